@@ -1,48 +1,60 @@
 import os
-import openai
-from openai import OpenAI
+import re
+import time
+import asyncio
+import numpy as np
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import cache
+import imaging
+import metrics
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY", "demo_key"))
+# Report generation: "demo" uses the canned reports below, "llm" asks an
+# OpenAI-compatible chat model (OPENAI_BASE_URL points it at another server)
+REPORT_GENERATION = os.getenv("REPORT_GENERATION", "demo")
+REPORT_MODEL = os.getenv("DEFAULT_MODEL", "gpt-4o")
+REPORT_TEMPERATURE = float(os.getenv("TEMPERATURE", "0.1"))
+REPORT_MAX_TOKENS = int(os.getenv("MAX_TOKENS", "2000"))
 
-class AIService:
-    def __init__(self):
-        # For demo purposes, we'll simulate AI analysis
-        # In production, this would integrate with actual medical AI models
-        pass
+_openai_client = None
 
-    async def generate_report(self, image_url: str, study_type: str):
-        """Generate medical report using AI analysis"""
-        try:
-            # Demo analysis - in production this would analyze the actual image
-            demo_reports = {
-                "chest_xray": {
-                    "findings": "The heart size is normal. The lung fields are clear bilaterally. No pleural effusion or pneumothorax is observed. The bony structures appear intact.",
-                    "impression": "Normal chest X-ray. No acute cardiopulmonary process.",
-                    "confidence": 0.85
-                },
-                "brain_mri": {
-                    "findings": "The brain parenchyma demonstrates normal signal intensity. No mass lesions or abnormal enhancement identified. The ventricular system is normal in size and configuration.",
-                    "impression": "Normal brain MRI study.",
-                    "confidence": 0.90
-                },
-                "abdominal_ct": {
-                    "findings": "The liver, spleen, kidneys, and pancreas demonstrate normal attenuation and morphology. No bowel obstruction or free fluid. No suspicious masses identified.",
-                    "impression": "Normal abdominal CT scan.",
-                    "confidence": 0.88
-                },
-                "general": {
-                    "findings": "Image quality is adequate for interpretation. No acute abnormalities detected.",
-                    "impression": "Study appears within normal limits.",
-                    "confidence": 0.75
-                }
-            }
-            
-            # Get demo report for the study type
-            report = demo_reports.get(study_type.lower(), demo_reports["general"])
-            
-            # Format the response
-            response = f"""
+def get_openai_client():
+    """Async OpenAI client, imported and built on first use (the demo path never needs it)"""
+    global _openai_client
+    if _openai_client is None:
+        from openai import AsyncOpenAI
+        _openai_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY", "demo_key"),
+            base_url=os.getenv("OPENAI_BASE_URL") or None
+        )
+    return _openai_client
+
+DEMO_REPORTS = {
+    "chest_xray": {
+        "findings": "The heart size is normal. The lung fields are clear bilaterally. No pleural effusion or pneumothorax is observed. The bony structures appear intact.",
+        "impression": "Normal chest X-ray. No acute cardiopulmonary process.",
+        "confidence": 0.85
+    },
+    "brain_mri": {
+        "findings": "The brain parenchyma demonstrates normal signal intensity. No mass lesions or abnormal enhancement identified. The ventricular system is normal in size and configuration.",
+        "impression": "Normal brain MRI study.",
+        "confidence": 0.90
+    },
+    "abdominal_ct": {
+        "findings": "The liver, spleen, kidneys, and pancreas demonstrate normal attenuation and morphology. No bowel obstruction or free fluid. No suspicious masses identified.",
+        "impression": "Normal abdominal CT scan.",
+        "confidence": 0.88
+    },
+    "general": {
+        "findings": "Image quality is adequate for interpretation. No acute abnormalities detected.",
+        "impression": "Study appears within normal limits.",
+        "confidence": 0.75
+    }
+}
+
+def demo_report(study_type: str) -> str:
+    """Canned report text for a study type"""
+    report = DEMO_REPORTS.get(study_type.lower(), DEMO_REPORTS["general"])
+    return f"""
 MEDICAL IMAGE ANALYSIS REPORT
 ============================
 
@@ -58,47 +70,277 @@ CONFIDENCE SCORE: {report['confidence']:.1%}
 
 DISCLAIMER: This is an AI-assisted analysis for educational purposes only. 
 All findings must be reviewed and validated by a qualified medical professional.
-            """.strip()
-            
-            return response
-            
-        except Exception as e:
-            # Return a basic error report if analysis fails
-            return f"""
-MEDICAL IMAGE ANALYSIS REPORT
-============================
+    """.strip()
 
-Study Type: {study_type.replace('_', ' ').title()}
+REPORT_SYSTEM_PROMPT = (
+    "You are a radiology teaching assistant drafting reports for students. "
+    "Write a report with a FINDINGS section and an IMPRESSION section, then a "
+    "CONFIDENCE SCORE and a disclaimer that the analysis is for educational "
+    "purposes only and must be reviewed by a qualified medical professional."
+)
 
-FINDINGS:
-Unable to complete automated analysis due to technical issues.
+def report_messages(study_type: str, description: str = None) -> List[Dict[str, str]]:
+    prompt = f"Study type: {study_type.replace('_', ' ')}."
+    if description:
+        prompt += f"\nClinical notes: {description}"
+    return [
+        {"role": "system", "content": REPORT_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
 
-IMPRESSION:
-Manual review required.
+# Image quality features
+#
+# Quality metrics are measured on the full-resolution grayscale image, since
+# downsampling averages away the noise and blur they look for; the filters
+# run over bands of rows so memory stays bounded for large images. Draft
+# annotations work on the fixed (N, 256, 256) analysis stack. Everything
+# runs inside the image process pool, so the API event loop never does
+# pixel work.
 
-CONFIDENCE SCORE: 0.0%
+HISTOGRAM_BINS = 32
+LOW_DYNAMIC_RANGE = 0.2
+BLUR_LAPLACIAN_VARIANCE = 0.0015
+NOISE_SIGMA = 0.08
+CLIPPED_FRACTION = 0.05
+FEATURE_BAND_ROWS = 512
 
-NOTE: Please consult with a qualified radiologist for proper interpretation.
-            """.strip()
+def _filter_sums(image: np.ndarray) -> Tuple[float, float, float, int]:
+    """Sum and sum of squares of the 4-neighbour Laplacian, and the summed
+    Immerkaer noise mask magnitude, over bands of rows with a one-row halo"""
+    height = image.shape[0]
+    laplacian_sum = laplacian_squares = noise_sum = 0.0
+    count = 0
+    for start in range(1, height - 1, FEATURE_BAND_ROWS):
+        stop = min(start + FEATURE_BAND_ROWS, height - 1)
+        x = image[start - 1:stop + 1].astype(np.float32) / 255.0
+        center = x[1:-1, 1:-1]
+        laplacian = x[:-2, 1:-1] + x[2:, 1:-1] + x[1:-1, :-2] + x[1:-1, 2:] - 4 * center
+        mask = (
+            x[:-2, :-2] - 2 * x[:-2, 1:-1] + x[:-2, 2:]
+            - 2 * x[1:-1, :-2] + 4 * center - 2 * x[1:-1, 2:]
+            + x[2:, :-2] - 2 * x[2:, 1:-1] + x[2:, 2:]
+        )
+        laplacian_sum += float(laplacian.sum(dtype=np.float64))
+        laplacian_squares += float(np.square(laplacian, dtype=np.float64).sum())
+        noise_sum += float(np.abs(mask).sum(dtype=np.float64))
+        count += laplacian.size
+    return laplacian_sum, laplacian_squares, noise_sum, count
 
-    async def analyze_image_features(self, image_data: bytes):
-        """Analyze image features for AI processing"""
-        # This would implement actual computer vision analysis
-        # For now, return simulated analysis results
-        return {
-            "regions_of_interest": [],
-            "anatomical_structures": [],
-            "potential_findings": [],
-            "image_quality": "adequate"
-        }
+def quality_features(image: np.ndarray) -> Dict[str, Any]:
+    """Histogram, contrast, dynamic range, noise, blur and clipping of one 8-bit image"""
+    image = imaging.to_grayscale(image)
+    height, width = image.shape
+    pixels_per_image = height * width
 
-    async def generate_annotations(self, image_data: bytes):
-        """Generate image annotations"""
-        # This would generate bounding boxes and annotations
-        return {
-            "annotations": [],
+    # Intensity statistics all follow from the exact 256-level histogram
+    histogram = np.bincount(image.ravel(), minlength=256)
+    fractions = histogram / pixels_per_image
+    levels = np.arange(256) / 255.0
+    cdf = np.cumsum(fractions)
+    p1 = np.argmax(cdf >= 0.01) / 255.0
+    p99 = np.argmax(cdf >= 0.99) / 255.0
+    coarse = fractions.reshape(HISTOGRAM_BINS, -1).sum(axis=1)
+    mean = float((fractions * levels).sum())
+    rms_contrast = float(np.sqrt((fractions * (levels - mean) ** 2).sum()))
+
+    # Blur: variance of the Laplacian; noise: Immerkaer's fast estimate
+    laplacian_sum, laplacian_squares, noise_sum, count = _filter_sums(image)
+    if count:
+        sharpness = laplacian_squares / count - (laplacian_sum / count) ** 2
+        noise = noise_sum * np.sqrt(np.pi / 2) / (6.0 * (width - 2) * (height - 2))
+    else:
+        sharpness = noise = 0.0
+
+    underexposed = fractions[0]
+    overexposed = fractions[255]
+    dynamic_range = p99 - p1
+
+    flags = []
+    if underexposed > CLIPPED_FRACTION:
+        flags.append("underexposed")
+    if overexposed > CLIPPED_FRACTION:
+        flags.append("overexposed")
+    if dynamic_range < LOW_DYNAMIC_RANGE:
+        flags.append("low_contrast")
+    if sharpness < BLUR_LAPLACIAN_VARIANCE:
+        flags.append("blurred")
+    if noise > NOISE_SIGMA:
+        flags.append("noisy")
+    return {
+        "regions_of_interest": [],
+        "anatomical_structures": [],
+        "potential_findings": [],
+        "image_quality": flags[0] if flags else "adequate",
+        "quality_flags": flags,
+        "metrics": {
+            "mean_intensity": round(mean, 4),
+            "rms_contrast": round(rms_contrast, 4),
+            "dynamic_range": round(float(dynamic_range), 4),
+            "percentile_1": round(float(p1), 4),
+            "percentile_99": round(float(p99), 4),
+            "noise_sigma": round(float(noise), 5),
+            "laplacian_variance": round(float(sharpness), 6),
+            "clipped_low": round(float(underexposed), 4),
+            "clipped_high": round(float(overexposed), 4)
+        },
+        "histogram": np.round(coarse, 5).tolist()
+    }
+
+def annotate_batch(batch: np.ndarray) -> List[Dict[str, Any]]:
+    """Draft bounding boxes around the brightest 1% of each image"""
+    # This would generate bounding boxes and annotations
+    n, height, width = batch.shape
+    threshold = np.percentile(batch.reshape(n, -1), 99, axis=1)[:, None, None]
+    mask = (batch >= threshold) & (batch > batch.mean(axis=(1, 2), keepdims=True))
+    rows = mask.any(axis=2)
+    cols = mask.any(axis=1)
+    found = rows.any(axis=1)
+    top = rows.argmax(axis=1)
+    bottom = height - rows[:, ::-1].argmax(axis=1)
+    left = cols.argmax(axis=1)
+    right = width - cols[:, ::-1].argmax(axis=1)
+
+    results = []
+    for i in range(n):
+        annotations = []
+        if found[i]:
+            annotations.append({
+                "type": "bounding_box",
+                "label": "high_intensity_region",
+                "status": "draft",
+                "box": {
+                    "x": round(left[i] / width, 4),
+                    "y": round(top[i] / height, 4),
+                    "width": round((right[i] - left[i]) / width, 4),
+                    "height": round((bottom[i] - top[i]) / height, 4)
+                }
+            })
+        results.append({
+            "annotations": annotations,
             "segmentations": [],
             "measurements": []
+        })
+    return results
+
+def analyze_image_files(paths: List[str]) -> Dict[str, Any]:
+    """Process-pool entry point: full-resolution features per file, then annotations over one stack.
+
+    An image that fails to decode leaves a blank slot and its error message
+    at the same index. Timings cover decoding as well as analysis and are
+    normalised by the source images' size.
+    """
+    started = time.perf_counter()
+    size = imaging.ANALYSIS_SIZE
+    batch = np.zeros((len(paths), size, size), dtype=np.uint8)
+    features: List[Optional[Dict[str, Any]]] = [None] * len(paths)
+    errors: List[Optional[str]] = [None] * len(paths)
+    source_pixels = 0
+    for i, path in enumerate(paths):
+        try:
+            image = imaging.to_grayscale(imaging.load_pixels(path))
+        except Exception as e:
+            # The message would name server paths; details stay in the log
+            print(f"Could not decode {path}: {e}")
+            errors[i] = "Could not decode image"
+            continue
+        source_pixels += image.size
+        features[i] = quality_features(image)
+        batch[i] = imaging.to_analysis_frame(image, size)
+    annotations = annotate_batch(batch)
+    return {
+        "features": features,
+        "annotations": annotations,
+        "errors": errors,
+        "seconds": time.perf_counter() - started,
+        "megapixels": source_pixels / 1e6
+    }
+
+class FeatureTimings:
+    """Running totals of feature-extraction time, for sizing hardware"""
+
+    def __init__(self):
+        self.calls = 0
+        self.megapixels = 0.0
+        self.seconds = 0.0
+
+    def record(self, megapixels: float, seconds: float):
+        self.calls += 1
+        self.megapixels += megapixels
+        self.seconds += seconds
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "megapixels": round(self.megapixels, 4),
+            "seconds": round(self.seconds, 6),
+            "ms_per_megapixel": round(self.seconds * 1000 / self.megapixels, 3) if self.megapixels else None
         }
 
+class AIService:
+    def __init__(self):
+        # For demo purposes, we'll simulate AI analysis
+        # In production, this would integrate with actual medical AI models
+        # Bump AI_MODEL_VERSION whenever the model or prompts change; cached
+        # results are keyed by it
+        self.model_version = os.getenv("AI_MODEL_VERSION", "demo-1")
+        self.feature_timings = FeatureTimings()
+
+    @metrics.track_ai()
+    async def generate_report_cached(self, content_hash: str, image_url: str, study_type: str):
+        """Generate a report, reusing a cached one for the same image bytes and study type"""
+        cached = await cache.analysis_cache.get(content_hash, study_type, self.model_version)
+        if cached is not None:
+            return cached
+        report = await self.generate_report(image_url, study_type)
+        if report:
+            await cache.analysis_cache.set(content_hash, study_type, self.model_version, report)
+        return report
+
+    @metrics.track_ai()
+    async def generate_report(self, image_url: str, study_type: str, description: str = None):
+        """Generate medical report using AI analysis.
+
+        Model errors propagate, so callers never cache or store a failed
+        report as if it were a result.
+        """
+        if REPORT_GENERATION != "llm":
+            # Demo analysis - in production this would analyze the actual image
+            return demo_report(study_type)
+        return "".join([text async for text in self.stream_report(image_url, study_type, description)])
+
+    @metrics.track_ai()
+    async def stream_report(self, image_url: str, study_type: str, description: str = None) -> AsyncIterator[str]:
+        """Yield report text as the model produces it.
+
+        Stopping the iteration (or cancelling the task consuming it) closes
+        the upstream HTTP response, which ends generation on the server.
+        """
+        if REPORT_GENERATION != "llm":
+            for token in re.findall(r"\S+\s*", demo_report(study_type)):
+                yield token
+                await asyncio.sleep(0)
+            return
+        stream = await get_openai_client().chat.completions.create(
+            model=REPORT_MODEL,
+            messages=report_messages(study_type, description),
+            temperature=REPORT_TEMPERATURE,
+            max_tokens=REPORT_MAX_TOKENS,
+            stream=True
+        )
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Shielded so the connection is released even while being cancelled
+            await asyncio.shield(stream.response.aclose())
+
+    @metrics.track_ai()
+    async def analyze_files(self, paths: List[str]) -> Dict[str, Any]:
+        """Decode and analyze stored images as one stack in the image process pool"""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(imaging.get_process_pool(), analyze_image_files, paths)
+        self.feature_timings.record(result["megapixels"], result["seconds"])
+        return result
+
 ai_assistant = AIService()
@@ -0,0 +1,100 @@
+import os
+import asyncio
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+import database
+
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+
+_STOP = object()
+
+class AuditLogWriter:
+    """Buffers audit events in memory and writes them with insert_many.
+
+    A batch is written once it reaches batch_size events or flush_interval
+    seconds after its first event, whichever comes first. When the buffer is
+    full, log() waits for the writer to catch up instead of dropping events.
+    stop() drains and writes everything still buffered.
+    """
+
+    def __init__(self, maxsize: int = AUDIT_QUEUE_SIZE, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.failed = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        await self.queue.put(_STOP)
+        await self._task
+        self._task = None
+        remaining = []
+        while not self.queue.empty():
+            event = self.queue.get_nowait()
+            if event is not _STOP:
+                remaining.append(event)
+        await self._write(remaining)
+        self.queue = None
+
+    async def log(self, event: Dict[str, Any]):
+        """Queue an audit event; waits while the buffer is full"""
+        event.setdefault("timestamp", datetime.utcnow())
+        if self._task is None:
+            await self._write([event])
+            return
+        await self.queue.put(event)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await self.queue.get()
+            if event is _STOP:
+                return
+            batch = [event]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            await self._write(batch)
+            if stopping:
+                return
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        try:
+            await database.create_audit_logs(batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Failed to write {len(batch)} audit log entries: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+audit_log = AuditLogWriter()
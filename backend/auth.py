@@ -1,13 +1,74 @@
 import os
-from datetime import datetime, timedelta
+import time
+import asyncio
+import hashlib
+import hmac
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from jose import jwt, JWTError
+from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from typing import List
+from pydantic import ValidationError
+from typing import Any, Dict, List, Optional, Tuple
+from cache import LRUCache
+import database
+import schemas
 
 SECRET_KEY = os.getenv("SECRET_KEY", "med_secret_key_123")
 ALGORITHM = "HS256"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+REVOCATION_REFRESH_INTERVAL = float(os.getenv("REVOCATION_REFRESH_INTERVAL", "30"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Hashes made with a different cost are flagged by verify_and_update, so
+# changing BCRYPT_ROUNDS migrates users as they log in
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event
+# loop and caps how many cores logins can take at once
+_hash_executor: Optional[ThreadPoolExecutor] = None
+
+def get_hash_executor() -> ThreadPoolExecutor:
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return _hash_executor
+
+def shutdown_hash_executor():
+    global _hash_executor
+    if _hash_executor is not None:
+        _hash_executor.shutdown(wait=False, cancel_futures=True)
+        _hash_executor = None
+
+async def _run_hashing(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_hash_executor(), func, *args)
+
+async def hash_password(password: str) -> str:
+    """Hash a password with the configured bcrypt cost"""
+    return await _run_hashing(pwd_context.hash, password)
+
+async def verify_password(password: str, user: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
+    """Check a password against a user record.
+
+    Returns (valid, new_hash); new_hash is set when the stored hash should be
+    replaced, either because the cost changed or because the record still
+    holds a legacy plaintext password. Pass user=None to spend the same time
+    as a real check on an unknown account.
+    """
+    if not user:
+        await _run_hashing(pwd_context.dummy_verify)
+        return False, None
+    if user.get("hashed_password"):
+        return await _run_hashing(pwd_context.verify_and_update, password, user["hashed_password"])
+    legacy = user.get("password")
+    if legacy is None or not hmac.compare_digest(legacy.encode(), password.encode()):
+        await _run_hashing(pwd_context.dummy_verify)
+        return False, None
+    return True, await hash_password(password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -15,15 +76,94 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def decode_token(token: str) -> dict:
+    """Verify a token and return its payload; raises JWTError if invalid"""
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+def token_digest(token: str) -> str:
+    """Key for a token in the principal cache and the revocation set"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+class TokenVerifier:
+    """Verifies access tokens, caching the resulting principal per token.
+
+    Cached principals never outlive the token's own exp. Revoked token
+    digests are mirrored from the revoked_tokens collection and checked on
+    every request, cache hit or not; a revocation made by another worker
+    takes effect here within one refresh interval.
+    """
+
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: int = PRINCIPAL_CACHE_TTL,
+                 refresh_interval: float = REVOCATION_REFRESH_INTERVAL):
+        self.principals = LRUCache(maxsize, ttl)
+        self.revoked: Dict[str, float] = {}
+        self.refresh_interval = refresh_interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.refresh()
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def refresh(self):
+        """Reload the revocation set, keeping local revocations not yet expired"""
+        stored = await database.get_revoked_tokens()
+        now = time.time()
+        revoked = {digest: exp for digest, exp in self.revoked.items() if exp > now}
+        for digest, expires_at in stored.items():
+            revoked[digest] = expires_at.replace(tzinfo=timezone.utc).timestamp()
+            self.principals.delete(digest)
+        self.revoked = revoked
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Failed to refresh revoked tokens: {e}")
+
+    def verify(self, token: str) -> schemas.Principal:
+        """Return the principal for a valid token; raises JWTError otherwise"""
+        digest = token_digest(token)
+        if digest in self.revoked:
+            raise JWTError("Token has been revoked")
+        principal = self.principals.get(digest)
+        if principal is None:
+            try:
+                principal = schemas.Principal(**decode_token(token))
+            except ValidationError:
+                raise JWTError("Malformed token claims")
+            remaining = principal.exp.timestamp() - time.time()
+            if remaining > 0:
+                self.principals.set(digest, principal, ttl=min(self.principals.ttl, remaining))
+        return principal
+
+    async def revoke(self, token: str):
+        """Revoke a token everywhere until it expires"""
+        principal = self.verify(token)
+        digest = token_digest(token)
+        exp = principal.exp.timestamp()
+        await database.revoke_token(digest, datetime.utcfromtimestamp(exp))
+        self.revoked[digest] = exp
+        self.principals.delete(digest)
+
+token_verifier = TokenVerifier()
+
 class RoleChecker:
     def __init__(self, allowed_roles: List[str]):
         self.allowed_roles = allowed_roles
 
-    def __call__(self, token: str = Depends(oauth2_scheme)):
+    async def __call__(self, token: str = Depends(oauth2_scheme)) -> schemas.Principal:
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            if payload.get("role") not in self.allowed_roles:
-                raise HTTPException(status_code=403, detail="Insufficient permissions")
-            return payload
+            principal = token_verifier.verify(token)
         except JWTError:
-            raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+            raise HTTPException(status_code=401, detail="Invalid token")
+        if principal.role not in self.allowed_roles:
+            raise HTTPException(status_code=403, detail="Insufficient permissions")
+        return principal
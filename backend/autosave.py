@@ -0,0 +1,291 @@
+import os
+import asyncio
+import weakref
+from uuid import uuid4
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+import database
+import versioning
+import audit
+
+AUTOSAVE_WINDOW = float(os.getenv("AUTOSAVE_WINDOW", "5.0"))
+# A report's lock is held across workers for at most LOCK_TTL seconds; a
+# request gives up after waiting LOCK_WAIT seconds for it
+LOCK_TTL = 30.0
+LOCK_WAIT = 10.0
+
+class AutosaveConflict(Exception):
+    """Raised when an autosave is based on a version that is no longer current.
+
+    unsaved carries the text of edits that were accepted earlier but could
+    not be written, so the editor can re-apply them to the current version.
+    """
+
+    def __init__(self, current_version: int, unsaved: Optional[Dict[str, str]] = None):
+        super().__init__(f"Report has moved on to version {current_version}")
+        self.current_version = current_version
+        self.unsaved = unsaved
+
+def apply_char_delta(text: Optional[str], ops: List[list]) -> str:
+    """Apply editor ops to text: ["=", n] keep, ["-", n] drop, ["+", s] insert.
+
+    The keep and drop counts must cover the old text exactly; raises
+    ValueError otherwise.
+    """
+    text = text or ""
+    position = 0
+    parts = []
+    for op in ops:
+        if len(op) != 2:
+            raise ValueError("Each delta op must be [op, value]")
+        kind, value = op
+        if kind in ("=", "-"):
+            if not isinstance(value, int) or value < 0 or position + value > len(text):
+                raise ValueError("Delta does not match the base text")
+            if kind == "=":
+                parts.append(text[position:position + value])
+            position += value
+        elif kind == "+" and isinstance(value, str):
+            parts.append(value)
+        else:
+            raise ValueError(f"Unknown delta op {kind!r}")
+    if position != len(text):
+        raise ValueError("Delta does not match the base text")
+    return "".join(parts)
+
+class AutosaveSession:
+    """Unsaved edits to one report from one editor of one user"""
+
+    def __init__(self, report_id: str, editor: str, user_id: str, report: Dict[str, Any], window: float):
+        self.report_id = report_id
+        self.editor = editor
+        self.user_id = user_id
+        self.stored_version = report.get("version", 1)
+        self.fields = {field: report.get(field) for field in versioning.TEXT_FIELDS}
+        self.changed: set = set()
+        self.patches = 0
+        self.flush_at = datetime.utcnow() + timedelta(seconds=window)
+
+    @classmethod
+    def from_document(cls, doc: Dict[str, Any]) -> "AutosaveSession":
+        session = cls.__new__(cls)
+        session.report_id = doc["_id"]
+        session.editor = doc["editor"]
+        session.user_id = doc["user_id"]
+        session.stored_version = doc["stored_version"]
+        session.fields = doc["fields"]
+        session.changed = set(doc["changed"])
+        session.patches = doc["patches"]
+        session.flush_at = doc["flush_at"]
+        return session
+
+    def to_document(self) -> Dict[str, Any]:
+        return {
+            "_id": self.report_id,
+            "editor": self.editor,
+            "user_id": self.user_id,
+            "stored_version": self.stored_version,
+            "fields": self.fields,
+            "changed": sorted(self.changed),
+            "patches": self.patches,
+            "flush_at": self.flush_at,
+        }
+
+    @property
+    def owner(self) -> tuple:
+        return (self.user_id, self.editor)
+
+    @property
+    def version(self) -> int:
+        """Version the report will have once the pending edits are written"""
+        return self.stored_version + 1 if self.changed else self.stored_version
+
+def unsaved_key(report_id: str, user_id: str, editor: str) -> str:
+    # Report and user ids are hex, so only the editor id can contain the separator
+    return f"{report_id}:{user_id}:{editor}"
+
+class ReportAutosaver:
+    """Coalesces autosave deltas per report into one write per time window.
+
+    The first delta of a window loads the report and opens a session; later
+    deltas from the same editor are applied to it. When the window closes,
+    the merged text is written with a conditional update on the version it
+    was based on, together with one history entry and one audit entry. A
+    delta from a different editor first flushes the pending session, so its
+    base version is checked against what is really stored.
+    An editor is the (user, editor_id) pair: editor ids come from clients,
+    so two users picking the same one are still different editors.
+    If a write fails or its base version has moved on, the edits are set
+    aside and that editor's next delta gets a conflict carrying the unsaved
+    text instead of the edits being lost.
+    Sessions are kept in Mongo (autosave_sessions) and changed under a
+    per-report lock (autosave_locks), so consecutive deltas may land on
+    different API workers. The worker that opened a window flushes it on
+    time; every worker also sweeps for windows left overdue by a worker
+    that stopped.
+    """
+
+    def __init__(self, window: float = AUTOSAVE_WINDOW):
+        self.window = window
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._flushes: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def _lock(self, report_id: str) -> asyncio.Lock:
+        lock = self._locks.get(report_id)
+        if lock is None:
+            lock = self._locks[report_id] = asyncio.Lock()
+        return lock
+
+    @asynccontextmanager
+    async def _report_lock(self, report_id: str):
+        """Hold a report's session exclusively, within this process and across workers"""
+        async with self._lock(report_id):
+            owner = uuid4().hex
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + LOCK_WAIT
+            while not await database.acquire_autosave_lock(report_id, owner, LOCK_TTL):
+                if loop.time() > deadline:
+                    raise RuntimeError("Report is busy, try again")
+                await asyncio.sleep(0.02)
+            try:
+                yield
+            finally:
+                await asyncio.shield(database.release_autosave_lock(report_id, owner))
+
+    async def apply(self, report_id: str, editor: str, user_id: str,
+                    base_version: int, deltas: Dict[str, List[list]]) -> Optional[Dict[str, Any]]:
+        """Apply deltas made against base_version.
+
+        Returns the version the edits will be saved as, or None if the report
+        does not exist; raises AutosaveConflict on a stale base and
+        ValueError on a delta that does not apply.
+        """
+        unknown = set(deltas) - set(versioning.TEXT_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot autosave fields: {', '.join(sorted(unknown))}")
+        async with self._report_lock(report_id):
+            unsaved = await database.take_unsaved_autosave(unsaved_key(report_id, user_id, editor))
+            if unsaved is not None:
+                report = await database.get_report_by_id(report_id)
+                if report is None:
+                    return None
+                raise AutosaveConflict(report.get("version", 1), unsaved["fields"])
+            doc = await database.get_autosave_session(report_id)
+            session = AutosaveSession.from_document(doc) if doc else None
+            if session is not None and session.owner != (user_id, editor):
+                await self._flush_locked(session)
+                session = None
+            if session is None:
+                report = await database.get_report_by_id(report_id)
+                if report is None:
+                    return None
+                session = AutosaveSession(report_id, editor, user_id, report, self.window)
+            if base_version != session.version:
+                raise AutosaveConflict(session.version)
+            updated = {field: apply_char_delta(session.fields.get(field), ops) for field, ops in deltas.items()}
+            for field, text in updated.items():
+                if text != session.fields.get(field):
+                    session.fields[field] = text
+                    session.changed.add(field)
+            session.patches += 1
+            if session.changed:
+                await database.save_autosave_session(session.to_document())
+                self._schedule_timer(report_id, session.flush_at)
+            flush_in = max(0.0, (session.flush_at - datetime.utcnow()).total_seconds())
+            return {"version": session.version, "pending": bool(session.changed), "flush_in": round(flush_in, 3)}
+
+    def _schedule_timer(self, report_id: str, flush_at: datetime):
+        if report_id in self._timers:
+            return
+        delay = max(0.0, (flush_at - datetime.utcnow()).total_seconds())
+        self._timers[report_id] = asyncio.get_running_loop().call_later(delay, self._schedule_flush, report_id)
+
+    def _schedule_flush(self, report_id: str):
+        self._timers.pop(report_id, None)
+        task = asyncio.create_task(self.flush(report_id, due_only=True))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self, report_id: str, due_only: bool = False):
+        """Write a report's pending edits now (with due_only, only once their window has closed)"""
+        async with self._report_lock(report_id):
+            doc = await database.get_autosave_session(report_id)
+            if doc is None:
+                return
+            session = AutosaveSession.from_document(doc)
+            if due_only and session.flush_at > datetime.utcnow():
+                # A later window opened after the one this timer was for
+                self._schedule_timer(report_id, session.flush_at)
+                return
+            await self._flush_locked(session)
+
+    async def _flush_locked(self, session: AutosaveSession):
+        timer = self._timers.pop(session.report_id, None)
+        if timer is not None:
+            timer.cancel()
+        update = {field: session.fields[field] for field in session.changed}
+        update["updated_at"] = datetime.utcnow()
+        try:
+            entry = await versioning.update_report(
+                session.report_id, update, session.user_id, expected_version=session.stored_version
+            )
+        except Exception as e:
+            print(f"Autosave of report {session.report_id} failed: {e}")
+            entry = None
+        if entry is None:
+            # Kept for the editor's next delta, which is answered with a conflict carrying the text
+            await database.save_unsaved_autosave({
+                "_id": unsaved_key(session.report_id, *session.owner),
+                "fields": {field: session.fields[field] for field in session.changed},
+                "failed_at": datetime.utcnow(),
+            })
+        # Removed only after the write, so a worker stopping in between cannot lose the edits
+        await database.delete_autosave_session(session.report_id)
+        if entry is None:
+            return
+        await audit.audit_log.log({
+            "user_id": session.user_id,
+            "action": "autosave_report",
+            "resource_type": "report",
+            "resource_id": session.report_id,
+            "timestamp": datetime.utcnow(),
+            "details": {"version": entry["version"], "changed": entry["changed"], "patches": session.patches}
+        })
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Autosave sweep failed: {e}")
+
+    async def sweep(self) -> int:
+        """Flush sessions a full window overdue, whose worker stopped before flushing them"""
+        overdue = await database.due_autosave_sessions(datetime.utcnow() - timedelta(seconds=self.window))
+        for report_id in overdue:
+            await self.flush(report_id, due_only=True)
+        return len(overdue)
+
+    async def stop(self):
+        """Write the sessions this worker is timing (called on shutdown)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for report_id in list(self._timers):
+            await self.flush(report_id)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+report_autosaver = ReportAutosaver()
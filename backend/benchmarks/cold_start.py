@@ -0,0 +1,77 @@
+"""Cold start to first served request.
+
+Starts a fresh uvicorn worker per trial and times (a) importing main in a
+clean interpreter and (b) process spawn until GET /health first answers 200.
+Needs a reachable MongoDB (MONGO_URI) for (b).
+
+    python benchmarks/cold_start.py --trials 5 --index-mode background
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import statistics
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def import_time(env) -> float:
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+def time_to_first_request(env, timeout: float) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited: {server.stderr.read().decode()[-2000:]}")
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health", timeout=0.5).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                pass
+            time.sleep(0.01)
+        raise TimeoutError("Server did not answer within the timeout")
+    finally:
+        server.terminate()
+        server.wait()
+
+def summarize(samples):
+    return {
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "min_ms": round(min(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--index-mode", default="background", choices=["background", "blocking", "off"])
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--skip-server", action="store_true", help="only measure the import of main")
+    args = parser.parse_args()
+
+    env = dict(os.environ, INDEX_BUILD_MODE=args.index_mode)
+    result = {"index_mode": args.index_mode, "trials": args.trials}
+    result["import_main"] = summarize([import_time(env) for _ in range(args.trials)])
+    if not args.skip_server:
+        result["first_request"] = summarize([time_to_first_request(env, args.timeout) for _ in range(args.trials)])
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Encode time and payload size of list responses, per 1,000 rows.
+
+Compares the old path (whole documents in an untyped PaginatedResponse,
+serialized by FastAPI's jsonable_encoder + json.dumps) with projected
+documents validated into the typed page models and dumped by pydantic-core.
+
+    python benchmarks/list_serialization.py --rows 1000
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+import database
+import schemas
+
+HISTORY = ("Hypertension managed with ACE inhibitor. Prior appendectomy. "
+           "Family history of coronary artery disease. No known drug allergies. ") * 8
+FINDINGS = "Lungs are clear bilaterally. No pleural effusion or pneumothorax. Heart size is normal. " * 4
+
+def patient_document(i: int) -> dict:
+    doc = {
+        "_id": ObjectId(),
+        "patient_id": f"MRN-{i:07d}",
+        "first_name": random.choice(["John", "Maria", "Wei", "Fatima"]),
+        "last_name": random.choice(["Smith", "Garcia", "Chen", "Khan"]),
+        "date_of_birth": datetime(1960, 1, 1) + timedelta(days=i),
+        "gender": random.choice(["male", "female"]),
+        "medical_history": HISTORY,
+        "created_by": "user-1",
+        "created_at": datetime.utcnow() - timedelta(minutes=i),
+    }
+    doc.update(database.patient_search_fields(doc))
+    return doc
+
+def report_document(i: int) -> dict:
+    return {
+        "_id": ObjectId(),
+        "patient_id": f"MRN-{i:07d}",
+        "image_id": str(ObjectId()),
+        "study_type": "chest_xray",
+        "findings": FINDINGS,
+        "impression": "No acute cardiopulmonary process.",
+        "status": "draft",
+        "version": 3,
+        "created_by": "user-1",
+        "created_at": datetime.utcnow() - timedelta(minutes=i),
+    }
+
+def project(doc: dict, projection: dict) -> dict:
+    """What Mongo returns for a model_projection"""
+    projected = {"id": str(doc["_id"])}
+    for field, value in projection.items():
+        if value == 1 and field in doc:
+            projected[field] = doc[field]
+    return projected
+
+def old_path(docs) -> bytes:
+    items = [database.with_string_id(dict(doc)) for doc in docs]
+    response = schemas.PaginatedResponse(success=True, data=items, total=len(items), page=1,
+                                         per_page=len(items), has_next=False, has_prev=False)
+    return json.dumps(jsonable_encoder(response)).encode()
+
+def new_path(docs, projection, page_model, exclude=None) -> bytes:
+    items = [project(doc, projection) for doc in docs]
+    page = page_model(success=True, data=items, total=len(items), page=1,
+                      per_page=len(items), has_next=False, has_prev=False)
+    return page.model_dump_json(exclude={"data": {"__all__": exclude}} if exclude else None).encode()
+
+def measure(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = func()
+        best = min(best, time.perf_counter() - start)
+    return best, len(body)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    cases = {
+        "patients": ([patient_document(i) for i in range(args.rows)],
+                     database.PATIENT_LIST_PROJECTION, schemas.PatientPage, database.PATIENT_LIST_EXCLUDE),
+        "reports": ([report_document(i) for i in range(args.rows)],
+                    database.REPORT_LIST_PROJECTION, schemas.ReportPage, None),
+    }
+    results = {}
+    for name, (docs, projection, page_model, exclude) in cases.items():
+        old_time, old_size = measure(lambda: old_path(docs), args.repeat)
+        new_time, new_size = measure(lambda: new_path(docs, projection, page_model, exclude), args.repeat)
+        results[name] = {
+            "rows": args.rows,
+            "old_ms": round(old_time * 1000, 2),
+            "new_ms": round(new_time * 1000, 2),
+            "old_bytes": old_size,
+            "new_bytes": new_size,
+        }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
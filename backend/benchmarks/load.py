@@ -0,0 +1,349 @@
+"""Throughput and latency of the main API paths under concurrent load.
+
+Drives the FastAPI app in-process through httpx.AsyncClient (ASGITransport)
+with database.py pointed at the in-memory stand-in from memory_db.py, so a
+run needs no MongoDB or OpenAI key and is repeatable on any machine. Each
+scenario is run at every requested concurrency level and reports
+throughput, p50/p95/p99 latency and error rate as JSON.
+
+    python benchmarks/load.py --concurrency 1,8,32 --requests 200 \\
+        --output load-results.json --thresholds benchmarks/load_thresholds.json \\
+        --baseline previous-load-results.json --tolerance 0.25
+
+The process exits with status 1 when a result breaks an absolute threshold
+or is worse than the baseline run by more than the tolerance, so it can
+gate a deploy. Note that ASGITransport returns only once the app call
+finishes, so background tasks (derivative generation after an upload) are
+included in the measured latency.
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import asyncio
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+SCENARIOS = ("login", "list_patients", "patient_view", "upload", "analyze", "update_report")
+SEED_PATIENTS = 500
+SEED_REPORTS = 50
+PASSWORD = "benchmark-password"
+
+def configure_environment(args):
+    """Settings that modules read at import time"""
+    os.environ["UPLOAD_DIR"] = args.upload_dir
+    os.environ["INDEX_BUILD_MODE"] = "blocking"
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    # Measure the submit path rather than rejections from a full queue
+    os.environ.setdefault("ANALYSIS_QUEUE_SIZE", str(max(args.requests + args.warmup, 100)))
+
+def install_memory_database(latency: float):
+    import database
+    from benchmarks.memory_db import MemoryDatabase
+
+    async def connect_db(cls):
+        cls.db = MemoryDatabase(latency)
+        await cls.initialize_collections()
+
+    async def close_db(cls):
+        cls.db = None
+
+    database.Database.connect_db = classmethod(connect_db)
+    database.Database.close_db = classmethod(close_db)
+
+def png_bytes(seed: int, size: int = 64) -> bytes:
+    """A small grayscale PNG that differs for every seed"""
+    import numpy as np
+    from PIL import Image
+    pixels = np.random.default_rng(seed).integers(0, 256, (size, size), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels, mode="L").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def check(response) -> bool:
+    """2xx and, for APIResponse bodies, success (failures are returned as 200)"""
+    if response.status_code >= 300:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    return not isinstance(body, dict) or body.get("success", True) is not False
+
+class Context:
+    def __init__(self, client, token: str, patient_ids, report_ids):
+        self.client = client
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.patient_ids = patient_ids
+        self.report_ids = report_ids
+        self.email = "bench@example.com"
+
+async def seed(client) -> Context:
+    response = await client.post("/auth/register", json={
+        "email": "bench@example.com", "password": PASSWORD,
+        "first_name": "Bench", "last_name": "Mark", "role": "instructor"
+    })
+    assert check(response), response.text
+    response = await client.post("/auth/login", json={"email": "bench@example.com", "password": PASSWORD})
+    assert check(response), response.text
+    token = response.json()["data"]["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    rng = random.Random(42)
+    patient_ids = []
+    for i in range(SEED_PATIENTS):
+        patient_id = f"MRN-{i:07d}"
+        response = await client.post("/patients/", headers=headers, json={
+            "patient_id": patient_id,
+            "first_name": rng.choice(["John", "Maria", "Wei", "Fatima", "Olu"]),
+            "last_name": rng.choice(["Smith", "Garcia", "Chen", "Khan", "Adeyemi"]),
+            "gender": rng.choice(["male", "female"]),
+            "medical_history": "Hypertension managed with ACE inhibitor. No known drug allergies."
+        })
+        assert check(response), response.text
+        patient_ids.append(patient_id)
+
+    report_ids = []
+    for i in range(SEED_REPORTS):
+        response = await client.post("/reports/", headers=headers, json={
+            "patient_id": patient_ids[i],
+            "image_id": f"image-{i}",
+            "study_type": "chest_xray",
+            "findings": "Lungs are clear bilaterally. No pleural effusion or pneumothorax.",
+            "impression": "No acute cardiopulmonary process."
+        })
+        assert check(response), response.text
+        report_ids.append(response.json()["data"]["report_id"])
+    return Context(client, token, patient_ids, report_ids)
+
+# Scenarios: one request each, i is the request's sequence number
+
+async def login(ctx: Context, i: int):
+    return await ctx.client.post("/auth/login", json={"email": ctx.email, "password": PASSWORD})
+
+async def list_patients(ctx: Context, i: int):
+    return await ctx.client.get("/patients/", params={"limit": 50}, headers=ctx.headers)
+
+async def patient_view(ctx: Context, i: int):
+    """What the viewer loads for a patient: the record's images and reports"""
+    patient_id = ctx.patient_ids[i % len(ctx.report_ids)]
+    images, reports = await asyncio.gather(
+        ctx.client.get(f"/images/patient/{patient_id}", headers=ctx.headers),
+        ctx.client.get(f"/reports/patient/{patient_id}", headers=ctx.headers)
+    )
+    return images if not check(images) else reports
+
+async def upload(ctx: Context, i: int):
+    return await ctx.client.post(
+        "/images/upload", headers=ctx.headers,
+        data={"patient_id": ctx.patient_ids[i % len(ctx.patient_ids)], "study_type": "chest_xray"},
+        files={"file": (f"upload-{i}.png", png_bytes(1_000_000 + i), "image/png")}
+    )
+
+async def analyze(ctx: Context, i: int):
+    return await ctx.client.post(
+        "/analyze", headers=ctx.headers,
+        data={"study_type": "chest_xray"},
+        files={"file": (f"analyze-{i}.png", png_bytes(2_000_000 + i), "image/png")}
+    )
+
+async def update_report(ctx: Context, i: int):
+    return await ctx.client.put(
+        f"/reports/{ctx.report_ids[i % len(ctx.report_ids)]}", headers=ctx.headers,
+        json={"findings": f"Lungs are clear bilaterally. Revision {i}. No pleural effusion."}
+    )
+
+SCENARIO_FUNCTIONS = {
+    "login": login,
+    "list_patients": list_patients,
+    "patient_view": patient_view,
+    "upload": upload,
+    "analyze": analyze,
+    "update_report": update_report,
+}
+
+def percentile(sorted_samples, fraction: float) -> float:
+    """Nearest-rank percentile"""
+    index = max(0, min(len(sorted_samples) - 1, round(fraction * len(sorted_samples) + 0.5) - 1))
+    return sorted_samples[index]
+
+async def run_scenario(ctx: Context, name: str, concurrency: int, requests: int, warmup: int, offset: int):
+    scenario = SCENARIO_FUNCTIONS[name]
+    for i in range(warmup):
+        await scenario(ctx, offset + i)
+    offset += warmup
+
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                ok = check(await scenario(ctx, offset + i))
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "error_rate": round(errors / requests, 4),
+    }
+
+def check_thresholds(results, thresholds):
+    """Absolute limits per scenario.
+
+    {"scenario": {"default": {...}, "<concurrency>": {...}}} where each limit
+    set may hold p50_ms, p95_ms, p99_ms, min_rps and max_error_rate (0 if
+    omitted); a concurrency entry overrides the defaults at that level.
+    """
+    failures = []
+    for name, by_concurrency in results.items():
+        scenario_limits = thresholds.get(name, {})
+        for concurrency, result in by_concurrency.items():
+            limits = {**scenario_limits.get("default", {}), **scenario_limits.get(concurrency, {})}
+            label = f"{name}@{concurrency}"
+            for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                if metric in limits and result[metric] > limits[metric]:
+                    failures.append(f"{label}: {metric} {result[metric]} > {limits[metric]}")
+            if "min_rps" in limits and result["throughput_rps"] < limits["min_rps"]:
+                failures.append(f"{label}: throughput {result['throughput_rps']} < {limits['min_rps']}")
+            if result["error_rate"] > limits.get("max_error_rate", 0):
+                failures.append(f"{label}: error rate {result['error_rate']} > {limits.get('max_error_rate', 0)}")
+    return failures
+
+def compare_baseline(results, baseline, tolerance: float):
+    """Relative limits: latency up or throughput down by more than tolerance.
+
+    p99 is left out: over a few hundred requests it is one or two samples
+    and too noisy to compare between runs.
+    """
+    failures = []
+    for name, by_concurrency in results.items():
+        for concurrency, result in by_concurrency.items():
+            previous = baseline.get("results", {}).get(name, {}).get(concurrency)
+            if previous is None:
+                continue
+            label = f"{name}@{concurrency}"
+            for metric in ("p50_ms", "p95_ms"):
+                if result[metric] > previous[metric] * (1 + tolerance):
+                    failures.append(f"{label}: {metric} {result[metric]} vs baseline {previous[metric]}")
+            if result["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+                failures.append(f"{label}: throughput {result['throughput_rps']} vs baseline {previous['throughput_rps']}")
+    return failures
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+async def run(args):
+    install_memory_database(args.db_latency_ms / 1000)
+    import httpx
+    from main import app
+
+    random.seed(42)
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            ctx = await seed(client)
+            results = {}
+            for name in args.scenarios:
+                results[name] = {}
+                for n, concurrency in enumerate(args.concurrency):
+                    result = await run_scenario(ctx, name, concurrency, args.requests, args.warmup,
+                                                offset=n * (args.requests + args.warmup))
+                    results[name][str(concurrency)] = result
+                    print(f"{name:>14} c={concurrency:<4} {result['throughput_rps']:>8.1f} req/s  "
+                          f"p50 {result['p50_ms']:>8.2f}  p95 {result['p95_ms']:>8.2f}  "
+                          f"p99 {result['p99_ms']:>8.2f} ms  errors {result['error_rate']:.2%}",
+                          file=sys.stderr)
+    finally:
+        await app.router.shutdown()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario and level")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="Simulated round trip per database call")
+    parser.add_argument("--bcrypt-rounds", type=int, default=int(os.getenv("BCRYPT_ROUNDS", "12")))
+    parser.add_argument("--output", help="Write results JSON here (default: stdout)")
+    parser.add_argument("--thresholds", help="JSON file of absolute per-scenario limits")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown vs the baseline")
+    args = parser.parse_args()
+    args.scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+
+    with tempfile.TemporaryDirectory(prefix="bench-uploads-") as upload_dir:
+        args.upload_dir = upload_dir
+        configure_environment(args)
+        results = asyncio.run(run(args))
+
+    failures = []
+    if args.thresholds:
+        with open(args.thresholds) as f:
+            failures += check_thresholds(results, json.load(f))
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += compare_baseline(results, json.load(f), args.tolerance)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "db_latency_ms": args.db_latency_ms,
+            "bcrypt_rounds": args.bcrypt_rounds,
+        },
+        "results": results,
+        "regressions": failures,
+        "passed": not failures,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""In-memory stand-in for the Motor database used by the benchmarks.
+
+Implements the subset of the collection API that database.py calls: find /
+find_one / count_documents / distinct with the query operators the app
+uses, inserts, updates (including upserts and find_one_and_update/delete),
+bulk_write, deletes, and aggregation with $match, $sort, $limit, $skip,
+$project, $facet, $count and $group. Results are pymongo's own result classes. Documents are copied on
+the way in and out, as a BSON round trip would.
+
+Indexes are recorded but not used; the only unique constraint enforced is
+the one on _id.
+Every operation awaits an optional fixed latency to stand in for the network
+round trip to a real server.
+"""
+import re
+import copy
+import asyncio
+import itertools
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from pymongo.results import (
+    BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+)
+
+_MISSING = object()
+
+def get_path(doc: Dict[str, Any], path: str):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+def _regex(condition: Dict[str, Any]):
+    pattern = condition["$regex"]
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+    return re.compile(pattern, flags)
+
+def _compare(value, other, op) -> bool:
+    try:
+        return op(value, other)
+    except TypeError:
+        return False
+
+def _candidates(value) -> List[Any]:
+    """A field matches if it or (for arrays) any of its elements does"""
+    if isinstance(value, list):
+        return [value] + value
+    return [value]
+
+def _match_operator(value, op: str, operand, condition: Dict[str, Any]) -> bool:
+    present = value is not _MISSING
+    if op == "$exists":
+        return present == bool(operand)
+    if op == "$options":
+        return True
+    if op == "$ne":
+        return not _match_operator(value, "$eq", operand, condition)
+    if op == "$nin":
+        return not _match_operator(value, "$in", operand, condition)
+    if op == "$all":
+        return present and isinstance(value, list) and all(item in value for item in operand)
+    if not present:
+        return op == "$eq" and operand is None or op == "$in" and None in operand
+    candidates = _candidates(value)
+    if op == "$eq":
+        return operand in candidates
+    if op == "$in":
+        return any(item in candidates for item in operand)
+    if op == "$regex":
+        pattern = _regex(condition)
+        return any(isinstance(item, str) and pattern.search(item) for item in candidates)
+    comparisons = {
+        "$gt": lambda a, b: a > b,
+        "$gte": lambda a, b: a >= b,
+        "$lt": lambda a, b: a < b,
+        "$lte": lambda a, b: a <= b,
+    }
+    if op in comparisons:
+        return any(_compare(item, operand, comparisons[op]) for item in candidates)
+    raise NotImplementedError(f"Query operator {op} is not supported in memory")
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, sub) for sub in condition):
+                return False
+        elif key.startswith("$"):
+            raise NotImplementedError(f"Query operator {key} is not supported in memory")
+        else:
+            value = get_path(doc, key)
+            if isinstance(condition, re.Pattern):
+                condition = {"$regex": condition}
+            if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+                if not all(_match_operator(value, op, operand, condition) for op, operand in condition.items()):
+                    return False
+            elif not _match_operator(value, "$eq", condition, {}):
+                return False
+    return True
+
+def _sort_key(value):
+    # Missing and null sort first, as in MongoDB
+    return (0, 0) if value is _MISSING or value is None else (1, value)
+
+def sort_documents(docs: List[Dict[str, Any]], sort) -> List[Dict[str, Any]]:
+    if isinstance(sort, dict):
+        sort = list(sort.items())
+    docs = list(docs)
+    for key, direction in reversed(sort):
+        docs.sort(key=lambda doc: _sort_key(get_path(doc, key)), reverse=direction == -1)
+    return docs
+
+def _evaluate(doc: Dict[str, Any], expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = get_path(doc, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict) and "$toString" in expression:
+        value = _evaluate(doc, expression["$toString"])
+        return None if value is None else str(value)
+    raise NotImplementedError(f"Expression {expression!r} is not supported in memory")
+
+def project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return copy.deepcopy(doc)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    inclusive = any(not isinstance(value, (int, bool)) or value for value in fields.values())
+    if inclusive:
+        result = {}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        for key, value in fields.items():
+            if isinstance(value, (int, bool)):
+                if key in doc:
+                    result[key] = copy.deepcopy(doc[key])
+            else:
+                result[key] = _evaluate(doc, value)
+        return result
+    result = {key: copy.deepcopy(value) for key, value in doc.items() if key not in fields}
+    if projection.get("_id", 1) == 0:
+        result.pop("_id", None)
+    return result
+
+def _group(docs: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    groups: Dict[Any, Dict[str, Any]] = {}
+    for doc in docs:
+        key = _evaluate(doc, spec["_id"]) if spec["_id"] is not None else None
+        group = groups.setdefault(key, {"_id": key})
+        for name, accumulator in spec.items():
+            if name == "_id":
+                continue
+            if set(accumulator) != {"$sum"}:
+                raise NotImplementedError(f"Accumulator {accumulator!r} is not supported in memory")
+            operand = accumulator["$sum"]
+            amount = operand if isinstance(operand, (int, float)) else (_evaluate(doc, operand) or 0)
+            group[name] = group.get(name, 0) + amount
+    return list(groups.values())
+
+def run_pipeline(docs: List[Dict[str, Any]], pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [doc for doc in docs if matches(doc, spec)]
+        elif name == "$sort":
+            docs = sort_documents(docs, spec)
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$project":
+            docs = [project(doc, spec) for doc in docs]
+        elif name == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        elif name == "$group":
+            docs = _group(docs, spec)
+        elif name == "$facet":
+            docs = [{key: run_pipeline(docs, sub) for key, sub in spec.items()}]
+        else:
+            raise NotImplementedError(f"Aggregation stage {name} is not supported in memory")
+    return docs
+
+def apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserting: bool = False):
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for key, value in fields.items():
+            if op in ("$set", "$setOnInsert"):
+                doc[key] = copy.deepcopy(value)
+            elif op == "$unset":
+                doc.pop(key, None)
+            elif op == "$inc":
+                doc[key] = doc.get(key, 0) + value
+            elif op == "$currentDate":
+                doc[key] = datetime.utcnow()
+            elif op == "$push":
+                doc.setdefault(key, []).append(copy.deepcopy(value))
+            else:
+                raise NotImplementedError(f"Update operator {op} is not supported in memory")
+
+def _upsert_document(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Seed an upserted document with the equality fields of its filter"""
+    return {key: copy.deepcopy(value) for key, value in query.items()
+            if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))}
+
+class MemoryCursor:
+    """Lazy find/aggregate cursor: sort, limit and batch_size chain like Motor's"""
+
+    def __init__(self, collection: "MemoryCollection", produce):
+        self.collection = collection
+        self._produce = produce
+        self._sort = None
+        self._limit = 0
+        self._results: Optional[List[Dict[str, Any]]] = None
+
+    def sort(self, key_or_list, direction: Optional[int] = None) -> "MemoryCursor":
+        self._sort = [(key_or_list, direction or 1)] if isinstance(key_or_list, str) else key_or_list
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size: int) -> "MemoryCursor":
+        return self
+
+    def _evaluate(self) -> List[Dict[str, Any]]:
+        if self._results is None:
+            self._results = self._produce(self._sort, self._limit)
+        return self._results
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        await self.collection.database.round_trip()
+        results = self._evaluate()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await self.collection.database.round_trip()
+        for doc in self._evaluate():
+            yield doc
+
+    async def close(self):
+        self._results = []
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.documents: Dict[Any, Dict[str, Any]] = {}
+        self.indexes: List[str] = ["_id_"]
+
+    def _select(self, query: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        query = query or {}
+        if set(query) == {"_id"} and not isinstance(query["_id"], dict):
+            doc = self.documents.get(query["_id"])
+            return [doc] if doc is not None else []
+        return [doc for doc in self.documents.values() if matches(doc, query)]
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None) -> MemoryCursor:
+        def produce(sort, limit):
+            docs = self._select(query)
+            if sort:
+                docs = sort_documents(docs, sort)
+            if limit:
+                docs = docs[:limit]
+            return [project(doc, projection) for doc in docs]
+        return MemoryCursor(self, produce)
+
+    async def find_one(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None):
+        await self.database.round_trip()
+        docs = self._select(query)
+        return project(docs[0], projection) if docs else None
+
+    async def count_documents(self, query: Dict[str, Any]) -> int:
+        await self.database.round_trip()
+        return len(self._select(query))
+
+    async def distinct(self, key: str, query: Optional[Dict[str, Any]] = None) -> List[Any]:
+        await self.database.round_trip()
+        values = []
+        for doc in self._select(query):
+            value = get_path(doc, key)
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not _MISSING and item not in values:
+                    values.append(item)
+        return values
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> MemoryCursor:
+        return MemoryCursor(self, lambda sort, limit: run_pipeline(list(self.documents.values()), pipeline))
+
+    def _insert(self, document: Dict[str, Any]):
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self.documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error: _id {document['_id']!r}")
+        self.documents[document["_id"]] = copy.deepcopy(document)
+        return document["_id"]
+
+    async def insert_one(self, document: Dict[str, Any]) -> InsertOneResult:
+        await self.database.round_trip()
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True) -> InsertManyResult:
+        await self.database.round_trip()
+        return InsertManyResult([self._insert(doc) for doc in documents], True)
+
+    def _update(self, query, update, upsert: bool, many: bool) -> Dict[str, Any]:
+        docs = self._select(query)
+        if not many:
+            docs = docs[:1]
+        for doc in docs:
+            apply_update(doc, update)
+        result = {"n": len(docs), "nModified": len(docs)}
+        if not docs and upsert:
+            doc = _upsert_document(query)
+            apply_update(doc, update, inserting=True)
+            result.update(n=1, upserted=self._insert(doc))
+        return result
+
+    async def update_one(self, query, update, upsert: bool = False) -> UpdateResult:
+        await self.database.round_trip()
+        return UpdateResult(self._update(query, update, upsert, many=False), True)
+
+    async def update_many(self, query, update, upsert: bool = False) -> UpdateResult:
+        await self.database.round_trip()
+        return UpdateResult(self._update(query, update, upsert, many=True), True)
+
+    async def replace_one(self, query, replacement: Dict[str, Any], upsert: bool = False) -> UpdateResult:
+        await self.database.round_trip()
+        docs = self._select(query)
+        if docs:
+            replacement = {**copy.deepcopy(replacement), "_id": docs[0]["_id"]}
+            self.documents[docs[0]["_id"]] = replacement
+            return UpdateResult({"n": 1, "nModified": 1}, True)
+        if upsert:
+            doc = {**_upsert_document(query), **replacement}
+            return UpdateResult({"n": 1, "nModified": 0, "upserted": self._insert(doc)}, True)
+        return UpdateResult({"n": 0, "nModified": 0}, True)
+
+    async def find_one_and_update(self, query, update, upsert: bool = False,
+                                  return_document=ReturnDocument.BEFORE, projection=None, sort=None):
+        await self.database.round_trip()
+        docs = self._select(query)
+        if sort:
+            docs = sort_documents(docs, sort)
+        if not docs:
+            if upsert:
+                doc = _upsert_document(query)
+                apply_update(doc, update, inserting=True)
+                self._insert(doc)
+                return project(doc, projection) if return_document == ReturnDocument.AFTER else None
+            return None
+        before = project(docs[0], projection)
+        apply_update(docs[0], update)
+        return before if return_document == ReturnDocument.BEFORE else project(docs[0], projection)
+
+    async def find_one_and_delete(self, query, projection=None):
+        await self.database.round_trip()
+        docs = self._select(query)
+        if not docs:
+            return None
+        return project(self.documents.pop(docs[0]["_id"]), projection)
+
+    async def delete_one(self, query: Dict[str, Any]) -> DeleteResult:
+        await self.database.round_trip()
+        docs = self._select(query)[:1]
+        for doc in docs:
+            del self.documents[doc["_id"]]
+        return DeleteResult({"n": len(docs)}, True)
+
+    async def delete_many(self, query: Dict[str, Any]) -> DeleteResult:
+        await self.database.round_trip()
+        docs = self._select(query)
+        for doc in docs:
+            del self.documents[doc["_id"]]
+        return DeleteResult({"n": len(docs)}, True)
+
+    async def bulk_write(self, requests, ordered: bool = True) -> BulkWriteResult:
+        await self.database.round_trip()
+        matched = 0
+        for request in requests:
+            # pymongo's UpdateOne keeps its arguments in private attributes
+            result = self._update(request._filter, request._doc, request._upsert, many=False)
+            matched += result["n"]
+        return BulkWriteResult({"nMatched": matched, "nModified": matched, "upserted": []}, True)
+
+    def list_indexes(self) -> MemoryCursor:
+        return MemoryCursor(self, lambda sort, limit: [{"name": name} for name in self.indexes])
+
+    async def create_indexes(self, models) -> List[str]:
+        await self.database.round_trip()
+        names = [model.document["name"] for model in models]
+        self.indexes.extend(names)
+        return names
+
+class MemoryDatabase:
+    """Collections created on first access, like a Motor database"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.collections: Dict[str, MemoryCollection] = {}
+        self.operations = itertools.count()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.collections[name] = MemoryCollection(self, name)
+        return collection
+
+    async def round_trip(self):
+        next(self.operations)
+        await asyncio.sleep(self.latency)
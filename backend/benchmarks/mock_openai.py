@@ -0,0 +1,91 @@
+"""Local OpenAI-compatible chat completions server for exercising report streaming.
+
+Streams a canned report word by word after a configurable first-token delay
+and counts streams that finish versus streams the client abandoned, so
+cancellation can be checked from outside (GET /stats).
+
+    python benchmarks/mock_openai.py --port 8001 --first-token-ms 400 --token-ms 25
+
+Then run the API with REPORT_GENERATION=llm,
+OPENAI_BASE_URL=http://127.0.0.1:8001/v1 and any OPENAI_API_KEY.
+"""
+import re
+import json
+import time
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+REPORT = (
+    "FINDINGS:\nThe heart size is normal. The lung fields are clear bilaterally. "
+    "No pleural effusion or pneumothorax is observed. The bony structures appear intact.\n\n"
+    "IMPRESSION:\nNormal chest X-ray. No acute cardiopulmonary process.\n\n"
+    "CONFIDENCE SCORE: 85.0%\n\n"
+    "DISCLAIMER: This is an AI-assisted analysis for educational purposes only. "
+    "All findings must be reviewed and validated by a qualified medical professional."
+)
+
+def create_app(first_token_delay: float = 0.4, token_delay: float = 0.025) -> FastAPI:
+    app = FastAPI(title="Mock OpenAI")
+    app.state.stats = {"requests": 0, "streams_completed": 0, "streams_cancelled": 0}
+    tokens = re.findall(r"\S+\s*", REPORT)
+
+    def chunk(model: str, delta: dict, finish_reason=None) -> bytes:
+        body = {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(body)}\n\n".encode()
+
+    async def stream(model: str):
+        stats = app.state.stats
+        try:
+            await asyncio.sleep(first_token_delay)
+            yield chunk(model, {"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(token_delay)
+                yield chunk(model, {"content": token})
+            yield chunk(model, {}, "stop")
+            yield b"data: [DONE]\n\n"
+            stats["streams_completed"] += 1
+        except (asyncio.CancelledError, GeneratorExit):
+            stats["streams_cancelled"] += 1
+            raise
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.stats["requests"] += 1
+        model = body.get("model", "mock")
+        if body.get("stream"):
+            return StreamingResponse(stream(model), media_type="text/event-stream")
+        await asyncio.sleep(first_token_delay + token_delay * (len(tokens) - 1))
+        return JSONResponse({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": REPORT}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+        })
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    return app
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--first-token-ms", type=float, default=400)
+    parser.add_argument("--token-ms", type=float, default=25)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.first_token_ms / 1000, args.token_ms / 1000), host=args.host, port=args.port)
@@ -0,0 +1,87 @@
+"""Login password-check throughput and latency.
+
+Runs N concurrent logins through auth.verify_password on the hashing
+executor and reports throughput, p50/p99 latency and the worst event-loop
+stall seen meanwhile (which should stay near zero).
+
+    python benchmarks/password_hashing.py --rounds 12 --concurrency 32 --logins 200
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+async def loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """Largest delay seen between when a timer should fire and when it did"""
+    worst = 0.0
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        worst = max(worst, loop.time() - expected)
+    return worst
+
+async def run(args) -> dict:
+    import auth
+
+    user = {"hashed_password": auth.pwd_context.hash("correct horse battery staple")}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def login():
+        async with semaphore:
+            start = time.perf_counter()
+            valid, _ = await auth.verify_password("correct horse battery staple", user)
+            latencies.append(time.perf_counter() - start)
+            assert valid
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(args.logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    worst_lag = await lag_task
+    auth.shutdown_hash_executor()
+
+    return {
+        "rounds": auth.BCRYPT_ROUNDS,
+        "workers": auth.PASSWORD_HASH_WORKERS,
+        "concurrency": args.concurrency,
+        "logins": args.logins,
+        "throughput_per_s": round(args.logins / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_loop_lag_ms": round(worst_lag * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--p99-budget-ms", type=float, default=None,
+                        help="exit non-zero if p99 latency exceeds this")
+    args = parser.parse_args()
+
+    # auth reads its settings at import time
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    if args.workers:
+        os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.p99_budget_ms is not None and result["p99_ms"] > args.p99_budget_ms:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
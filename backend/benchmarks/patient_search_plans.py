@@ -0,0 +1,106 @@
+"""Check that every patient search query shape is answered from an index.
+
+Seeds a scratch database with synthetic patients, builds the indexes from
+Database.initialize_collections, then explains each query shape that
+/patients/search can produce (both the page query and its count) and exits
+non-zero if any winning plan contains a COLLSCAN.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/patient_search_plans.py --patients 200000
+"""
+import os
+import sys
+import json
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+import database
+
+FIRST_NAMES = ["john", "maria", "wei", "fatima", "olga", "kwame", "lucia", "arjun", "emma", "noah"]
+LAST_NAMES = ["smith", "garcia", "chen", "khan", "ivanova", "mensah", "rossi", "patel", "brown", "jones"]
+
+def plan_stages(plan) -> list:
+    """Every stage name in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+async def seed(coll, count: int, users: int, batch: int = 5000):
+    now = datetime.utcnow()
+    for start in range(0, count, batch):
+        docs = []
+        for i in range(start, min(start + batch, count)):
+            doc = {
+                "patient_id": f"MRN-{i:07d}",
+                "first_name": random.choice(FIRST_NAMES).title(),
+                "last_name": random.choice(LAST_NAMES).title(),
+                "created_by": f"user-{i % users}",
+                "created_at": now - timedelta(minutes=i),
+            }
+            doc.update(database.patient_search_fields(doc))
+            docs.append(doc)
+        await coll.insert_many(docs, ordered=False)
+
+def query_shapes():
+    date_from = datetime.utcnow() - timedelta(days=30)
+    for created_by in ("user-1", None):
+        yield "list", dict(created_by=created_by)
+        yield "date range", dict(created_by=created_by, date_from=date_from)
+        for mode, search in (("prefix", "smi"), ("prefix", "mrn-00012"), ("substring", "arci"),
+                             ("substring", "n s"), ("text", "garcia")):
+            yield f"{mode} '{search}'", dict(search=search, mode=mode, created_by=created_by)
+            yield f"{mode} '{search}' + date range", dict(
+                search=search, mode=mode, created_by=created_by, date_from=date_from
+            )
+
+async def main(args) -> int:
+    client = AsyncIOMotorClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+    db = client[args.database]
+    database.Database.client = client
+    database.Database.db = db
+    try:
+        if args.patients:
+            await db.patients.drop()
+            await database.Database.initialize_collections()
+            await seed(db.patients, args.patients, args.users)
+        else:
+            await database.Database.initialize_collections()
+
+        failures = []
+        report = []
+        for name, params in query_shapes():
+            query = database.build_patient_search_query(**params)
+            shape = f"{name} ({'one user' if params.get('created_by') else 'all users'})"
+            find_plan = await db.patients.find(query).sort(database.KEYSET_SORT).limit(51).explain()
+            count_plan = await db.command("explain", {"count": "patients", "query": query}, verbosity="queryPlanner")
+            for kind, explained in (("find", find_plan), ("count", count_plan)):
+                stages = plan_stages(explained["queryPlanner"]["winningPlan"])
+                report.append({"shape": shape, "kind": kind, "stages": stages})
+                if "COLLSCAN" in stages:
+                    failures.append(f"{shape} [{kind}]")
+        print(json.dumps({"plans": report, "collscans": failures}, indent=2))
+        return 1 if failures else 0
+    finally:
+        if args.patients and not args.keep:
+            await client.drop_database(args.database)
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="medical_imaging_plan_check")
+    parser.add_argument("--patients", type=int, default=200000,
+                        help="synthetic patients to seed; 0 checks the existing collection as is")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch database afterwards")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,184 @@
+"""Time to first token of streamed report generation.
+
+Runs the API and the mock OpenAI server (mock_openai.py) in this process on
+real sockets, with the database replaced by the in-memory stand-in, and
+calls POST /reports/generate/{image_id}/stream at the given concurrency.
+Reports p50/p95 time to first token and to the complete report, then opens
+one more stream, drops it after the first token and checks that the mock
+server sees the upstream stream cancelled.
+
+    python benchmarks/report_streaming.py --requests 50 --concurrency 8 \\
+        --first-token-ms 400 --token-ms 25 --max-ttft-p95-ms 600
+
+Exits with status 1 if the p95 time to first token exceeds --max-ttft-p95-ms
+or the cancellation does not reach the model server.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from benchmarks.cold_start import free_port
+from benchmarks.load import install_memory_database, percentile, check
+from benchmarks.mock_openai import create_app
+
+async def serve(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+async def seed(client, requests: int):
+    """A user and one image record per request (distinct hashes, so no cache hits)"""
+    import database
+    credentials = {"email": "stream@example.com", "password": "benchmark-password"}
+    response = await client.post("/auth/register", json={
+        **credentials, "first_name": "Stream", "last_name": "Bench", "role": "instructor"
+    })
+    assert check(response), response.text
+    response = await client.post("/auth/login", json=credentials)
+    assert check(response), response.text
+    headers = {"Authorization": f"Bearer {response.json()['data']['access_token']}"}
+    image_ids = []
+    for i in range(requests):
+        image_ids.append(await database.create_medical_image({
+            "patient_id": "MRN-STREAM",
+            "study_type": "chest_xray",
+            "file_name": f"stream-{i}.png",
+            "content_hash": f"{i:064x}",
+            "uploaded_by": "bench",
+            "created_at": datetime.utcnow(),
+        }))
+    return headers, image_ids
+
+async def stream_once(client, headers, image_id: str, stop_after_first: bool = False):
+    """(time to first token, time to done) in seconds"""
+    started = time.perf_counter()
+    first = None
+    event = None
+    async with client.stream("POST", f"/reports/generate/{image_id}/stream", headers=headers) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event == "token" and first is None:
+                first = time.perf_counter() - started
+                if stop_after_first:
+                    return first, None
+            elif line.startswith("data: ") and event == "error":
+                raise RuntimeError(json.loads(line[len("data: "):])["message"])
+            elif line.startswith("data: ") and event == "done":
+                return first, time.perf_counter() - started
+    raise RuntimeError("Stream ended without a done event")
+
+async def run(args):
+    import httpx
+    install_memory_database(0.0)
+    from main import app
+
+    mock = create_app(args.first_token_ms / 1000, args.token_ms / 1000)
+    mock_server, mock_task = await serve(mock, args.mock_port)
+    api_server, api_task = await serve(app, free_port())
+    base_url = f"http://127.0.0.1:{api_server.config.port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            headers, image_ids = await seed(client, args.requests + 1)
+            first_tokens, totals, errors = [], [], 0
+            pending = iter(image_ids[:args.requests])
+
+            async def worker():
+                nonlocal errors
+                for image_id in pending:
+                    try:
+                        first, total = await stream_once(client, headers, image_id)
+                        first_tokens.append(first)
+                        totals.append(total)
+                    except Exception as e:
+                        errors += 1
+                        print(f"stream failed: {e}", file=sys.stderr)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+
+            # Drop a stream after its first token; the model server should see it go
+            cancelled_before = mock.state.stats["streams_cancelled"]
+            await stream_once(client, headers, image_ids[-1], stop_after_first=True)
+            dropped_at = time.perf_counter()
+            propagated_ms = None
+            while time.perf_counter() - dropped_at < 5:
+                if mock.state.stats["streams_cancelled"] > cancelled_before:
+                    propagated_ms = round((time.perf_counter() - dropped_at) * 1000, 1)
+                    break
+                await asyncio.sleep(0.005)
+    finally:
+        for server in (api_server, mock_server):
+            server.should_exit = True
+        await asyncio.gather(api_task, mock_task)
+
+    first_tokens.sort()
+    totals.sort()
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "throughput_rps": round(len(totals) / elapsed, 2),
+        "time_to_first_token_ms": {
+            "p50": round(percentile(first_tokens, 0.50) * 1000, 1),
+            "p95": round(percentile(first_tokens, 0.95) * 1000, 1),
+        } if first_tokens else None,
+        "total_ms": {
+            "p50": round(percentile(totals, 0.50) * 1000, 1),
+            "p95": round(percentile(totals, 0.95) * 1000, 1),
+        } if totals else None,
+        "mock_first_token_ms": args.first_token_ms,
+        "mock_token_ms": args.token_ms,
+        "cancellation_propagated_ms": propagated_ms,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--first-token-ms", type=float, default=400, help="Mock model latency to its first token")
+    parser.add_argument("--token-ms", type=float, default=25, help="Mock model delay between tokens")
+    parser.add_argument("--mock-port", type=int, default=0, help="Port for the mock model server (default: any free)")
+    parser.add_argument("--max-ttft-p95-ms", type=float, help="Fail if p95 time to first token is above this")
+    args = parser.parse_args()
+    args.mock_port = args.mock_port or free_port()
+
+    with tempfile.TemporaryDirectory(prefix="bench-uploads-") as upload_dir:
+        os.environ["UPLOAD_DIR"] = upload_dir
+        os.environ["INDEX_BUILD_MODE"] = "blocking"
+        os.environ["BCRYPT_ROUNDS"] = "4"
+        os.environ["REPORT_GENERATION"] = "llm"
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.mock_port}/v1"
+        os.environ["OPENAI_API_KEY"] = "mock"
+        result = asyncio.run(run(args))
+
+    failures = []
+    if result["errors"]:
+        failures.append(f"{result['errors']} streams failed")
+    if result["cancellation_propagated_ms"] is None:
+        failures.append("dropping the client stream did not cancel the model stream")
+    ttft = result["time_to_first_token_ms"]
+    if args.max_ttft_p95_ms is not None and (ttft is None or ttft["p95"] > args.max_ttft_p95_ms):
+        failures.append(f"p95 time to first token {ttft and ttft['p95']} ms > {args.max_ttft_p95_ms} ms")
+    result["regressions"] = failures
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
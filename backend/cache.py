@@ -0,0 +1,123 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Optional
+import database
+
+_MISSING = object()
+
+class LRUCache:
+    """Bounded in-process LRU with a per-entry TTL and hit/miss/eviction counters"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1024"))
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", "3600"))
+ANALYSIS_CACHE_MONGO_TTL = int(os.getenv("ANALYSIS_CACHE_MONGO_TTL", str(7 * 24 * 3600)))
+
+class AnalysisResultCache:
+    """Two-tier cache of analysis output keyed by (image digest, study type, model version).
+
+    The in-process LRU answers repeat requests on the same worker; the
+    analysis_cache collection (TTL-indexed on expires_at) shares results
+    across workers. Changing the model version changes every key, so stale
+    results are simply never looked up again.
+    """
+
+    def __init__(self, maxsize: int = ANALYSIS_CACHE_SIZE, ttl: int = ANALYSIS_CACHE_TTL,
+                 shared_ttl: int = ANALYSIS_CACHE_MONGO_TTL):
+        self.local = LRUCache(maxsize, ttl)
+        self.shared_ttl = shared_ttl
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @staticmethod
+    def make_key(content_hash: str, study_type: str, model_version: str) -> str:
+        return f"{content_hash}:{study_type.lower()}:{model_version}"
+
+    async def get(self, content_hash: str, study_type: str, model_version: str) -> Optional[Any]:
+        key = self.make_key(content_hash, study_type, model_version)
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        entry = await database.get_cached_analysis(key)
+        if entry is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        self.local.set(key, entry["result"])
+        return entry["result"]
+
+    async def set(self, content_hash: str, study_type: str, model_version: str, result: Any):
+        key = self.make_key(content_hash, study_type, model_version)
+        self.local.set(key, result)
+        await database.save_cached_analysis({
+            "_id": key,
+            "content_hash": content_hash,
+            "study_type": study_type.lower(),
+            "model_version": model_version,
+            "result": result,
+            "created_at": datetime.utcnow(),
+            "expires_at": datetime.utcnow() + timedelta(seconds=self.shared_ttl)
+        })
+
+    async def purge_other_versions(self, model_version: str) -> int:
+        """Drop shared entries written by other model versions"""
+        return await database.delete_cached_analyses_except(model_version)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "local": self.local.stats(),
+            "shared": {"hits": self.shared_hits, "misses": self.shared_misses},
+        }
+
+analysis_cache = AnalysisResultCache()
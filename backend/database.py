@@ -1,60 +1,168 @@
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 import os
+import json
+import base64
+import re
+import asyncio
 from dotenv import load_dotenv
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import IndexModel, UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import schemas
+import metrics
+import cache
 
 load_dotenv()
 
+# Declared indexes, reconciled against the database at startup
+#
+# INDEX_BUILD_MODE: "background" (default) serves requests while missing
+# indexes build, "blocking" waits for them before startup completes, "off"
+# leaves index management to deployment tooling.
+INDEX_BUILD_MODE = os.getenv("INDEX_BUILD_MODE", "background")
+
+INDEX_MANIFEST: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel("email", unique=True),
+        IndexModel("role"),
+    ],
+    "patients": [
+        IndexModel("patient_id", unique=True),
+        IndexModel("created_by"),
+        IndexModel("created_at"),
+        IndexModel([("created_by", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("created_at", -1), ("_id", -1)]),
+        IndexModel([("created_by", 1), ("search_terms", 1), ("created_at", -1)]),
+        IndexModel([("created_by", 1), ("search_grams", 1)]),
+        IndexModel("search_terms"),
+        IndexModel("search_grams"),
+        IndexModel(
+            [("patient_id", "text"), ("first_name", "text"), ("last_name", "text"), ("medical_history", "text")],
+            weights={"patient_id": 10, "first_name": 5, "last_name": 5, "medical_history": 1},
+            name="patient_text"
+        ),
+    ],
+    "medical_images": [
+        IndexModel("patient_id"),
+        IndexModel("uploaded_by"),
+        IndexModel("created_at"),
+        IndexModel("file_type"),
+        IndexModel("content_hash"),
+        IndexModel([("patient_id", 1), ("created_at", -1), ("_id", -1)]),
+    ],
+    "reports": [
+        IndexModel("patient_id"),
+        IndexModel("image_id"),
+        IndexModel("created_by"),
+        IndexModel("status"),
+        IndexModel("created_at"),
+        IndexModel([("patient_id", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("created_at", -1), ("_id", -1)]),
+        IndexModel([("created_by", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("status", 1), ("study_type", 1), ("created_at", -1), ("_id", -1)]),
+        IndexModel([("study_type", 1), ("created_at", -1), ("_id", -1)]),
+    ],
+    "report_versions": [
+        IndexModel([("report_id", 1), ("version", 1)], unique=True),
+    ],
+    # Autosave state shared by every API worker
+    "autosave_sessions": [
+        IndexModel("flush_at"),
+    ],
+    "autosave_locks": [
+        IndexModel("until", expireAfterSeconds=0),
+    ],
+    # Edits whose write failed wait an hour for their editor to come back for them
+    "autosave_unsaved": [
+        IndexModel("failed_at", expireAfterSeconds=3600),
+    ],
+    "analysis_jobs": [
+        IndexModel("user_id"),
+        IndexModel("created_at"),
+        IndexModel([("status", 1), ("updated_at", 1)]),
+        IndexModel("lease", sparse=True),
+    ],
+    # Expired entries are removed by the TTL monitor
+    "analysis_cache": [
+        IndexModel("expires_at", expireAfterSeconds=0),
+        IndexModel("model_version"),
+    ],
+    # Kept only until the token would have expired anyway
+    "revoked_tokens": [
+        IndexModel("expires_at", expireAfterSeconds=0),
+    ],
+    # Stamps only need to outlive a few metadata cache sync intervals
+    "cache_versions": [
+        IndexModel("updated_at", expireAfterSeconds=24 * 3600),
+    ],
+    "audit_logs": [
+        IndexModel("user_id"),
+        IndexModel("action"),
+        IndexModel("timestamp"),
+        IndexModel([("user_id", 1), ("timestamp", 1)]),
+    ],
+}
+
 class Database:
     client: AsyncIOMotorClient = None
     db: AsyncIOMotorDatabase = None
+    indexes_ready: bool = False
+    _index_task: Optional[asyncio.Task] = None
 
     @classmethod
     async def connect_db(cls):
         """Connect to MongoDB and initialize collections"""
-        cls.client = AsyncIOMotorClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+        cls.client = AsyncIOMotorClient(
+            os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+            event_listeners=[metrics.MongoCommandMetrics()]
+        )
         cls.db = cls.client.medical_imaging_db
         
-        # Initialize collections with indexes
-        await cls.initialize_collections()
+        # Build missing indexes now, after startup, or not at all (managed elsewhere)
+        if INDEX_BUILD_MODE == "blocking":
+            await cls.initialize_collections()
+        elif INDEX_BUILD_MODE == "background":
+            cls._index_task = asyncio.create_task(cls.initialize_collections())
 
     @classmethod
     async def close_db(cls):
         """Close MongoDB connection"""
+        if cls._index_task is not None and not cls._index_task.done():
+            cls._index_task.cancel()
         if cls.client:
             cls.client.close()
 
     @classmethod
-    async def initialize_collections(cls):
-        """Initialize database collections and indexes"""
-        # Users collection
-        await cls.db.users.create_index("email", unique=True)
-        await cls.db.users.create_index("role")
-        
-        # Patients collection
-        await cls.db.patients.create_index("patient_id", unique=True)
-        await cls.db.patients.create_index("created_by")
-        await cls.db.patients.create_index("created_at")
-        
-        # Medical images collection
-        await cls.db.medical_images.create_index("patient_id")
-        await cls.db.medical_images.create_index("uploaded_by")
-        await cls.db.medical_images.create_index("created_at")
-        await cls.db.medical_images.create_index("file_type")
-        
-        # Reports collection
-        await cls.db.reports.create_index("patient_id")
-        await cls.db.reports.create_index("image_id")
-        await cls.db.reports.create_index("created_by")
-        await cls.db.reports.create_index("status")
-        await cls.db.reports.create_index("created_at")
-        
-        # Audit logs collection
-        await cls.db.audit_logs.create_index("user_id")
-        await cls.db.audit_logs.create_index("action")
-        await cls.db.audit_logs.create_index("timestamp")
+    async def initialize_collections(cls) -> Dict[str, List[str]]:
+        """Create any index from INDEX_MANIFEST that the database does not have yet.
+
+        Existing indexes are read with list_indexes (one call per collection,
+        all in parallel) and only the missing ones are built, again in
+        parallel. Returns the names created per collection.
+        """
+        existing = await asyncio.gather(*(
+            cls.db[name].list_indexes().to_list(length=None) for name in INDEX_MANIFEST
+        ))
+        missing = {}
+        for (name, models), indexes in zip(INDEX_MANIFEST.items(), existing):
+            present = {index["name"] for index in indexes}
+            todo = [model for model in models if model.document["name"] not in present]
+            if todo:
+                missing[name] = todo
+        results = await asyncio.gather(
+            *(cls.db[name].create_indexes(models) for name, models in missing.items()),
+            return_exceptions=True
+        )
+        created = {}
+        for name, result in zip(missing, results):
+            if isinstance(result, Exception):
+                print(f"Failed to create indexes on {name}: {result}")
+            else:
+                created[name] = result
+        cls.indexes_ready = True
+        return created
 
     @classmethod
     def get_collection(cls, name: str):
@@ -66,6 +174,215 @@ class Database:
 # Database instance
 db = Database()
 
+# Keyset pagination
+#
+# List queries sort on (created_at, _id) descending and resume after the last
+# row of the previous page, so every page is one index range scan no matter
+# how deep it is. The cursor handed to clients is that last row's key,
+# base64url-encoded so it stays opaque.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+KEYSET_SORT = [("created_at", -1), ("_id", -1)]
+
+def model_projection(model, exclude=()) -> Dict[str, Any]:
+    """Projection returning just a response model's fields, with _id as a string id"""
+    projection: Dict[str, Any] = {"_id": 0, "id": {"$toString": "$_id"}}
+    for name in model.model_fields:
+        if name != "id" and name not in exclude:
+            projection[name] = 1
+    return projection
+
+# List queries fetch only what their response models serialize
+PATIENT_LIST_EXCLUDE = {"medical_history"}
+PATIENT_LIST_PROJECTION = model_projection(schemas.PatientResponse, exclude=PATIENT_LIST_EXCLUDE)
+IMAGE_LIST_PROJECTION = model_projection(schemas.MedicalImageResponse)
+REPORT_LIST_PROJECTION = model_projection(schemas.ReportResponse)
+
+class InvalidCursorError(ValueError):
+    """Raised for a pagination cursor that was not produced by encode_cursor"""
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    """Opaque token pointing just after a document in keyset order"""
+    key = json.dumps({"t": doc["created_at"].isoformat(), "i": doc["id"] if "id" in doc else str(doc["_id"])})
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor; raises ValueError on a malformed token"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(key["t"]), ObjectId(key["i"])
+    except Exception:
+        raise InvalidCursorError("Invalid pagination cursor")
+
+def with_string_id(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace the ObjectId _id with a string id for JSON responses"""
+    if "_id" in doc:
+        doc["id"] = str(doc.pop("_id"))
+    return doc
+
+def keyset_condition(cursor: str) -> Dict[str, Any]:
+    """Filter selecting the rows after a cursor in keyset order"""
+    created_at, last_id = decode_cursor(cursor)
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "_id": {"$lt": last_id}}
+    ]}
+
+async def find_page(
+    collection: str,
+    query: Dict[str, Any],
+    projection: Optional[Dict[str, Any]] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """One keyset page of a collection plus the total match count"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    page_query = {"$and": [query, keyset_condition(cursor)]} if cursor else query
+    coll = db.get_collection(collection)
+    find_cursor = coll.find(page_query, projection).sort(KEYSET_SORT).limit(limit + 1)
+    docs, total = await asyncio.gather(
+        find_cursor.to_list(length=limit + 1),
+        coll.count_documents(query)
+    )
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return {
+        "items": [with_string_id(doc) for doc in docs[:limit]],
+        "total": total,
+        "next_cursor": next_cursor
+    }
+
+# Metadata cache
+#
+# Patient records and per-patient image and report pages are read over and
+# over while a study is open. They are served from an in-process LRU per
+# entity type; writers invalidate the patient's entries here at once and
+# bump a stamp in cache_versions that every other worker polls.
+
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "2048"))
+METADATA_CACHE_TTL = {
+    "patient": float(os.getenv("PATIENT_CACHE_TTL", "300")),
+    "images": float(os.getenv("IMAGE_LIST_CACHE_TTL", "60")),
+    "reports": float(os.getenv("REPORT_LIST_CACHE_TTL", "30")),
+}
+METADATA_SYNC_INTERVAL = float(os.getenv("METADATA_CACHE_SYNC_INTERVAL", "2"))
+# Re-read stamps this far behind the newest one seen, so writes committed
+# out of timestamp order are not missed
+METADATA_SYNC_OVERLAP = timedelta(seconds=5)
+MAX_TRACKED_GENERATIONS = 100000
+
+_MISSING = object()
+
+class MetadataCache:
+    """Read-through cache keyed by (patient_id, generation, *args) per entity type.
+
+    Invalidating a patient bumps its local generation, so its old entries
+    can no longer be looked up and simply age out; a load that was already
+    in flight stores its result under the old generation and is never read.
+    The bump is recorded in cache_versions and other workers pick it up
+    within one sync interval; the TTLs bound staleness if syncing fails.
+    Cached values are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, maxsize: int = METADATA_CACHE_SIZE, ttls: Dict[str, float] = METADATA_CACHE_TTL,
+                 sync_interval: float = METADATA_SYNC_INTERVAL):
+        self.maxsize = maxsize
+        self.ttls = ttls
+        self.sync_interval = sync_interval
+        self._caches: Dict[str, "cache.LRUCache"] = {}
+        self._generations: Dict[Tuple[str, str], int] = {}
+        # Stamps read in the overlap window: (kind, patient_id) -> (version, updated_at)
+        self._stamps: Dict[Tuple[str, str], tuple] = {}
+        self._watermark: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _cache(self, kind: str) -> "cache.LRUCache":
+        lru = self._caches.get(kind)
+        if lru is None:
+            lru = self._caches[kind] = cache.LRUCache(self.maxsize, self.ttls[kind])
+        return lru
+
+    async def get(self, kind: str, patient_id: str, loader, *args):
+        """Cached value for (kind, patient_id, *args), loading it on a miss.
+
+        None results are not cached.
+        """
+        lru = self._cache(kind)
+        key = (patient_id, self._generations.get((kind, patient_id), 0)) + args
+        value = lru.get(key, _MISSING)
+        if value is _MISSING:
+            value = await loader()
+            if value is not None:
+                lru.set(key, value)
+        return value
+
+    def _bump(self, kind: str, patient_id: str):
+        if len(self._generations) >= MAX_TRACKED_GENERATIONS:
+            # Forgetting generations would make old entries reachable again
+            for lru in self._caches.values():
+                lru.clear()
+            self._generations.clear()
+        self._generations[(kind, patient_id)] = self._generations.get((kind, patient_id), 0) + 1
+
+    async def invalidate(self, kind: str, patient_id: Optional[str]):
+        """Drop a patient's cached entries here and announce it to other workers"""
+        if not patient_id:
+            return
+        self._bump(kind, patient_id)
+        stamp = await db.get_collection("cache_versions").find_one_and_update(
+            {"_id": f"{kind}:{patient_id}"},
+            {"$inc": {"version": 1}, "$currentDate": {"updated_at": True}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._stamps[(kind, patient_id)] = (stamp["version"], stamp["updated_at"])
+
+    async def sync(self):
+        """Apply invalidations other workers made since the last sync"""
+        coll = db.get_collection("cache_versions")
+        if self._watermark is None:
+            # Nothing is cached yet; only find where to start reading
+            latest = await coll.find({}, {"updated_at": 1}).sort("updated_at", -1).limit(1).to_list(length=1)
+            self._watermark = latest[0]["updated_at"] if latest else datetime.utcnow()
+            return
+        since = self._watermark - METADATA_SYNC_OVERLAP
+        async for stamp in coll.find({"updated_at": {"$gte": since}}):
+            kind, _, patient_id = stamp["_id"].partition(":")
+            key = (kind, patient_id)
+            seen = self._stamps.get(key)
+            if seen is None or seen[0] != stamp["version"]:
+                self._bump(kind, patient_id)
+                self._stamps[key] = (stamp["version"], stamp["updated_at"])
+            self._watermark = max(self._watermark, stamp["updated_at"])
+        since = self._watermark - METADATA_SYNC_OVERLAP
+        self._stamps = {key: seen for key, seen in self._stamps.items() if seen[1] >= since}
+
+    async def start(self):
+        await self.sync()
+        self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Failed to sync metadata cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "caches": {kind: lru.stats() for kind, lru in self._caches.items()},
+            "tracked_generations": len(self._generations),
+        }
+
+metadata_cache = MetadataCache()
+
 # Utility functions for MongoDB operations
 async def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     """Get user by email"""
@@ -79,51 +396,482 @@ async def create_user(user_data: Dict[str, Any]) -> str:
 
 async def get_patient_by_id(patient_id: str) -> Optional[Dict[str, Any]]:
     """Get patient by ID"""
-    patient = await db.get_collection("patients").find_one({"patient_id": patient_id})
-    return patient
+    return await metadata_cache.get(
+        "patient", patient_id, lambda: db.get_collection("patients").find_one({"patient_id": patient_id})
+    )
+
+# Patient search
+#
+# Names and IDs are stored lowercased in search_terms (for anchored prefix
+# regexes, which become tight index ranges) and as trigrams in search_grams
+# (for substring search, which would otherwise scan every key). Substring
+# matches are narrowed through the trigram index and then confirmed with a
+# regex on the few candidates.
+
+SEARCH_GRAM_SIZE = 3
+PATIENT_SEARCH_BACKFILL_BATCH = 1000
+
+def normalize_search_text(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+def search_grams(text: str) -> List[str]:
+    return sorted({text[i:i + SEARCH_GRAM_SIZE] for i in range(len(text) - SEARCH_GRAM_SIZE + 1)})
+
+def patient_search_fields(patient: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Derived search fields for a patient document"""
+    first = normalize_search_text(patient.get("first_name") or "")
+    last = normalize_search_text(patient.get("last_name") or "")
+    terms = {normalize_search_text(patient.get("patient_id") or ""), first, last,
+             f"{first} {last}".strip(), f"{last} {first}".strip()}
+    terms.discard("")
+    grams = set()
+    for term in terms:
+        grams.update(search_grams(term))
+    return {"search_terms": sorted(terms), "search_grams": sorted(grams)}
+
+def build_patient_search_query(
+    search: Optional[str] = None,
+    mode: str = "prefix",
+    created_by: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Mongo filter for a patient search; every shape is served by an index"""
+    query: Dict[str, Any] = {}
+    if created_by:
+        query["created_by"] = created_by
+    if date_from or date_to:
+        query["created_at"] = {}
+        if date_from:
+            query["created_at"]["$gte"] = date_from
+        if date_to:
+            query["created_at"]["$lte"] = date_to
+    term = normalize_search_text(search or "")
+    if not term:
+        return query
+    if mode == "text":
+        query["$text"] = {"$search": term}
+    elif mode == "substring" and len(term) >= SEARCH_GRAM_SIZE:
+        query["search_grams"] = {"$all": search_grams(term)}
+        query["search_terms"] = {"$regex": re.escape(term)}
+    else:
+        # Shorter substrings have no trigram to look up, so match them as prefixes
+        query["search_terms"] = {"$regex": "^" + re.escape(term)}
+    return query
+
+async def search_patients(
+    query: Dict[str, Any], limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """One page of patients matching a search query, newest first"""
+    return await find_page("patients", query, PATIENT_LIST_PROJECTION, limit, cursor)
+
+async def backfill_patient_search_fields(batch_size: int = PATIENT_SEARCH_BACKFILL_BATCH) -> int:
+    """Add search fields to patients created before they existed"""
+    coll = db.get_collection("patients")
+    updated = 0
+    while True:
+        docs = await coll.find(
+            {"search_terms": {"$exists": False}},
+            {"patient_id": 1, "first_name": 1, "last_name": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            return updated
+        await coll.bulk_write(
+            [UpdateOne({"_id": doc["_id"]}, {"$set": patient_search_fields(doc)}) for doc in docs],
+            ordered=False
+        )
+        updated += len(docs)
+
+# Patient dashboard
+#
+# One aggregation pages through a user's patients and joins each page row to
+# its images and reports. Both lookups are equality joins on patient_id, so
+# they are served by the (patient_id, created_at, _id) indexes and only ever
+# touch the rows of the patients on the current page.
+
+DASHBOARD_THUMBNAILS = 4
+
+def _summary_lookup(collection: str, latest_limit: int, latest_fields: Dict[str, int], alias: str) -> Dict[str, Any]:
+    # let + $expr equality rather than localField with pipeline (MongoDB 5.0+);
+    # an $expr $eq match still uses the patient_id index on MongoDB 4.4
+    return {"$lookup": {
+        "from": collection,
+        "let": {"pid": "$patient_id"},
+        "pipeline": [{"$match": {"$expr": {"$eq": ["$patient_id", "$$pid"]}}}, {"$facet": {
+            "count": [{"$count": "n"}],
+            "latest": [{"$sort": dict(KEYSET_SORT)}, {"$limit": latest_limit}, {"$project": latest_fields}],
+        }}],
+        "as": alias,
+    }}
+
+async def get_patient_dashboard(
+    user_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """One page of a user's patients with image/report counts, latest report status and thumbnails"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = {"created_by": user_id}
+    page_query = {"$and": [query, keyset_condition(cursor)]} if cursor else query
+    pipeline = [
+        {"$match": page_query},
+        {"$sort": dict(KEYSET_SORT)},
+        {"$limit": limit + 1},
+        {"$project": PATIENT_LIST_PROJECTION},
+        _summary_lookup("medical_images", DASHBOARD_THUMBNAILS,
+                        {"thumbnail_url": 1, "study_type": 1, "derivatives": 1, "created_at": 1}, "images"),
+        _summary_lookup("reports", 1, {"status": 1, "study_type": 1, "created_at": 1}, "reports"),
+    ]
+    coll = db.get_collection("patients")
+    docs, total = await asyncio.gather(
+        coll.aggregate(pipeline).to_list(length=limit + 1),
+        coll.count_documents(query)
+    )
+    items = []
+    for doc in docs[:limit]:
+        images, reports = doc.pop("images")[0], doc.pop("reports")[0]
+        latest_report = reports["latest"][0] if reports["latest"] else None
+        doc["image_count"] = images["count"][0]["n"] if images["count"] else 0
+        doc["report_count"] = reports["count"][0]["n"] if reports["count"] else 0
+        doc["latest_report_status"] = latest_report["status"] if latest_report else None
+        doc["latest_report_at"] = latest_report["created_at"] if latest_report else None
+        doc["thumbnails"] = [
+            {"image_id": str(image["_id"]), "thumbnail_url": image.get("thumbnail_url"),
+             "study_type": image.get("study_type"), "derivatives": image.get("derivatives")}
+            for image in images["latest"]
+        ]
+        items.append(with_string_id(doc))
+    return {
+        "items": items,
+        "total": total,
+        "next_cursor": encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    }
 
 async def create_patient(patient_data: Dict[str, Any]) -> str:
     """Create new patient"""
+    patient_data.update(patient_search_fields(patient_data))
     result = await db.get_collection("patients").insert_one(patient_data)
     return str(result.inserted_id)
 
-async def get_patients_by_user(user_id: str) -> List[Dict[str, Any]]:
-    """Get all patients for a user"""
-    cursor = db.get_collection("patients").find({"created_by": user_id})
-    patients = await cursor.to_list(length=100)
-    return patients
+async def get_patients_by_user(
+    user_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """Get one page of a user's patients, newest first"""
+    return await find_page("patients", {"created_by": user_id}, PATIENT_LIST_PROJECTION, limit, cursor)
 
 async def create_medical_image(image_data: Dict[str, Any]) -> str:
     """Create medical image record"""
     result = await db.get_collection("medical_images").insert_one(image_data)
+    await metadata_cache.invalidate("images", image_data.get("patient_id"))
     return str(result.inserted_id)
 
-async def get_images_by_patient(patient_id: str) -> List[Dict[str, Any]]:
-    """Get all images for a patient"""
-    cursor = db.get_collection("medical_images").find({"patient_id": patient_id})
-    images = await cursor.to_list(length=100)
-    return images
+async def get_image_by_id(image_id: str) -> Optional[Dict[str, Any]]:
+    """Get medical image record by ID"""
+    if not ObjectId.is_valid(image_id):
+        return None
+    image = await db.get_collection("medical_images").find_one({"_id": ObjectId(image_id)})
+    return image
+
+async def get_images_by_ids(image_ids: List[str]) -> List[Dict[str, Any]]:
+    """Get several medical image records in one query"""
+    object_ids = [ObjectId(i) for i in image_ids if ObjectId.is_valid(i)]
+    cursor = db.get_collection("medical_images").find({"_id": {"$in": object_ids}})
+    return await cursor.to_list(length=len(object_ids))
+
+async def set_derivatives_status(content_hash: str, status: str) -> int:
+    """Record thumbnail/pyramid status on every image sharing a blob"""
+    coll = db.get_collection("medical_images")
+    result = await coll.update_many(
+        {"content_hash": content_hash},
+        {"$set": {"derivatives": status}}
+    )
+    for patient_id in await coll.distinct("patient_id", {"content_hash": content_hash}):
+        await metadata_cache.invalidate("images", patient_id)
+    return result.modified_count
+
+async def referenced_content_hashes(content_hashes: List[str]) -> set:
+    """Which of these blobs at least one image record still points at"""
+    return set(await db.get_collection("medical_images").distinct(
+        "content_hash", {"content_hash": {"$in": content_hashes}}
+    ))
+
+async def get_images_by_patient(
+    patient_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """Get one page of a patient's images, newest first"""
+    return await metadata_cache.get(
+        "images", patient_id,
+        lambda: find_page("medical_images", {"patient_id": patient_id}, IMAGE_LIST_PROJECTION, limit, cursor),
+        limit, cursor
+    )
 
 async def create_report(report_data: Dict[str, Any]) -> str:
     """Create medical report"""
     result = await db.get_collection("reports").insert_one(report_data)
+    await metadata_cache.invalidate("reports", report_data.get("patient_id"))
+    return str(result.inserted_id)
+
+async def get_reports_by_patient(
+    patient_id: str, limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """Get one page of a patient's reports, newest first"""
+    return await metadata_cache.get(
+        "reports", patient_id,
+        lambda: find_page("reports", {"patient_id": patient_id}, REPORT_LIST_PROJECTION, limit, cursor),
+        limit, cursor
+    )
+
+REPORT_FACETS = ("status", "study_type")
+
+def build_report_filter_query(
+    patient_id: Optional[str] = None,
+    study_type: Optional[str] = None,
+    status: Optional[str] = None,
+    created_by: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Mongo filter for a report query"""
+    query: Dict[str, Any] = {}
+    for field, value in (("patient_id", patient_id), ("study_type", study_type),
+                         ("status", status), ("created_by", created_by)):
+        if value:
+            query[field] = value
+    if date_from or date_to:
+        query["created_at"] = {}
+        if date_from:
+            query["created_at"]["$gte"] = date_from
+        if date_to:
+            query["created_at"]["$lte"] = date_to
+    return query
+
+async def query_reports(
+    query: Dict[str, Any], limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """One keyset page of matching reports plus total and per-facet counts.
+
+    The page is a find with the keyset condition, so a deep page seeks
+    straight to the cursor on a (..., created_at, _id) index instead of
+    walking every earlier row.
+    The counts come from one aggregation over the same filter without the
+    cursor, where $facet splits the matched stream into total and groups.
+    Both run in parallel.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    page_query = {"$and": [query, keyset_condition(cursor)]} if cursor else query
+    coll = db.get_collection("reports")
+    find_cursor = coll.find(page_query, REPORT_LIST_PROJECTION).sort(KEYSET_SORT).limit(limit + 1)
+    facets: Dict[str, Any] = {"total": [{"$count": "count"}]}
+    for field in REPORT_FACETS:
+        facets[field] = [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}]
+    counts_pipeline = [{"$match": query}, {"$facet": facets}]
+    docs, counts = await asyncio.gather(
+        find_cursor.to_list(length=limit + 1),
+        coll.aggregate(counts_pipeline, allowDiskUse=True).to_list(length=1)
+    )
+    result = counts[0] if counts else {}
+    total = result.get("total", [])
+    return {
+        "items": [with_string_id(doc) for doc in docs[:limit]],
+        "total": total[0]["count"] if total else 0,
+        "next_cursor": encode_cursor(docs[limit - 1]) if len(docs) > limit else None,
+        "facets": {
+            field: {group["_id"]: group["count"] for group in result.get(field, []) if group["_id"] is not None}
+            for field in REPORT_FACETS
+        }
+    }
+
+async def get_report_by_id(report_id: str) -> Optional[Dict[str, Any]]:
+    """Get medical report by ID"""
+    if not ObjectId.is_valid(report_id):
+        return None
+    return await db.get_collection("reports").find_one({"_id": ObjectId(report_id)})
+
+async def update_report_versioned(
+    report_id: str, update_data: Dict[str, Any], expected_version: int, entry: Dict[str, Any]
+) -> bool:
+    """Apply an update and bump the version if the report is still at expected_version.
+
+    The new version's history entry is stored on the report in the same
+    atomic write (as pending_version), so it cannot be lost if the process
+    stops before the entry reaches report_versions.
+    """
+    if not ObjectId.is_valid(report_id):
+        return False
+    before = await db.get_collection("reports").find_one_and_update(
+        {"_id": ObjectId(report_id), "version": expected_version},
+        {"$set": {**update_data, "pending_version": entry}, "$inc": {"version": 1}},
+        projection={"patient_id": 1}
+    )
+    if before is None:
+        return False
+    await metadata_cache.invalidate("reports", before.get("patient_id"))
+    return True
+
+async def clear_pending_version(report_id: str, version: int):
+    """Drop a report's pending history entry once it is stored in report_versions"""
+    await db.get_collection("reports").update_one(
+        {"_id": ObjectId(report_id), "pending_version.version": version},
+        {"$unset": {"pending_version": ""}}
+    )
+
+async def save_report_version(entry: Dict[str, Any]):
+    """Store a report history entry unless that version is already recorded"""
+    await db.get_collection("report_versions").update_one(
+        {"report_id": entry["report_id"], "version": entry["version"]},
+        {"$setOnInsert": entry},
+        upsert=True
+    )
+
+async def list_report_versions(report_id: str) -> List[Dict[str, Any]]:
+    """History entries of a report without their payloads, oldest first"""
+    cursor = db.get_collection("report_versions").find(
+        {"report_id": report_id}, {"snapshot": 0, "delta": 0}
+    ).sort("version", 1)
+    return [with_string_id(doc) async for doc in cursor]
+
+async def get_report_versions_between(report_id: str, first: int, last: int) -> List[Dict[str, Any]]:
+    """History entries first..last of a report, oldest first"""
+    cursor = db.get_collection("report_versions").find(
+        {"report_id": report_id, "version": {"$gte": first, "$lte": last}}
+    ).sort("version", 1)
+    return await cursor.to_list(length=last - first + 1)
+
+async def acquire_autosave_lock(report_id: str, owner: str, ttl: float) -> bool:
+    """Take a report's autosave lock for ttl seconds unless someone else holds it"""
+    now = datetime.utcnow()
+    locks = db.get_collection("autosave_locks")
+    try:
+        await locks.insert_one({"_id": report_id, "owner": owner, "until": now + timedelta(seconds=ttl)})
+        return True
+    except DuplicateKeyError:
+        # Held, or left behind by a worker that stopped before releasing it
+        result = await locks.update_one(
+            {"_id": report_id, "until": {"$lt": now}},
+            {"$set": {"owner": owner, "until": now + timedelta(seconds=ttl)}}
+        )
+        return result.modified_count > 0
+
+async def release_autosave_lock(report_id: str, owner: str):
+    await db.get_collection("autosave_locks").delete_one({"_id": report_id, "owner": owner})
+
+async def get_autosave_session(report_id: str) -> Optional[Dict[str, Any]]:
+    return await db.get_collection("autosave_sessions").find_one({"_id": report_id})
+
+async def save_autosave_session(session: Dict[str, Any]):
+    await db.get_collection("autosave_sessions").replace_one({"_id": session["_id"]}, session, upsert=True)
+
+async def delete_autosave_session(report_id: str):
+    await db.get_collection("autosave_sessions").delete_one({"_id": report_id})
+
+async def due_autosave_sessions(before: datetime, limit: int = 100) -> List[str]:
+    """Ids of reports whose autosave window closed before the given time"""
+    cursor = db.get_collection("autosave_sessions").find({"flush_at": {"$lte": before}}, {"_id": 1})
+    return [doc["_id"] async for doc in cursor.sort("flush_at", 1).limit(limit)]
+
+async def save_unsaved_autosave(entry: Dict[str, Any]):
+    """Keep edits whose write failed for their editor to collect"""
+    await db.get_collection("autosave_unsaved").replace_one({"_id": entry["_id"]}, entry, upsert=True)
+
+async def take_unsaved_autosave(key: str) -> Optional[Dict[str, Any]]:
+    """Hand back (once) an editor's unsaved edits"""
+    return await db.get_collection("autosave_unsaved").find_one_and_delete({"_id": key})
+
+async def create_analysis_job(job_data: Dict[str, Any]) -> str:
+    """Create analysis job record"""
+    result = await db.get_collection("analysis_jobs").insert_one(job_data)
     return str(result.inserted_id)
 
-async def get_reports_by_patient(patient_id: str) -> List[Dict[str, Any]]:
-    """Get all reports for a patient"""
-    cursor = db.get_collection("reports").find({"patient_id": patient_id})
-    reports = await cursor.to_list(length=100)
-    return reports
-
-async def update_report(report_id: str, update_data: Dict[str, Any]) -> bool:
-    """Update medical report"""
-    result = await db.get_collection("reports").update_one(
-        {"_id": ObjectId(report_id)}, 
-        {"$set": update_data}
+async def get_analysis_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Get analysis job by ID"""
+    if not ObjectId.is_valid(job_id):
+        return None
+    return await db.get_collection("analysis_jobs").find_one({"_id": ObjectId(job_id)})
+
+async def update_analysis_job(job_id: str, update_data: Dict[str, Any],
+                              lease: Optional[str] = None, status: Optional[str] = None) -> bool:
+    """Update analysis job state; with a lease (and status) only while the job still matches"""
+    query: Dict[str, Any] = {"_id": ObjectId(job_id)}
+    if lease is not None:
+        query["lease"] = lease
+    if status is not None:
+        query["status"] = status
+    result = await db.get_collection("analysis_jobs").update_one(query, {"$set": update_data})
+    return result.matched_count > 0
+
+async def touch_analysis_jobs(leases: List[str]) -> int:
+    """Refresh updated_at on unfinished jobs still held under these leases"""
+    if not leases:
+        return 0
+    result = await db.get_collection("analysis_jobs").update_many(
+        {"lease": {"$in": leases}, "status": {"$in": [schemas.JobStatus.QUEUED, schemas.JobStatus.RUNNING]}},
+        {"$set": {"updated_at": datetime.utcnow()}}
     )
-    return result.modified_count > 0
+    return result.modified_count
+
+async def claim_stale_analysis_job(cutoff: datetime, lease: str) -> Optional[Dict[str, Any]]:
+    """Atomically take over one queued/running job not updated since cutoff under a new lease"""
+    return await db.get_collection("analysis_jobs").find_one_and_update(
+        {
+            "status": {"$in": [schemas.JobStatus.QUEUED, schemas.JobStatus.RUNNING]},
+            "$or": [
+                {"updated_at": {"$lt": cutoff}},
+                {"updated_at": {"$exists": False}, "created_at": {"$lt": cutoff}},
+            ],
+        },
+        {"$set": {"status": schemas.JobStatus.QUEUED, "lease": lease, "updated_at": datetime.utcnow()}},
+        sort=[("updated_at", 1)],
+    )
+
+async def get_cached_analysis(key: str) -> Optional[Dict[str, Any]]:
+    """Get an unexpired cached analysis result"""
+    return await db.get_collection("analysis_cache").find_one(
+        {"_id": key, "expires_at": {"$gt": datetime.utcnow()}}
+    )
+
+async def save_cached_analysis(entry: Dict[str, Any]):
+    """Insert or replace a cached analysis result"""
+    await db.get_collection("analysis_cache").replace_one({"_id": entry["_id"]}, entry, upsert=True)
+
+async def delete_cached_analyses_except(model_version: str) -> int:
+    """Remove cached analysis results from other model versions"""
+    result = await db.get_collection("analysis_cache").delete_many({"model_version": {"$ne": model_version}})
+    return result.deleted_count
+
+async def revoke_token(token_digest: str, expires_at: datetime):
+    """Record a revoked token until its natural expiry"""
+    await db.get_collection("revoked_tokens").update_one(
+        {"_id": token_digest},
+        {"$set": {"expires_at": expires_at, "revoked_at": datetime.utcnow()}},
+        upsert=True
+    )
+
+async def get_revoked_tokens() -> Dict[str, datetime]:
+    """Digests of revoked tokens that have not yet expired"""
+    cursor = db.get_collection("revoked_tokens").find(
+        {"expires_at": {"$gt": datetime.utcnow()}}, {"expires_at": 1}
+    )
+    return {doc["_id"]: doc["expires_at"] async for doc in cursor}
+
+async def stream_documents(
+    collection: str,
+    query: Dict[str, Any],
+    sort: List[tuple],
+    projection: Optional[Dict[str, Any]] = None,
+    batch_size: int = 1000
+):
+    """Iterate a query batch by batch without materializing the result"""
+    cursor = db.get_collection(collection).find(query, projection).sort(sort).batch_size(batch_size)
+    try:
+        async for doc in cursor:
+            yield doc
+    finally:
+        await cursor.close()
 
 async def create_audit_log(log_data: Dict[str, Any]) -> str:
     """Create audit log entry"""
     result = await db.get_collection("audit_logs").insert_one(log_data)
     return str(result.inserted_id)
+
+async def create_audit_logs(entries: List[Dict[str, Any]]) -> int:
+    """Insert a batch of audit log entries"""
+    result = await db.get_collection("audit_logs").insert_many(entries, ordered=False)
+    return len(result.inserted_ids)
@@ -0,0 +1,150 @@
+import os
+import typing
+import anyio
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+# Blobs are content-addressed, so a given URL never changes what it returns
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def make_etag(digest: str) -> str:
+    """Strong ETag for a content-addressed file"""
+    return f'"{digest}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag (RFC 9110 13.1.2)"""
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def parse_range(range_header: str, total: int) -> typing.Optional[typing.Tuple[int, int]]:
+    """Parse a single-range "bytes=" header into an inclusive (start, end) pair.
+
+    Returns None when the header should be ignored (other units, malformed or
+    multiple ranges) and raises ValueError when the range is unsatisfiable.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    first, last = first.strip(), last.strip()
+    if not sep or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None
+    if first == "":
+        if last == "" or int(last) == 0:
+            raise ValueError("Range not satisfiable")
+        return max(total - int(last), 0), total - 1
+    start = int(first)
+    end = int(last) if last else total - 1
+    if start >= total or end < start:
+        raise ValueError("Range not satisfiable")
+    return start, min(end, total - 1)
+
+class ZeroCopyFileResponse(FileResponse):
+    """File response for a whole file or one byte range of it (206 Partial Content).
+
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers
+    it and falls back to chunked reads through a worker thread otherwise.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        byte_range: typing.Optional[typing.Tuple[int, int]] = None,
+        **kwargs
+    ):
+        if byte_range is None:
+            byte_range = (0, stat_result.st_size - 1)
+            status_code = 200
+        else:
+            status_code = 206
+        self.start, self.end = byte_range
+        super().__init__(path, status_code=status_code, stat_result=stat_result, **kwargs)
+
+    def set_stat_headers(self, stat_result: os.stat_result) -> None:
+        super().set_stat_headers(stat_result)
+        if self.status_code == 206:
+            self.headers["content-length"] = str(self.end - self.start + 1)
+            self.headers["content-range"] = f"bytes {self.start}-{self.end}/{stat_result.st_size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        count = self.end - self.start + 1
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only or count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            file = await run_in_threadpool(open, self.path, "rb")
+            try:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.start,
+                    "count": count,
+                    "more_body": False,
+                })
+            finally:
+                await run_in_threadpool(file.close)
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(self.start)
+                remaining = count
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0,
+                    })
+                if remaining > 0:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+async def serve_immutable_file(request: Request, path: str, digest: str, media_type: str) -> Response:
+    """Serve a content-addressed file with ETag revalidation and Range support"""
+    etag = make_etag(digest)
+    headers = {
+        "etag": etag,
+        "cache-control": IMMUTABLE_CACHE_CONTROL,
+        "accept-ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    stat_result = await run_in_threadpool(os.stat, path)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, stat_result.st_size)
+        except ValueError:
+            headers["content-range"] = f"bytes */{stat_result.st_size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            return ZeroCopyFileResponse(
+                path, stat_result, byte_range,
+                headers=headers, media_type=media_type, method=request.method
+            )
+
+    return ZeroCopyFileResponse(
+        path, stat_result,
+        headers=headers, media_type=media_type, method=request.method
+    )
@@ -0,0 +1,80 @@
+import os
+import json
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Optional
+from bson import ObjectId
+import database
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_GZIP_LEVEL = 6
+
+# Exportable collections: the field holding the record's time (which is also
+# the sort key), the field holding the user it belongs to and any internal
+# fields to leave out
+EXPORTS = {
+    "reports": {"time_field": "created_at", "user_field": "created_by", "projection": {"pending_version": 0}},
+    "audit_logs": {"time_field": "timestamp", "user_field": "user_id"},
+}
+
+def _json_default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def build_export_query(
+    name: str,
+    user_id: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+) -> Dict[str, Any]:
+    spec = EXPORTS[name]
+    query: Dict[str, Any] = {}
+    if user_id:
+        query[spec["user_field"]] = user_id
+    if date_from or date_to:
+        query[spec["time_field"]] = {}
+        if date_from:
+            query[spec["time_field"]]["$gte"] = date_from
+        if date_to:
+            query[spec["time_field"]]["$lte"] = date_to
+    return query
+
+async def ndjson_lines(name: str, query: Dict[str, Any], batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Stream a collection as NDJSON, oldest first, in chunks of about EXPORT_CHUNK_SIZE"""
+    time_field = EXPORTS[name]["time_field"]
+    # Sorting on the indexed time field alone keeps the sort out of memory
+    documents = database.stream_documents(
+        name, query, [(time_field, 1)], EXPORTS[name].get("projection"), batch_size=batch_size
+    )
+    buffer = []
+    size = 0
+    async for doc in documents:
+        line = json.dumps(doc, default=_json_default, separators=(",", ":")).encode() + b"\n"
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+async def gzip_stream(chunks: AsyncIterator[bytes], level: int = EXPORT_GZIP_LEVEL) -> AsyncIterator[bytes]:
+    """Gzip a byte stream on the fly.
+
+    Each chunk is sync-flushed so the client receives data as soon as it is
+    read rather than when the compressor's window fills.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_stream(name: str, query: Dict[str, Any], compress: bool = False) -> AsyncIterator[bytes]:
+    stream = ndjson_lines(name, query)
+    return gzip_stream(stream) if compress else stream
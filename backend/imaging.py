@@ -0,0 +1,209 @@
+import os
+import io
+import json
+import shutil
+import uuid
+import asyncio
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Optional
+import storage
+import pixels
+
+DERIVED_DIR = os.path.join(storage.UPLOAD_DIR, "derived")
+TILE_SIZE = 256
+THUMBNAIL_SIZE = 128
+ANALYSIS_SIZE = 256
+PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", "2"))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_pending: Dict[str, asyncio.Future] = {}
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Shared process pool for CPU-bound image work"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS)
+    return _process_pool
+
+def shutdown_process_pool():
+    """Stop the image worker processes"""
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+# Derived file layout
+#
+# Derivatives are keyed by the blob digest, so every image record sharing a
+# blob shares one pyramid. Level 0 is full resolution and each level halves
+# the previous one until the whole image fits in a single tile.
+
+def derived_dir(digest: str) -> str:
+    return os.path.join(DERIVED_DIR, digest[:2], digest[2:4], digest)
+
+async def remove_derivatives(digest: str):
+    """Delete a blob's thumbnail, tiles and manifest"""
+    await asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, derived_dir(digest), True)
+
+def manifest_path(digest: str) -> str:
+    return os.path.join(derived_dir(digest), "manifest.json")
+
+def thumbnail_path(digest: str) -> str:
+    return os.path.join(derived_dir(digest), "thumbnail.png")
+
+def tile_path(digest: str, level: int, x: int, y: int) -> str:
+    return os.path.join(derived_dir(digest), str(level), f"{x}_{y}.png")
+
+def has_derivatives(digest: str) -> bool:
+    return os.path.exists(manifest_path(digest))
+
+def load_manifest(digest: str) -> Optional[Dict[str, Any]]:
+    """Read the pyramid manifest for a blob, if it has been built"""
+    try:
+        with open(manifest_path(digest)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# Pixel helpers (vectorized NumPy)
+
+def to_uint8(array: np.ndarray) -> np.ndarray:
+    """Rescale any integer or float image to 0-255 using its own min/max"""
+    if array.dtype == np.uint8:
+        return array
+    array = array.astype(np.float32)
+    low, high = float(array.min()), float(array.max())
+    if high <= low:
+        return np.zeros(array.shape, dtype=np.uint8)
+    return ((array - low) * (255.0 / (high - low))).astype(np.uint8)
+
+def load_pixels(path: str) -> np.ndarray:
+    """Decode an image file into an 8-bit (H, W) or (H, W, 3/4) array.
+
+    Uncompressed DICOM/TIFF go through the memory-mapped pixel layer with
+    their default window; everything else is decoded by Pillow.
+    """
+    from PIL import Image
+
+    try:
+        return pixels.render_frame(pixels.open_pixel_source(path))
+    except pixels.PixelFormatError:
+        pass
+
+    with Image.open(path) as image:
+        if image.mode not in ("L", "RGB", "RGBA"):
+            if image.mode.startswith("I") or image.mode == "F":
+                return to_uint8(np.asarray(image))
+            image = image.convert("RGB")
+        return np.asarray(image)
+
+def downsample_2x(array: np.ndarray) -> np.ndarray:
+    """Halve an 8-bit image with a 2x2 box filter, replicating the edge on odd sizes"""
+    height, width = array.shape[:2]
+    pad = [(0, height % 2), (0, width % 2)] + [(0, 0)] * (array.ndim - 2)
+    if height % 2 or width % 2:
+        array = np.pad(array, pad, mode="edge")
+    height, width = array.shape[:2]
+    blocks = array.reshape(height // 2, 2, width // 2, 2, *array.shape[2:]).astype(np.uint16)
+    return ((blocks.sum(axis=(1, 3)) + 2) >> 2).astype(np.uint8)
+
+def _area_weights(source: int, target: int) -> np.ndarray:
+    """(target, source) matrix averaging each output pixel over its source footprint"""
+    edges = np.arange(target + 1, dtype=np.float64) * (source / target)
+    starts = np.arange(source, dtype=np.float64)
+    overlap = np.clip(
+        np.minimum(edges[1:, None], starts[None, :] + 1) - np.maximum(edges[:-1, None], starts[None, :]),
+        0, None
+    )
+    return (overlap / overlap.sum(axis=1, keepdims=True)).astype(np.float32)
+
+def resize_area(array: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Area-average resize as two matrix products (rows, then columns)"""
+    rows = _area_weights(array.shape[0], height)
+    cols = _area_weights(array.shape[1], width)
+    resized = np.tensordot(rows, array.astype(np.float32), axes=(1, 0))
+    resized = np.moveaxis(np.tensordot(cols, resized, axes=(1, 1)), 0, 1)
+    return np.clip(resized + 0.5, 0, 255).astype(np.uint8)
+
+def encode_png(array: np.ndarray) -> bytes:
+    """Encode an 8-bit array as PNG"""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def to_grayscale(array: np.ndarray) -> np.ndarray:
+    """Average the colour channels of an 8-bit image (alpha ignored)"""
+    if array.ndim == 3:
+        return (array[..., :3].mean(axis=2) + 0.5).astype(np.uint8)
+    return array
+
+def to_analysis_frame(array: np.ndarray, size: int = ANALYSIS_SIZE) -> np.ndarray:
+    """Grayscale and area-resize an 8-bit image to the fixed analysis shape"""
+    return resize_area(to_grayscale(array), size, size)
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def build_derivatives(source_path: str, digest: str, tile_size: int = TILE_SIZE) -> Dict[str, Any]:
+    """Build the tile pyramid and thumbnail for a blob; runs in a worker process.
+
+    The manifest is written last, so its presence means every file is in place.
+    """
+    array = load_pixels(source_path)
+    height, width = array.shape[:2]
+
+    scale = min(1.0, THUMBNAIL_SIZE / max(height, width))
+    thumbnail = resize_area(array, max(1, round(height * scale)), max(1, round(width * scale)))
+    _write_atomic(thumbnail_path(digest), encode_png(thumbnail))
+
+    levels = []
+    level = 0
+    while True:
+        height, width = array.shape[:2]
+        columns = -(-width // tile_size)
+        rows = -(-height // tile_size)
+        for y in range(rows):
+            for x in range(columns):
+                tile = array[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size]
+                _write_atomic(tile_path(digest, level, x, y), encode_png(tile))
+        levels.append({"level": level, "width": width, "height": height, "columns": columns, "rows": rows})
+        if max(height, width) <= tile_size:
+            break
+        array = downsample_2x(array)
+        level += 1
+
+    manifest = {
+        "width": levels[0]["width"],
+        "height": levels[0]["height"],
+        "tile_size": tile_size,
+        "format": "png",
+        "levels": levels,
+    }
+    _write_atomic(manifest_path(digest), json.dumps(manifest).encode())
+    return manifest
+
+async def ensure_derivatives(source_path: str, digest: str) -> Dict[str, Any]:
+    """Build derivatives in the process pool unless they already exist on disk.
+
+    Concurrent requests for the same blob share one build.
+    """
+    manifest = load_manifest(digest)
+    if manifest is not None:
+        return manifest
+    if digest not in _pending:
+        loop = asyncio.get_running_loop()
+        _pending[digest] = asyncio.ensure_future(
+            loop.run_in_executor(get_process_pool(), build_derivatives, source_path, digest)
+        )
+    try:
+        return await asyncio.shield(_pending[digest])
+    finally:
+        if digest in _pending and _pending[digest].done():
+            del _pending[digest]
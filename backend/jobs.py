@@ -0,0 +1,178 @@
+import os
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+import database
+import agents
+import schemas
+import storage
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "100"))
+# Held jobs are touched every heartbeat; ones untouched for the timeout were
+# lost with a worker that went away
+ANALYSIS_JOB_TIMEOUT = int(os.getenv("ANALYSIS_JOB_TIMEOUT", "300"))
+ANALYSIS_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "2"))
+HEARTBEAT_INTERVAL = min(60.0, ANALYSIS_JOB_TIMEOUT / 3)
+TERMINAL_STATUSES = (schemas.JobStatus.COMPLETED, schemas.JobStatus.FAILED)
+
+class QueueFullError(Exception):
+    """Raised when the analysis queue cannot take another job"""
+
+class AnalysisJobQueue:
+    """Bounded in-process queue of analysis jobs with a fixed pool of workers.
+
+    Job state lives in the analysis_jobs collection so any API worker can
+    answer a poll; waiters in this process are woken as soon as a job ends.
+    The queue itself is in memory, so every job is held under a lease whose
+    updated_at this process refreshes while the job waits or runs. Jobs whose
+    lease went quiet (their worker went away) are claimed under a new lease
+    and re-queued, or failed; writes under a lease that was taken over are
+    ignored.
+    """
+
+    def __init__(self, workers: int = ANALYSIS_WORKERS, maxsize: int = ANALYSIS_QUEUE_SIZE):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        # job id -> lease for every job queued or running in this process
+        self._held: Dict[str, str] = {}
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job_data: Dict[str, Any], result: Optional[str] = None) -> str:
+        """Persist a job and queue it; raises QueueFullError when at capacity.
+
+        A job whose result is already known (cache hit) is stored as completed
+        and never queued.
+        """
+        job_data["created_at"] = job_data["updated_at"] = datetime.utcnow()
+        if result is not None:
+            job_data.update({
+                "status": schemas.JobStatus.COMPLETED,
+                "result": result,
+                "finished_at": job_data["created_at"]
+            })
+            return await database.create_analysis_job(job_data)
+        if self.queue is None or self.queue.full():
+            raise QueueFullError("Analysis queue is full, please retry shortly")
+        job_data["status"] = schemas.JobStatus.QUEUED
+        job_data["lease"] = uuid.uuid4().hex
+        job_id = await database.create_analysis_job(job_data)
+        self._held[job_id] = job_data["lease"]
+        self.queue.put_nowait(job_id)
+        return job_id
+
+    async def wait(self, job_id: str, timeout: float) -> bool:
+        """Wait until a job handled by this process finishes; False on timeout"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, []).append(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self._waiters.get(job_id, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(job_id, None)
+
+    def _notify(self, job_id: str):
+        for future in self._waiters.pop(job_id, []):
+            if not future.done():
+                future.set_result(True)
+
+    async def recover_stale(self) -> int:
+        """Re-queue abandoned jobs while there is room; returns how many were claimed"""
+        claimed = 0
+        cutoff = datetime.utcnow() - timedelta(seconds=ANALYSIS_JOB_TIMEOUT)
+        while not self.queue.full():
+            lease = uuid.uuid4().hex
+            job = await database.claim_stale_analysis_job(cutoff, lease)
+            if not job:
+                break
+            claimed += 1
+            job_id = str(job["_id"])
+            if job.get("attempts", 0) >= ANALYSIS_MAX_ATTEMPTS:
+                error = "Analysis was interrupted too many times"
+            elif not os.path.exists(job.get("source_path") or ""):
+                error = "Analysis was interrupted and its upload is no longer available"
+            else:
+                self._held[job_id] = lease
+                self.queue.put_nowait(job_id)
+                continue
+            if await database.update_analysis_job(job_id, {
+                "status": schemas.JobStatus.FAILED,
+                "error": error,
+                "finished_at": datetime.utcnow()
+            }, lease=lease):
+                await storage.remove_scratch(job.get("source_path") or "")
+            self._notify(job_id)
+        return claimed
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await database.touch_analysis_jobs(list(self._held.values()))
+                claimed = await self.recover_stale()
+                if claimed:
+                    print(f"Recovered {claimed} stale analysis jobs")
+            except Exception as e:
+                print(f"Analysis job heartbeat failed: {e}")
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Analysis job {job_id} crashed: {e}")
+            finally:
+                self._held.pop(job_id, None)
+                self.queue.task_done()
+                self._notify(job_id)
+
+    async def _run(self, job_id: str):
+        lease = self._held.get(job_id)
+        job = await database.get_analysis_job(job_id)
+        # Finished, or taken over by another worker since it was queued here
+        if not job or lease is None or job.get("lease") != lease or job["status"] != schemas.JobStatus.QUEUED:
+            return
+        now = datetime.utcnow()
+        started = await database.update_analysis_job(job_id, {
+            "status": schemas.JobStatus.RUNNING,
+            "started_at": now,
+            "updated_at": now,
+            "attempts": job.get("attempts", 0) + 1
+        }, lease=lease, status=schemas.JobStatus.QUEUED)
+        if not started:
+            return
+        try:
+            result = await agents.ai_assistant.generate_report_cached(
+                job["content_hash"], job["source_path"], job["study_type"]
+            )
+            update = {"status": schemas.JobStatus.COMPLETED, "result": result, "error": None}
+        except Exception as e:
+            update = {"status": schemas.JobStatus.FAILED, "error": str(e)}
+        update["finished_at"] = datetime.utcnow()
+        # Kept until here so an interrupted job can be retried after a restart;
+        # a worker that lost its lease leaves the file to the new owner
+        if await database.update_analysis_job(job_id, update, lease=lease):
+            await storage.remove_scratch(job["source_path"])
+
+analysis_queue = AnalysisJobQueue()
@@ -1,17 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, status, Form
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, status, Form, Request, BackgroundTasks, WebSocket, WebSocketDisconnect, Query, Path
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 import database
 import auth
 import schemas
 import agents
-import shutil
+import storage
+import delivery
+import imaging
+import pixels
+import jobs
+import cache
+import audit
+import versioning
+import autosave
+import export
+import metrics
 import os
+import json
+import time
+import asyncio
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Union
 from bson import ObjectId
+from jose import JWTError
+from starlette.websockets import WebSocketState
 
 app = FastAPI(title="Medical Imaging Assistant API", version="1.0.0")
+app.router.route_class = storage.UploadRoute
 
 # CORS middleware
 app.add_middleware(
@@ -22,15 +40,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency; added last so it wraps everything, CORS included
+app.add_middleware(metrics.MetricsMiddleware)
+
 security = HTTPBearer()
 
 @app.on_event("startup")
 async def startup():
+    started = time.perf_counter()
     await database.db.connect_db()
     print("Database connected successfully")
+    await asyncio.gather(
+        jobs.analysis_queue.start(), audit.audit_log.start(), auth.token_verifier.start(),
+        database.metadata_cache.start(), autosave.report_autosaver.start()
+    )
+    # Housekeeping that requests do not depend on runs once we are serving
+    asyncio.create_task(purge_stale_analysis_cache())
+    asyncio.create_task(backfill_patient_search())
+    print(f"Startup finished in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+async def purge_stale_analysis_cache():
+    try:
+        await cache.analysis_cache.purge_other_versions(agents.ai_assistant.model_version)
+    except Exception as e:
+        print(f"Analysis cache purge failed: {e}")
+
+async def backfill_patient_search():
+    try:
+        updated = await database.backfill_patient_search_fields()
+        if updated:
+            print(f"Added search fields to {updated} patients")
+    except Exception as e:
+        print(f"Patient search backfill failed: {e}")
 
 @app.on_event("shutdown")
 async def shutdown():
+    await jobs.analysis_queue.stop()
+    await autosave.report_autosaver.stop()
+    await audit.audit_log.stop()
+    await auth.token_verifier.stop()
+    await database.metadata_cache.stop()
+    auth.shutdown_hash_executor()
+    imaging.shutdown_process_pool()
     await database.db.close_db()
     print("Database disconnected")
 
@@ -47,7 +98,8 @@ async def register_user(user_data: schemas.UserCreate):
             )
         
         # Create new user
-        user_dict = user_data.dict()
+        user_dict = user_data.dict(exclude={"password"})
+        user_dict["hashed_password"] = await auth.hash_password(user_data.password)
         user_dict["created_at"] = datetime.utcnow()
         user_dict["is_active"] = True
         user_id = await database.create_user(user_dict)
@@ -67,9 +119,9 @@ async def register_user(user_data: schemas.UserCreate):
 @app.post("/auth/login", response_model=schemas.APIResponse)
 async def login(login_data: schemas.LoginRequest):
     try:
-        # Simple authentication for demo - in production, verify password hash
         user = await database.get_user_by_email(login_data.email)
-        if not user:
+        valid, new_hash = await auth.verify_password(login_data.password, user)
+        if not valid:
             raise HTTPException(
                 status_code=401,
                 detail="Invalid email or password"
@@ -83,11 +135,12 @@ async def login(login_data: schemas.LoginRequest):
         }
         token = auth.create_access_token(token_data)
         
-        # Update last login
-        await database.db.get_collection("users").update_one(
-            {"_id": user["_id"]},
-            {"$set": {"last_login": datetime.utcnow()}}
-        )
+        # Update last login, upgrading the stored hash if the cost changed
+        update = {"$set": {"last_login": datetime.utcnow()}}
+        if new_hash:
+            update["$set"]["hashed_password"] = new_hash
+            update["$unset"] = {"password": ""}
+        await database.db.get_collection("users").update_one({"_id": user["_id"]}, update)
         
         return schemas.APIResponse(
             success=True,
@@ -96,7 +149,9 @@ async def login(login_data: schemas.LoginRequest):
                 "access_token": token,
                 "token_type": "bearer",
                 "expires_in": 86400,
-                "user": schemas.UserResponse(**{k: v for k, v in user.items() if k != "password"})
+                "user": schemas.UserResponse(**database.with_string_id(
+                    {k: v for k, v in user.items() if k not in ("password", "hashed_password")}
+                ))
             }
         )
     except HTTPException:
@@ -108,6 +163,20 @@ async def login(login_data: schemas.LoginRequest):
             errors=[str(e)]
         )
 
+@app.post("/auth/logout", response_model=schemas.APIResponse)
+async def logout(token: str = Depends(auth.oauth2_scheme)):
+    try:
+        await auth.token_verifier.revoke(token)
+        return schemas.APIResponse(success=True, message="Logged out successfully")
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    except Exception as e:
+        return schemas.APIResponse(
+            success=False,
+            message="Logout failed",
+            errors=[str(e)]
+        )
+
 # Patient management endpoints
 @app.post("/patients/", response_model=schemas.APIResponse)
 async def create_patient_record(
@@ -125,13 +194,13 @@ async def create_patient_record(
         
         # Create patient record
         patient_dict = patient_data.dict()
-        patient_dict["created_by"] = current_user["user_id"]
+        patient_dict["created_by"] = current_user.user_id
         patient_dict["created_at"] = datetime.utcnow()
         patient_id = await database.create_patient(patient_dict)
         
         # Create audit log
-        await database.create_audit_log({
-            "user_id": current_user["user_id"],
+        await audit.audit_log.log({
+            "user_id": current_user.user_id,
             "action": "create_patient",
             "resource_type": "patient",
             "resource_id": patient_id,
@@ -153,29 +222,109 @@ async def create_patient_record(
             errors=[str(e)]
         )
 
-@app.get("/patients/", response_model=schemas.APIResponse)
+def typed_page(page_model, result: dict, limit: int, page: int, cursor: Optional[str],
+               exclude: Optional[set] = None, **extra) -> Response:
+    """Validate a keyset page into its typed model and encode it straight to JSON bytes.
+
+    Returning the bytes skips FastAPI's second validation and jsonable_encoder
+    pass; pydantic-core's compiled serializer does all the work.
+    """
+    body = page_model(
+        success=True,
+        data=result["items"],
+        total=result["total"],
+        page=page,
+        per_page=limit,
+        has_next=result["next_cursor"] is not None,
+        has_prev=cursor is not None,
+        next_cursor=result["next_cursor"],
+        **extra
+    )
+    return Response(
+        content=body.model_dump_json(exclude={"data": {"__all__": exclude}} if exclude else None),
+        media_type="application/json"
+    )
+
+@app.get("/patients/", response_model=Union[schemas.PatientPage, schemas.APIResponse])
 async def get_patients(
-    skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(database.DEFAULT_PAGE_SIZE, ge=1, le=database.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    page: int = 1,
     current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
 ):
     try:
-        patients = await database.get_patients_by_user(current_user["user_id"])
+        result = await database.get_patients_by_user(current_user.user_id, limit, cursor)
+        return typed_page(schemas.PatientPage, result, limit, page, cursor, exclude=database.PATIENT_LIST_EXCLUDE)
+    except database.InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
         return schemas.APIResponse(
-            success=True,
-            message="Patients retrieved successfully",
-            data=patients[skip:skip + limit]
+            success=False,
+            message="Failed to retrieve patients",
+            errors=[str(e)]
         )
+
+@app.get("/patients/dashboard", response_model=Union[schemas.PatientDashboardPage, schemas.APIResponse])
+async def get_patient_dashboard(
+    limit: int = Query(database.DEFAULT_PAGE_SIZE, ge=1, le=database.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    page: int = 1,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    """Patients with their image/report summary in one request"""
+    try:
+        result = await database.get_patient_dashboard(current_user.user_id, limit, cursor)
+        return typed_page(schemas.PatientDashboardPage, result, limit, page, cursor, exclude=database.PATIENT_LIST_EXCLUDE)
+    except database.InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         return schemas.APIResponse(
             success=False,
-            message="Failed to retrieve patients",
+            message="Failed to load dashboard",
+            errors=[str(e)]
+        )
+
+@app.get("/patients/search", response_model=Union[schemas.PatientPage, schemas.APIResponse])
+async def search_patients(
+    filters: schemas.PatientFilter = Depends(),
+    limit: int = Query(database.DEFAULT_PAGE_SIZE, ge=1, le=database.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    page: int = 1,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    """Search patients by ID or name; students only ever see their own"""
+    try:
+        created_by = filters.created_by
+        if current_user.role == schemas.UserRole.STUDENT:
+            created_by = current_user.user_id
+        query = database.build_patient_search_query(
+            filters.search, filters.mode, created_by, filters.date_from, filters.date_to
+        )
+        result = await database.search_patients(query, limit, cursor)
+        return typed_page(schemas.PatientPage, result, limit, page, cursor, exclude=database.PATIENT_LIST_EXCLUDE)
+    except database.InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        return schemas.APIResponse(
+            success=False,
+            message="Failed to search patients",
             errors=[str(e)]
         )
 
 # Medical image endpoints
+async def generate_image_derivatives(source_path: str, content_hash: str):
+    """Background stage: build thumbnail and tile pyramid for a new blob"""
+    try:
+        await imaging.ensure_derivatives(source_path, content_hash)
+        await database.set_derivatives_status(content_hash, "ready")
+    except Exception as e:
+        print(f"Derivative generation failed for {content_hash}: {e}")
+        await database.set_derivatives_status(content_hash, "failed")
+
 @app.post("/images/upload", response_model=schemas.APIResponse)
+@storage.accepts_uploads()
 async def upload_medical_image(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     patient_id: str = Form(...),
     study_type: schemas.StudyType = Form(...),
@@ -190,30 +339,35 @@ async def upload_medical_image(
                 detail="Unsupported file type. Please upload PNG, JPG, TIFF, or DICOM files."
             )
         
-        # Save file
-        os.makedirs("uploads", exist_ok=True)
-        file_path = f"uploads/{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Store file by content hash (identical uploads share one blob)
+        stored = await storage.store_blob(file)
         
         # Create image record
+        image_oid = ObjectId()
         image_data = {
+            "_id": image_oid,
             "patient_id": patient_id,
             "study_type": study_type,
             "description": description,
             "file_name": file.filename,
             "file_type": file.content_type or "unknown",
-            "file_size": file.size or 0,
-            "image_url": f"http://localhost:8000/{file_path}",
-            "uploaded_by": current_user["user_id"],
+            "file_size": stored.size,
+            "content_hash": stored.sha256,
+            "storage_path": stored.path,
+            "image_url": f"http://localhost:8000/images/{image_oid}/file",
+            "thumbnail_url": f"http://localhost:8000/images/{image_oid}/thumbnail",
+            "derivatives": "ready" if imaging.has_derivatives(stored.sha256) else "pending",
+            "uploaded_by": current_user.user_id,
             "created_at": datetime.utcnow()
         }
         
         image_id = await database.create_medical_image(image_data)
+        if image_data["derivatives"] == "pending":
+            background_tasks.add_task(generate_image_derivatives, stored.path, stored.sha256)
         
         # Create audit log
-        await database.create_audit_log({
-            "user_id": current_user["user_id"],
+        await audit.audit_log.log({
+            "user_id": current_user.user_id,
             "action": "upload_image",
             "resource_type": "image",
             "resource_id": image_id,
@@ -224,7 +378,11 @@ async def upload_medical_image(
         return schemas.APIResponse(
             success=True,
             message="Image uploaded successfully",
-            data={"image_id": image_id, "file_path": file_path}
+            data={
+                "image_id": image_id,
+                "content_hash": stored.sha256,
+                "deduplicated": stored.deduplicated
+            }
         )
     except HTTPException:
         raise
@@ -235,18 +393,46 @@ async def upload_medical_image(
             errors=[str(e)]
         )
 
-@app.get("/images/patient/{patient_id}", response_model=schemas.APIResponse)
-async def get_patient_images(
-    patient_id: str,
-    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+@app.post("/images/blobs/gc", response_model=schemas.APIResponse)
+async def collect_image_blobs(
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.ADMIN]))
 ):
+    """Delete stored blobs (and their derivatives) that no image record references"""
     try:
-        images = await database.get_images_by_patient(patient_id)
+        result = await storage.collect_garbage(database.referenced_content_hashes, imaging.remove_derivatives)
+        await audit.audit_log.log({
+            "user_id": current_user.user_id,
+            "action": "collect_blobs",
+            "resource_type": "image",
+            "resource_id": None,
+            "timestamp": datetime.utcnow(),
+            "details": result
+        })
         return schemas.APIResponse(
             success=True,
-            message="Images retrieved successfully",
-            data=images
+            message="Unreferenced blobs collected",
+            data=result
         )
+    except Exception as e:
+        return schemas.APIResponse(
+            success=False,
+            message="Failed to collect blobs",
+            errors=[str(e)]
+        )
+
+@app.get("/images/patient/{patient_id}", response_model=Union[schemas.MedicalImagePage, schemas.APIResponse])
+async def get_patient_images(
+    patient_id: str,
+    limit: int = Query(database.DEFAULT_PAGE_SIZE, ge=1, le=database.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    page: int = 1,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    try:
+        result = await database.get_images_by_patient(patient_id, limit, cursor)
+        return typed_page(schemas.MedicalImagePage, result, limit, page, cursor)
+    except database.InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         return schemas.APIResponse(
             success=False,
@@ -254,6 +440,131 @@ async def get_patient_images(
             errors=[str(e)]
         )
 
+@app.api_route("/images/{image_id}/file", methods=["GET", "HEAD"])
+async def get_image_file(
+    image_id: str,
+    request: Request,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    image = await database.get_image_by_id(image_id)
+    if not image or not image.get("content_hash"):
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        return await delivery.serve_immutable_file(
+            request,
+            storage.blob_path(image["content_hash"]),
+            image["content_hash"],
+            image.get("file_type") or "application/octet-stream"
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image file is missing from storage")
+
+async def get_ready_image(image_id: str) -> dict:
+    """Load an image record whose derivatives have been built"""
+    image = await database.get_image_by_id(image_id)
+    if not image or not image.get("content_hash"):
+        raise HTTPException(status_code=404, detail="Image not found")
+    if not imaging.has_derivatives(image["content_hash"]):
+        raise HTTPException(status_code=404, detail="Image derivatives are not ready yet")
+    return image
+
+@app.get("/images/{image_id}/thumbnail")
+async def get_image_thumbnail(
+    image_id: str,
+    request: Request,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    image = await get_ready_image(image_id)
+    digest = image["content_hash"]
+    return await delivery.serve_immutable_file(
+        request, imaging.thumbnail_path(digest), f"{digest}-thumbnail", "image/png"
+    )
+
+@app.get("/images/{image_id}/pyramid", response_model=schemas.APIResponse)
+async def get_image_pyramid(
+    image_id: str,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    image = await get_ready_image(image_id)
+    return schemas.APIResponse(
+        success=True,
+        message="Pyramid retrieved successfully",
+        data=imaging.load_manifest(image["content_hash"])
+    )
+
+@app.get("/images/{image_id}/tiles/{level}/{x}/{y}")
+async def get_image_tile(
+    image_id: str,
+    level: int,
+    x: int,
+    y: int,
+    request: Request,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    image = await get_ready_image(image_id)
+    digest = image["content_hash"]
+    try:
+        return await delivery.serve_immutable_file(
+            request, imaging.tile_path(digest, level, x, y), f"{digest}-{level}-{x}-{y}", "image/png"
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+async def get_pixel_source(image_id: str):
+    """Open the memory-mapped pixel data behind a DICOM/TIFF image record"""
+    image = await database.get_image_by_id(image_id)
+    if not image or not image.get("content_hash"):
+        raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        source = await run_in_threadpool(pixels.open_pixel_source, storage.blob_path(image["content_hash"]))
+        return image, source
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image file is missing from storage")
+    except pixels.PixelFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+@app.get("/images/{image_id}/pixels", response_model=schemas.APIResponse)
+async def get_image_pixel_info(
+    image_id: str,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    _, source = await get_pixel_source(image_id)
+    return schemas.APIResponse(
+        success=True,
+        message="Pixel layout retrieved successfully",
+        data=source.describe()
+    )
+
+@app.get("/images/{image_id}/render")
+async def render_image(
+    image_id: str,
+    request: Request,
+    frame: int = 0,
+    center: Optional[float] = None,
+    width: Optional[float] = None,
+    function: str = "linear",
+    invert: Optional[bool] = None,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    image, source = await get_pixel_source(image_id)
+    if function not in pixels.WINDOW_FUNCTIONS:
+        raise HTTPException(status_code=400, detail=f"function must be one of {', '.join(pixels.WINDOW_FUNCTIONS)}")
+    if not 0 <= frame < source.frames:
+        raise HTTPException(status_code=400, detail=f"frame must be between 0 and {source.frames - 1}")
+
+    # Renders are a pure function of the blob and the parameters
+    digest = image["content_hash"]
+    etag = delivery.make_etag(f"{digest}-{frame}-{center}-{width}-{function}-{invert}")
+    headers = {"etag": etag, "cache-control": delivery.IMMUTABLE_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and delivery.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    def render() -> bytes:
+        return imaging.encode_png(pixels.render_frame(source, frame, center, width, function, invert))
+
+    return Response(content=await run_in_threadpool(render), media_type="image/png", headers=headers)
+
 # Report endpoints
 @app.post("/reports/", response_model=schemas.APIResponse)
 async def create_medical_report(
@@ -263,16 +574,17 @@ async def create_medical_report(
     try:
         # Create report
         report_dict = report_data.dict()
-        report_dict["created_by"] = current_user["user_id"]
+        report_dict["created_by"] = current_user.user_id
         report_dict["created_at"] = datetime.utcnow()
         report_dict["status"] = "draft"
         report_dict["version"] = 1
         
         report_id = await database.create_report(report_dict)
+        await versioning.record_initial_version(report_id, report_dict, current_user.user_id)
         
         # Create audit log
-        await database.create_audit_log({
-            "user_id": current_user["user_id"],
+        await audit.audit_log.log({
+            "user_id": current_user.user_id,
             "action": "create_report",
             "resource_type": "report",
             "resource_id": report_id,
@@ -292,18 +604,47 @@ async def create_medical_report(
             errors=[str(e)]
         )
 
-@app.get("/reports/patient/{patient_id}", response_model=schemas.APIResponse)
-async def get_patient_reports(
-    patient_id: str,
+@app.get("/reports/", response_model=Union[schemas.ReportQueryResponse, schemas.APIResponse])
+async def query_reports(
+    filters: schemas.ReportFilter = Depends(),
+    limit: int = Query(database.DEFAULT_PAGE_SIZE, ge=1, le=database.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    page: int = 1,
     current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
 ):
+    """Filter reports and count the matches per status and study type"""
     try:
-        reports = await database.get_reports_by_patient(patient_id)
+        created_by = filters.created_by
+        if current_user.role == schemas.UserRole.STUDENT:
+            created_by = current_user.user_id
+        query = database.build_report_filter_query(
+            filters.patient_id, filters.study_type, filters.status,
+            created_by, filters.date_from, filters.date_to
+        )
+        result = await database.query_reports(query, limit, cursor)
+        return typed_page(schemas.ReportQueryResponse, result, limit, page, cursor, facets=result["facets"])
+    except database.InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
         return schemas.APIResponse(
-            success=True,
-            message="Reports retrieved successfully",
-            data=reports
+            success=False,
+            message="Failed to query reports",
+            errors=[str(e)]
         )
+
+@app.get("/reports/patient/{patient_id}", response_model=Union[schemas.ReportPage, schemas.APIResponse])
+async def get_patient_reports(
+    patient_id: str,
+    limit: int = Query(database.DEFAULT_PAGE_SIZE, ge=1, le=database.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    page: int = 1,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    try:
+        result = await database.get_reports_by_patient(patient_id, limit, cursor)
+        return typed_page(schemas.ReportPage, result, limit, page, cursor)
+    except database.InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         return schemas.APIResponse(
             success=False,
@@ -311,6 +652,78 @@ async def get_patient_reports(
             errors=[str(e)]
         )
 
+def sse_event(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+
+async def report_generation_events(image: dict, study_type: str):
+    """Server-sent events for one streamed report: start, token..., then done or error.
+
+    When the client disconnects, Starlette cancels this generator while it
+    waits for the next token, which closes the upstream model stream.
+    """
+    started = time.perf_counter()
+    model_version = agents.ai_assistant.model_version
+    content_hash = image.get("content_hash")
+    yield sse_event("start", {"image_id": str(image["_id"]), "study_type": study_type, "model_version": model_version})
+
+    cached = None
+    if content_hash:
+        cached = await cache.analysis_cache.get(content_hash, study_type, model_version)
+
+    parts = []
+    first_token_ms = None
+    try:
+        if cached is not None:
+            parts.append(cached)
+            first_token_ms = (time.perf_counter() - started) * 1000
+            yield sse_event("token", {"text": cached})
+        else:
+            tokens = agents.ai_assistant.stream_report(image.get("image_url"), study_type, image.get("description"))
+            async for text in tokens:
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started) * 1000
+                parts.append(text)
+                yield sse_event("token", {"text": text})
+    except Exception as e:
+        yield sse_event("error", {"message": str(e)})
+        return
+
+    report = "".join(parts)
+    if cached is None and content_hash and report:
+        await cache.analysis_cache.set(content_hash, study_type, model_version, report)
+    yield sse_event("done", {
+        "text": report,
+        "cached": cached is not None,
+        "time_to_first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1)
+    })
+
+@app.post("/reports/generate/{image_id}/stream")
+async def stream_report_generation(
+    image_id: str,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    """Draft a report for an image, streamed token by token as server-sent events"""
+    image = await database.get_image_by_id(image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    study_type = image.get("study_type") or "general"
+    
+    await audit.audit_log.log({
+        "user_id": current_user.user_id,
+        "action": "generate_report",
+        "resource_type": "image",
+        "resource_id": image_id,
+        "timestamp": datetime.utcnow(),
+        "details": {"study_type": study_type, "streamed": True}
+    })
+    
+    return StreamingResponse(
+        report_generation_events(image, study_type),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.put("/reports/{report_id}", response_model=schemas.APIResponse)
 async def update_medical_report(
     report_id: str,
@@ -321,24 +734,27 @@ async def update_medical_report(
         update_data = {k: v for k, v in report_update.dict().items() if v is not None}
         update_data["updated_at"] = datetime.utcnow()
         
-        success = await database.update_report(report_id, update_data)
+        # Pending autosaves land first so this update is based on them
+        await autosave.report_autosaver.flush(report_id)
+        version = await versioning.update_report(report_id, update_data, current_user.user_id)
         
-        if not success:
+        if version is None:
             raise HTTPException(status_code=404, detail="Report not found")
         
-        # Create audit log
-        await database.create_audit_log({
-            "user_id": current_user["user_id"],
+        # Create audit log (the content itself lives in the version history)
+        await audit.audit_log.log({
+            "user_id": current_user.user_id,
             "action": "update_report",
             "resource_type": "report",
             "resource_id": report_id,
             "timestamp": datetime.utcnow(),
-            "details": update_data
+            "details": {"version": version["version"], "changed": version["changed"]}
         })
         
         return schemas.APIResponse(
             success=True,
-            message="Report updated successfully"
+            message="Report updated successfully",
+            data={"version": version["version"]}
         )
     except HTTPException:
         raise
@@ -349,8 +765,150 @@ async def update_medical_report(
             errors=[str(e)]
         )
 
-# AI Analysis endpoint (enhanced)
-@app.post("/analyze", response_model=schemas.APIResponse)
+@app.patch("/reports/{report_id}", response_model=schemas.APIResponse)
+async def autosave_medical_report(
+    report_id: str,
+    changes: schemas.ReportAutosave,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    """Apply editor text deltas; bursts are coalesced into one write per window"""
+    try:
+        result = await autosave.report_autosaver.apply(
+            report_id,
+            changes.editor_id or current_user.user_id,
+            current_user.user_id,
+            changes.base_version,
+            changes.deltas
+        )
+        if result is None:
+            raise HTTPException(status_code=404, detail="Report not found")
+        return schemas.APIResponse(
+            success=True,
+            message="Report changes accepted",
+            data=result
+        )
+    except autosave.AutosaveConflict as e:
+        detail = {"message": str(e), "current_version": e.current_version}
+        if e.unsaved is not None:
+            detail["unsaved"] = e.unsaved
+        raise HTTPException(status_code=409, detail=detail)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        return schemas.APIResponse(
+            success=False,
+            message="Failed to autosave report",
+            errors=[str(e)]
+        )
+
+async def get_report_version_or_404(report_id: str, version: int) -> dict:
+    report_version = await versioning.get_version(report_id, version)
+    if report_version is None:
+        raise HTTPException(status_code=404, detail="Report version not found")
+    return report_version
+
+@app.get("/reports/{report_id}/versions", response_model=schemas.APIResponse)
+async def list_report_versions(
+    report_id: str,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    try:
+        report = await database.get_report_by_id(report_id)
+        if report:
+            await versioning.store_pending_version(report)
+        versions = await database.list_report_versions(report_id)
+        if not versions:
+            raise HTTPException(status_code=404, detail="Report not found")
+        return schemas.APIResponse(
+            success=True,
+            message="Report versions retrieved successfully",
+            data=versions
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        return schemas.APIResponse(
+            success=False,
+            message="Failed to retrieve report versions",
+            errors=[str(e)]
+        )
+
+@app.get("/reports/{report_id}/versions/{version}", response_model=schemas.APIResponse)
+async def get_report_version(
+    report_id: str,
+    version: int = Path(..., ge=1),
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    try:
+        return schemas.APIResponse(
+            success=True,
+            message="Report version retrieved successfully",
+            data=await get_report_version_or_404(report_id, version)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        return schemas.APIResponse(
+            success=False,
+            message="Failed to retrieve report version",
+            errors=[str(e)]
+        )
+
+@app.get("/reports/{report_id}/diff", response_model=schemas.APIResponse)
+async def diff_report_versions(
+    report_id: str,
+    from_version: int = Query(..., ge=1),
+    to_version: Optional[int] = Query(None, ge=1),
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    """Field changes from one version to another (defaults to the next version)"""
+    try:
+        versions = await asyncio.gather(
+            get_report_version_or_404(report_id, from_version),
+            get_report_version_or_404(report_id, to_version or from_version + 1),
+            return_exceptions=True
+        )
+        for result in versions:
+            if isinstance(result, Exception):
+                raise result
+        old, new = versions
+        return schemas.APIResponse(
+            success=True,
+            message="Report diff retrieved successfully",
+            data={
+                "from_version": old["version"],
+                "to_version": new["version"],
+                "changes": versioning.diff_versions(old, new)
+            }
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        return schemas.APIResponse(
+            success=False,
+            message="Failed to diff report versions",
+            errors=[str(e)]
+        )
+
+# AI Analysis endpoints (asynchronous jobs)
+JOB_POLL_INTERVAL = 2.0
+
+def serialize_job(job: dict) -> schemas.AnalysisJobResponse:
+    return schemas.AnalysisJobResponse(id=str(job["_id"]), **{k: v for k, v in job.items() if k != "_id"})
+
+async def get_visible_job(job_id: str, current_user: schemas.Principal) -> dict:
+    """Load a job the current user is allowed to see"""
+    job = await database.get_analysis_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    if current_user.role == schemas.UserRole.STUDENT and job["user_id"] != current_user.user_id:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    return job
+
+@app.post("/analyze", response_model=schemas.APIResponse, status_code=202)
+@storage.accepts_uploads()
 async def analyze_image(
     file: UploadFile = File(...),
     study_type: str = Form("general"),
@@ -358,31 +916,40 @@ async def analyze_image(
     current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
 ):
     try:
-        # Save file temporarily for analysis
-        os.makedirs("uploads", exist_ok=True)
-        file_path = f"uploads/temp_{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Generate AI analysis
-        analysis_result = await agents.ai_assistant.generate_report(
-            f"http://localhost:8000/{file_path}", 
-            study_type
-        )
-        
-        # Clean up temporary file
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Scratch copy for the worker; the job deletes it when it finishes
+        stored = await storage.save_scratch(file)
+        try:
+            # Identical image + study type analyzed before: answer without queuing
+            cached = await cache.analysis_cache.get(stored.sha256, study_type, agents.ai_assistant.model_version)
+
+            job_id = await jobs.analysis_queue.submit({
+                "user_id": current_user.user_id,
+                "study_type": study_type,
+                "patient_id": patient_id,
+                "content_hash": stored.sha256,
+                "source_path": stored.path
+            }, result=cached)
+        except BaseException:
+            await storage.remove_scratch(stored.path)
+            raise
+        if cached is not None:
+            await storage.remove_scratch(stored.path)
         
         return schemas.APIResponse(
             success=True,
-            message="Analysis completed successfully",
+            message="Analysis queued" if cached is None else "Analysis completed",
             data={
-                "analysis": analysis_result,
+                "job_id": job_id,
+                "status": schemas.JobStatus.QUEUED if cached is None else schemas.JobStatus.COMPLETED,
+                "result": cached,
                 "study_type": study_type,
                 "patient_id": patient_id
             }
         )
+    except jobs.QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         return schemas.APIResponse(
             success=False,
@@ -390,10 +957,225 @@ async def analyze_image(
             errors=[str(e)]
         )
 
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "64"))
+BATCH_CHUNK_SIZE = 8
+# Model calls from all batch requests in this process share these slots
+BATCH_REPORT_CONCURRENCY = int(os.getenv("BATCH_REPORT_CONCURRENCY", "4"))
+_batch_report_slots: Optional[asyncio.Semaphore] = None
+
+def batch_report_slots() -> asyncio.Semaphore:
+    global _batch_report_slots
+    if _batch_report_slots is None:
+        _batch_report_slots = asyncio.Semaphore(BATCH_REPORT_CONCURRENCY)
+    return _batch_report_slots
+
+async def analyze_batch_chunk(items: List[dict], study_type: str) -> List[dict]:
+    """Decode and analyze one chunk as a single stack in the process pool"""
+    analysis = await agents.ai_assistant.analyze_files([item["path"] for item in items])
+    results = []
+    for i, item in enumerate(items):
+        result = {k: v for k, v in item.items() if k != "path"}
+        if analysis["errors"][i]:
+            result["error"] = analysis["errors"][i]
+        else:
+            result["features"] = analysis["features"][i]
+            result["annotations"] = analysis["annotations"][i]
+            try:
+                async with batch_report_slots():
+                    result["report"] = await agents.ai_assistant.generate_report_cached(
+                        item["content_hash"], item["path"], study_type
+                    )
+            except Exception as e:
+                print(f"Batch report for {item['content_hash']} failed: {e}")
+                result["error"] = "Report generation failed"
+        results.append(result)
+    return results
+
+@app.post("/analyze/batch")
+@storage.accepts_uploads(MAX_BATCH_SIZE)
+async def analyze_batch(
+    files: List[UploadFile] = File([]),
+    image_ids: List[str] = Form([]),
+    study_type: str = Form("general"),
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    """Analyze many uploads and/or stored images; results stream back as NDJSON lines"""
+    files = files or []
+    image_ids = image_ids or []
+    if not files and not image_ids:
+        raise HTTPException(status_code=400, detail="Provide files or image_ids to analyze")
+    if len(files) + len(image_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {MAX_BATCH_SIZE} images")
+
+    # Everything is read before streaming starts; uploads are closed once the handler returns.
+    # Uploaded files only live in scratch storage until the stream ends.
+    items, scratch = [], []
+
+    async def remove_uploads():
+        for path in scratch:
+            await storage.remove_scratch(path)
+
+    try:
+        for file in files:
+            stored = await storage.save_scratch(file)
+            scratch.append(stored.path)
+            items.append({"file_name": file.filename, "content_hash": stored.sha256, "path": stored.path})
+        images = {}
+        if image_ids:
+            images = {str(image["_id"]): image for image in await database.get_images_by_ids(image_ids)}
+        for image_id in image_ids:
+            image = images.get(image_id)
+            if not image or not image.get("content_hash"):
+                raise HTTPException(status_code=404, detail=f"Image {image_id} not found")
+            items.append({
+                "image_id": image_id,
+                "content_hash": image["content_hash"],
+                "path": storage.blob_path(image["content_hash"])
+            })
+    except BaseException:
+        await remove_uploads()
+        raise
+    for index, item in enumerate(items):
+        item["index"] = index
+
+    async def stream_results():
+        chunks = [
+            asyncio.ensure_future(analyze_batch_chunk(items[start:start + BATCH_CHUNK_SIZE], study_type))
+            for start in range(0, len(items), BATCH_CHUNK_SIZE)
+        ]
+        try:
+            for finished in asyncio.as_completed(chunks):
+                for result in await finished:
+                    yield json.dumps(result) + "\n"
+        finally:
+            # A dropped client leaves chunks running; stop them before their files go
+            for chunk in chunks:
+                chunk.cancel()
+            await asyncio.gather(*chunks, return_exceptions=True)
+            await asyncio.shield(remove_uploads())
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/analyze/jobs/{job_id}", response_model=schemas.APIResponse)
+async def get_analysis_job(
+    job_id: str,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.STUDENT, schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    job = await get_visible_job(job_id, current_user)
+    return schemas.APIResponse(
+        success=True,
+        message="Analysis job retrieved successfully",
+        data=serialize_job(job)
+    )
+
+@app.get("/analyze/cache/stats", response_model=schemas.APIResponse)
+async def get_analysis_cache_stats(
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    return schemas.APIResponse(
+        success=True,
+        message="Cache statistics retrieved successfully",
+        data={
+            "model_version": agents.ai_assistant.model_version,
+            **cache.analysis_cache.stats(),
+            "metadata": database.metadata_cache.stats()
+        }
+    )
+
+@app.get("/analyze/performance", response_model=schemas.APIResponse)
+async def get_analysis_performance(
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    return schemas.APIResponse(
+        success=True,
+        message="Feature extraction timings retrieved successfully",
+        data={"feature_extraction": agents.ai_assistant.feature_timings.summary()}
+    )
+
+@app.websocket("/analyze/jobs/{job_id}/ws")
+async def watch_analysis_job(websocket: WebSocket, job_id: str, token: str):
+    """Push the job state once it finishes (browsers pass the token as a query parameter)"""
+    try:
+        current_user = auth.token_verifier.verify(token)
+    except JWTError:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    try:
+        try:
+            job = await get_visible_job(job_id, current_user)
+        except HTTPException as e:
+            await websocket.send_json({"error": e.detail})
+            return
+        # Jobs queued on another API worker are picked up by re-reading Mongo
+        while job["status"] not in jobs.TERMINAL_STATUSES:
+            await websocket.send_json({"id": job_id, "status": job["status"]})
+            await jobs.analysis_queue.wait(job_id, JOB_POLL_INTERVAL)
+            job = await database.get_analysis_job(job_id)
+        await websocket.send_text(serialize_job(job).model_dump_json())
+    except WebSocketDisconnect:
+        return
+    finally:
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close()
+
+# Bulk export endpoints
+def export_response(name: str, query: dict, compress: bool) -> StreamingResponse:
+    filename = f"{name}-{datetime.utcnow():%Y%m%dT%H%M%S}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        export.export_stream(name, query, compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"content-disposition": f'attachment; filename="{filename}"'}
+    )
+
+async def log_export(current_user: schemas.Principal, name: str, query: dict):
+    await audit.audit_log.log({
+        "user_id": current_user.user_id,
+        "action": f"export_{name}",
+        "resource_type": name,
+        "timestamp": datetime.utcnow(),
+        "details": {"filters": json.loads(json.dumps(query, default=str))}
+    })
+
+@app.get("/export/reports")
+async def export_reports(
+    user_id: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    compress: bool = False,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.INSTRUCTOR, schemas.UserRole.ADMIN]))
+):
+    """Stream reports as NDJSON (optionally gzipped), oldest first"""
+    query = export.build_export_query("reports", user_id, date_from, date_to)
+    await log_export(current_user, "reports", query)
+    return export_response("reports", query, compress)
+
+@app.get("/export/audit-logs")
+async def export_audit_logs(
+    user_id: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    compress: bool = False,
+    current_user=Depends(auth.RoleChecker([schemas.UserRole.ADMIN]))
+):
+    """Stream audit log entries as NDJSON (optionally gzipped), oldest first"""
+    query = export.build_export_query("audit_logs", user_id, date_from, date_to)
+    await log_export(current_user, "audit_logs", query)
+    return export_response("audit_logs", query, compress)
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    if database.INDEX_BUILD_MODE == "off":
+        indexes = "unmanaged"
+    else:
+        indexes = "ready" if database.db.indexes_ready else "building"
+    return {"status": "healthy", "timestamp": datetime.utcnow(), "indexes": indexes}
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 if __name__ == "__main__":
     import uvicorn
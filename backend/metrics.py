@@ -0,0 +1,256 @@
+import time
+import asyncio
+import bisect
+import inspect
+import functools
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from pymongo import monitoring
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Minimal Prometheus-style metrics
+#
+# Metrics are plain dicts of label tuples guarded by one lock, because pymongo
+# reports command events from Motor's worker threads. Everything is rendered
+# in the Prometheus text exposition format by render().
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_lock = threading.Lock()
+_registry: List["Metric"] = []
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+                for labels, value in sorted(self._values.items())]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+def render() -> str:
+    """All registered metrics in Prometheus text format"""
+    with _lock:
+        lines = [line for metric in _registry for line in metric.render()]
+    return "\n".join(lines) + "\n"
+
+# HTTP
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+http_requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+http_request_errors = Counter(
+    "http_request_errors_total", "HTTP requests that raised or returned a 5xx", ("method", "route")
+)
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every HTTP request by its route template.
+
+    Requests that match no route share one "unmatched" label so stray URLs
+    cannot blow up the label set.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            route_label = getattr(route, "path", None) or "unmatched"
+            http_request_duration.observe(elapsed, scope["method"], route_label, str(status_code))
+            if status_code >= 500:
+                http_request_errors.inc(scope["method"], route_label)
+
+# MongoDB
+
+mongo_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection and command",
+    ("collection", "command"), buckets=DB_BUCKETS
+)
+mongo_command_failures = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that failed", ("collection", "command")
+)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command the driver sends, keyed by collection and command name"""
+
+    def __init__(self):
+        self._pending: Dict[Tuple[int, int], str] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        # getMore names its cursor id first and the collection separately
+        key = "collection" if event.command_name == "getMore" else event.command_name
+        target = event.command.get(key)
+        self._pending[(event.request_id, event.operation_id)] = target if isinstance(target, str) else ""
+
+    def _finish(self, event) -> str:
+        return self._pending.pop((event.request_id, event.operation_id), "")
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        collection = self._finish(event)
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection = self._finish(event)
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+        mongo_command_failures.inc(collection, event.command_name)
+
+# AI service
+
+ai_calls = Counter("ai_calls_total", "AIService calls by method and outcome", ("method", "outcome"))
+ai_call_duration = Histogram("ai_call_duration_seconds", "AIService call latency by method", ("method",))
+ai_time_to_first_token = Histogram(
+    "ai_time_to_first_token_seconds", "Time until a streaming AIService method yields its first chunk", ("method",)
+)
+
+def track_ai(method: Optional[str] = None):
+    """Count and time an AIService method (sync, async or async generator).
+
+    Streaming methods also record time to first chunk; a stream closed
+    early by its consumer counts as "cancelled".
+    """
+    def decorator(func):
+        name = method or func.__name__
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def stream_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                outcome = "error"
+                first = True
+                stream = func(*args, **kwargs)
+                try:
+                    async for chunk in stream:
+                        if first:
+                            ai_time_to_first_token.observe(time.perf_counter() - started, name)
+                            first = False
+                        yield chunk
+                    outcome = "ok"
+                except (GeneratorExit, asyncio.CancelledError):
+                    outcome = "cancelled"
+                    raise
+                finally:
+                    ai_call_duration.observe(time.perf_counter() - started, name)
+                    ai_calls.inc(name, outcome)
+                    # Closed early: let the wrapped stream release what it holds
+                    await stream.aclose()
+            return stream_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                outcome = "error"
+                try:
+                    result = await func(*args, **kwargs)
+                    outcome = "ok"
+                    return result
+                finally:
+                    ai_call_duration.observe(time.perf_counter() - started, name)
+                    ai_calls.inc(name, outcome)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = func(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                ai_call_duration.observe(time.perf_counter() - started, name)
+                ai_calls.inc(name, outcome)
+        return wrapper
+    return decorator
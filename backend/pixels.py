@@ -0,0 +1,364 @@
+import os
+import struct
+import numpy as np
+from dataclasses import dataclass
+from typing import Optional, Tuple, Dict, Any
+
+class PixelFormatError(ValueError):
+    """The file is not an uncompressed DICOM or TIFF image we can map"""
+
+@dataclass
+class PixelSource:
+    """Location and layout of raw pixel data inside a file.
+
+    Nothing is read until `frame()` is called, and even then the data comes
+    from an np.memmap view, so only the pages actually touched are loaded.
+    """
+    path: str
+    offset: int
+    dtype: np.dtype
+    frames: int
+    rows: int
+    columns: int
+    samples: int = 1
+    photometric: str = "MONOCHROME2"
+    rescale_slope: float = 1.0
+    rescale_intercept: float = 0.0
+    window_center: Optional[float] = None
+    window_width: Optional[float] = None
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        if self.samples == 1:
+            return (self.frames, self.rows, self.columns)
+        return (self.frames, self.rows, self.columns, self.samples)
+
+    def memmap(self) -> np.memmap:
+        return np.memmap(self.path, dtype=self.dtype, mode="r", offset=self.offset, shape=self.shape)
+
+    def frame(self, index: int = 0) -> np.ndarray:
+        if not 0 <= index < self.frames:
+            raise IndexError(f"Frame {index} out of range (0-{self.frames - 1})")
+        return self.memmap()[index]
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "frames": self.frames,
+            "rows": self.rows,
+            "columns": self.columns,
+            "samples": self.samples,
+            "dtype": self.dtype.str,
+            "photometric": self.photometric,
+            "rescale_slope": self.rescale_slope,
+            "rescale_intercept": self.rescale_intercept,
+            "window_center": self.window_center,
+            "window_width": self.window_width,
+        }
+
+def open_pixel_source(path: str) -> PixelSource:
+    """Parse the header of a DICOM or TIFF file and locate its pixel data"""
+    with open(path, "rb") as f:
+        head = f.read(132)
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return read_tiff_header(path)
+    if head[128:132] == b"DICM":
+        return read_dicom_header(path)
+    raise PixelFormatError("Not a DICOM or TIFF file")
+
+def _check_extent(path: str, offset: int, nbytes: int, kind: str):
+    """Pixel data must lie entirely inside the file, or np.memmap fails later"""
+    if offset + nbytes > os.path.getsize(path):
+        raise PixelFormatError(f"{kind} pixel data extends past the end of the file (truncated?)")
+
+# TIFF (baseline, uncompressed, strip-organised)
+
+_TIFF_TYPES = {1: "B", 2: "c", 3: "H", 4: "I", 5: "II", 6: "b", 7: "B", 8: "h", 9: "i", 10: "ii", 11: "f", 12: "d"}
+
+def _read_tiff_tags(f, byte_order: str, ifd_offset: int) -> Dict[int, tuple]:
+    f.seek(ifd_offset)
+    (count,) = struct.unpack(byte_order + "H", f.read(2))
+    entries = f.read(12 * count)
+    tags = {}
+    for i in range(count):
+        tag, field_type, n, raw = struct.unpack(byte_order + "HHI4s", entries[12 * i:12 * i + 12])
+        fmt = _TIFF_TYPES.get(field_type)
+        if fmt is None:
+            continue
+        size = struct.calcsize(byte_order + fmt) * n
+        if size > 4:
+            position = f.tell()
+            (offset,) = struct.unpack(byte_order + "I", raw)
+            f.seek(offset)
+            raw = f.read(size)
+            f.seek(position)
+        tags[tag] = struct.unpack(byte_order + fmt * n, raw[:size])
+    return tags
+
+def read_tiff_header(path: str) -> PixelSource:
+    """Locate the first image of a TIFF file; strips must be stored back to back"""
+    with open(path, "rb") as f:
+        header = f.read(8)
+        byte_order = "<" if header[:2] == b"II" else ">"
+        magic, ifd_offset = struct.unpack(byte_order + "HI", header[2:8])
+        if magic != 42:
+            raise PixelFormatError("BigTIFF is not supported")
+        tags = _read_tiff_tags(f, byte_order, ifd_offset)
+
+    if tags.get(259, (1,))[0] != 1:
+        raise PixelFormatError("Compressed TIFF pixel data cannot be memory-mapped")
+    if 322 in tags:
+        raise PixelFormatError("Tiled TIFF files are not supported")
+    samples = tags.get(277, (1,))[0]
+    if samples > 1 and tags.get(284, (1,))[0] != 1:
+        raise PixelFormatError("Planar TIFF files are not supported")
+    bits = tags.get(258, (1,))[0]
+    sample_format = tags.get(339, (1,))[0]
+    kind = {1: "u", 2: "i", 3: "f"}.get(sample_format)
+    if kind is None or bits not in (8, 16, 32, 64) or (kind == "f" and bits < 32):
+        raise PixelFormatError(f"Unsupported TIFF sample layout ({bits}-bit, format {sample_format})")
+
+    offsets, counts = tags[273], tags[279]
+    for i in range(len(offsets) - 1):
+        if offsets[i] + counts[i] != offsets[i + 1]:
+            raise PixelFormatError("TIFF strips are not contiguous")
+    width, height = tags[256][0], tags[257][0]
+    if sum(counts) < width * height * samples * bits // 8:
+        raise PixelFormatError("TIFF strips are shorter than the image")
+    _check_extent(path, offsets[0], width * height * samples * bits // 8, "TIFF")
+
+    photometric = {0: "MONOCHROME1", 1: "MONOCHROME2", 2: "RGB"}.get(tags.get(262, (1,))[0], "MONOCHROME2")
+    return PixelSource(
+        path=path,
+        offset=offsets[0],
+        dtype=np.dtype(f"{byte_order}{kind}{bits // 8}"),
+        frames=1,
+        rows=height,
+        columns=width,
+        samples=samples,
+        photometric=photometric,
+    )
+
+# DICOM (Part 10, native little/big endian transfer syntaxes)
+
+IMPLICIT_VR_LE = "1.2.840.10008.1.2"
+EXPLICIT_VR_LE = "1.2.840.10008.1.2.1"
+EXPLICIT_VR_BE = "1.2.840.10008.1.2.2"
+
+_LONG_VRS = {b"OB", b"OD", b"OF", b"OL", b"OV", b"OW", b"SQ", b"SV", b"UC", b"UN", b"UR", b"UT", b"UV"}
+_UNDEFINED_LENGTH = 0xFFFFFFFF
+_ITEM = (0xFFFE, 0xE000)
+_ITEM_END = (0xFFFE, 0xE00D)
+_SEQUENCE_END = (0xFFFE, 0xE0DD)
+_PIXEL_DATA = (0x7FE0, 0x0010)
+
+# Tags we read, with their VRs for implicit-VR files
+_DICOM_TAGS = {
+    (0x0002, 0x0010): ("transfer_syntax", "UI"),
+    (0x0028, 0x0002): ("samples", "US"),
+    (0x0028, 0x0004): ("photometric", "CS"),
+    (0x0028, 0x0006): ("planar_configuration", "US"),
+    (0x0028, 0x0008): ("frames", "IS"),
+    (0x0028, 0x0010): ("rows", "US"),
+    (0x0028, 0x0011): ("columns", "US"),
+    (0x0028, 0x0100): ("bits_allocated", "US"),
+    (0x0028, 0x0103): ("pixel_representation", "US"),
+    (0x0028, 0x1050): ("window_center", "DS"),
+    (0x0028, 0x1051): ("window_width", "DS"),
+    (0x0028, 0x1052): ("rescale_intercept", "DS"),
+    (0x0028, 0x1053): ("rescale_slope", "DS"),
+}
+
+class _DicomReader:
+    def __init__(self, f, explicit: bool, byte_order: str):
+        self.f = f
+        self.explicit = explicit
+        self.byte_order = byte_order
+
+    def read_tag(self):
+        raw = self.f.read(4)
+        if len(raw) < 4:
+            return None
+        return struct.unpack(self.byte_order + "HH", raw)
+
+    def read_header(self, tag):
+        """Return (vr, length) for the element whose tag was just read"""
+        if tag[0] == 0xFFFE:
+            return None, struct.unpack(self.byte_order + "I", self.f.read(4))[0]
+        if self.explicit:
+            vr = self.f.read(2)
+            if vr in _LONG_VRS:
+                self.f.read(2)
+                return vr, struct.unpack(self.byte_order + "I", self.f.read(4))[0]
+            return vr, struct.unpack(self.byte_order + "H", self.f.read(2))[0]
+        length = struct.unpack(self.byte_order + "I", self.f.read(4))[0]
+        known = _DICOM_TAGS.get(tag)
+        return (known[1].encode() if known else None), length
+
+    def skip_undefined(self):
+        """Skip a sequence (or item) of undefined length up to its delimiter"""
+        while True:
+            tag = self.read_tag()
+            if tag is None or tag == _SEQUENCE_END or tag == _ITEM_END:
+                self.f.read(4)
+                return
+            _, length = self.read_header(tag)
+            if length == _UNDEFINED_LENGTH:
+                self.skip_undefined()
+            else:
+                self.f.seek(length, 1)
+
+    def decode(self, vr: bytes, raw: bytes):
+        if vr == b"US":
+            return struct.unpack(self.byte_order + "H", raw[:2])[0]
+        text = raw.decode("ascii", "ignore").strip("\x00 ")
+        if vr in (b"DS", b"IS"):
+            text = text.split("\\")[0].strip()
+            return float(text) if text else None
+        return text
+
+def read_dicom_header(path: str) -> PixelSource:
+    """Walk a DICOM file's elements up to Pixel Data without reading pixel values"""
+    values: Dict[str, Any] = {}
+    with open(path, "rb") as f:
+        f.seek(132)
+        reader = _DicomReader(f, explicit=True, byte_order="<")
+
+        # File meta information is always explicit VR little endian
+        while True:
+            position = f.tell()
+            tag = reader.read_tag()
+            if tag is None or tag[0] != 0x0002:
+                f.seek(position)
+                break
+            vr, length = reader.read_header(tag)
+            raw = f.read(length)
+            if tag in _DICOM_TAGS:
+                values[_DICOM_TAGS[tag][0]] = reader.decode(vr, raw)
+
+        transfer_syntax = values.get("transfer_syntax", IMPLICIT_VR_LE)
+        if transfer_syntax == IMPLICIT_VR_LE:
+            reader = _DicomReader(f, explicit=False, byte_order="<")
+        elif transfer_syntax == EXPLICIT_VR_LE:
+            reader = _DicomReader(f, explicit=True, byte_order="<")
+        elif transfer_syntax == EXPLICIT_VR_BE:
+            reader = _DicomReader(f, explicit=True, byte_order=">")
+        else:
+            raise PixelFormatError(f"Compressed transfer syntax {transfer_syntax} cannot be memory-mapped")
+
+        while True:
+            tag = reader.read_tag()
+            if tag is None:
+                raise PixelFormatError("DICOM file has no pixel data")
+            vr, length = reader.read_header(tag)
+            if tag == _PIXEL_DATA:
+                if length == _UNDEFINED_LENGTH:
+                    raise PixelFormatError("Encapsulated DICOM pixel data cannot be memory-mapped")
+                pixel_offset = f.tell()
+                break
+            if length == _UNDEFINED_LENGTH:
+                reader.skip_undefined()
+            elif tag in _DICOM_TAGS:
+                values[_DICOM_TAGS[tag][0]] = reader.decode(vr or _DICOM_TAGS[tag][1].encode(), f.read(length))
+            else:
+                f.seek(length, 1)
+
+    try:
+        rows, columns = values["rows"], values["columns"]
+    except KeyError:
+        raise PixelFormatError("DICOM file is missing Rows/Columns")
+    bits = values.get("bits_allocated", 16)
+    if bits not in (8, 16, 32):
+        raise PixelFormatError(f"Unsupported DICOM BitsAllocated {bits}")
+    samples = values.get("samples", 1)
+    if samples > 1 and values.get("planar_configuration", 0) != 0:
+        raise PixelFormatError("Planar DICOM colour data is not supported")
+    kind = "i" if values.get("pixel_representation", 0) == 1 else "u"
+    frames = int(values.get("frames") or 1)
+    _check_extent(path, pixel_offset, frames * rows * columns * samples * bits // 8, "DICOM")
+
+    return PixelSource(
+        path=path,
+        offset=pixel_offset,
+        dtype=np.dtype(f"{reader.byte_order}{kind}{bits // 8}"),
+        frames=frames,
+        rows=rows,
+        columns=columns,
+        samples=samples,
+        photometric=values.get("photometric") or "MONOCHROME2",
+        rescale_slope=values.get("rescale_slope") or 1.0,
+        rescale_intercept=values.get("rescale_intercept") or 0.0,
+        window_center=values.get("window_center"),
+        window_width=values.get("window_width"),
+    )
+
+# Window/level rendering
+
+WINDOW_FUNCTIONS = ("linear", "linear_exact", "sigmoid")
+BAND_ROWS = 256
+
+def apply_window(values: np.ndarray, center: float, width: float, function: str = "linear") -> np.ndarray:
+    """Map modality values to 0-255 with a DICOM VOI LUT function (PS3.3 C.11.2.1.2)"""
+    values = values.astype(np.float32, copy=False)
+    if function == "sigmoid":
+        scaled = 255.0 / (1.0 + np.exp(-4.0 * (values - center) / max(width, 1e-6)))
+    elif function == "linear_exact":
+        scaled = ((values - center) / max(width, 1e-6) + 0.5) * 255.0
+    elif width <= 1:
+        scaled = (values >= center) * 255.0
+    else:
+        scaled = ((values - (center - 0.5)) / (width - 1.0) + 0.5) * 255.0
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+def default_window(source: PixelSource, frame: np.ndarray) -> Tuple[float, float]:
+    """Window from the header, or the full modality range of the frame"""
+    if source.window_center is not None and source.window_width:
+        return source.window_center, source.window_width
+    low = float(frame.min()) * source.rescale_slope + source.rescale_intercept
+    high = float(frame.max()) * source.rescale_slope + source.rescale_intercept
+    if high < low:
+        low, high = high, low
+    return (low + high) / 2.0, max(high - low, 1.0)
+
+def render_frame(
+    source: PixelSource,
+    frame_index: int = 0,
+    center: Optional[float] = None,
+    width: Optional[float] = None,
+    function: str = "linear",
+    invert: Optional[bool] = None,
+) -> np.ndarray:
+    """Render one frame to 8 bits.
+
+    Integer sources up to 16 bits go through a lookup table built once per
+    call (rescale + window folded together), then the frame is mapped in
+    bands of rows so memory stays bounded regardless of frame size.
+    """
+    if function not in WINDOW_FUNCTIONS:
+        raise ValueError(f"Unknown window function '{function}'")
+    frame = source.frame(frame_index)
+    if center is None or width is None:
+        default_center, default_width = default_window(source, frame)
+        center = default_center if center is None else center
+        width = default_width if width is None else width
+    if invert is None:
+        invert = source.photometric == "MONOCHROME1"
+
+    lut = None
+    if source.dtype.kind in "ui" and source.dtype.itemsize <= 2:
+        info = np.iinfo(source.dtype)
+        stored = np.arange(info.min, info.max + 1, dtype=np.float32)
+        lut = apply_window(stored * source.rescale_slope + source.rescale_intercept, center, width, function)
+        if invert:
+            lut = 255 - lut
+        lut_offset = -info.min
+
+    output = np.empty(frame.shape, dtype=np.uint8)
+    for start in range(0, frame.shape[0], BAND_ROWS):
+        band = frame[start:start + BAND_ROWS]
+        if lut is not None:
+            output[start:start + BAND_ROWS] = lut[band] if lut_offset == 0 else lut[band.astype(np.int32) + lut_offset]
+        else:
+            values = band.astype(np.float32) * source.rescale_slope + source.rescale_intercept
+            rendered = apply_window(values, center, width, function)
+            output[start:start + BAND_ROWS] = 255 - rendered if invert else rendered
+    return output
@@ -13,6 +13,17 @@ class ReportStatus(str, Enum):
     FINALIZED = "finalized"
     REVIEWED = "reviewed"
 
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class SearchMode(str, Enum):
+    PREFIX = "prefix"
+    SUBSTRING = "substring"
+    TEXT = "text"
+
 class StudyType(str, Enum):
     CHEST_XRAY = "chest_xray"
     ABDOMINAL_CT = "abdominal_ct"
@@ -63,6 +74,16 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     email: Optional[str] = None
 
+class Principal(BaseModel):
+    """Verified identity carried by an access token"""
+    sub: str
+    user_id: str
+    role: UserRole
+    exp: datetime
+
+    class Config:
+        frozen = True
+
 class LoginRequest(BaseModel):
     email: EmailStr
     password: str
@@ -105,6 +126,8 @@ class MedicalImageResponse(MedicalImageBase):
     id: str
     uploaded_by: str
     created_at: datetime
+    thumbnail_url: Optional[str] = None
+    derivatives: Optional[str] = None
     ai_analysis: Optional[Dict[str, Any]] = None
     annotations: Optional[List[Dict[str, Any]]] = []
     
@@ -143,6 +166,11 @@ class ReportUpdate(BaseModel):
     reviewed_by: Optional[str] = None
     review_notes: Optional[str] = None
 
+class ReportAutosave(BaseModel):
+    base_version: int
+    deltas: Dict[str, List[List[Any]]]
+    editor_id: Optional[str] = None
+
 class ReportResponse(ReportBase):
     id: str
     created_by: str
@@ -156,6 +184,19 @@ class ReportResponse(ReportBase):
     class Config:
         from_attributes = True
 
+# Analysis Job Schemas
+class AnalysisJobResponse(BaseModel):
+    id: str
+    status: JobStatus
+    study_type: str
+    patient_id: Optional[str] = None
+    content_hash: str
+    result: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
 # Audit Log Schemas
 class AuditLogBase(BaseModel):
     user_id: str
@@ -187,10 +228,41 @@ class PaginatedResponse(BaseModel):
     per_page: int
     has_next: bool
     has_prev: bool
+    next_cursor: Optional[str] = None
+
+# Typed list pages
+class PatientPage(PaginatedResponse):
+    data: List[PatientResponse]
+
+class ThumbnailReference(BaseModel):
+    image_id: str
+    thumbnail_url: Optional[str] = None
+    study_type: Optional[StudyType] = None
+    derivatives: Optional[str] = None
+
+class PatientDashboardItem(PatientResponse):
+    image_count: int = 0
+    report_count: int = 0
+    latest_report_status: Optional[ReportStatus] = None
+    latest_report_at: Optional[datetime] = None
+    thumbnails: List[ThumbnailReference] = []
+
+class PatientDashboardPage(PaginatedResponse):
+    data: List[PatientDashboardItem]
+
+class MedicalImagePage(PaginatedResponse):
+    data: List[MedicalImageResponse]
+
+class ReportPage(PaginatedResponse):
+    data: List[ReportResponse]
+
+class ReportQueryResponse(ReportPage):
+    facets: Dict[str, Dict[str, int]] = {}
 
 # Search and Filter Schemas
 class PatientFilter(BaseModel):
     search: Optional[str] = None
+    mode: SearchMode = SearchMode.PREFIX
     created_by: Optional[str] = None
     date_from: Optional[datetime] = None
     date_to: Optional[datetime] = None
@@ -0,0 +1,383 @@
+import io
+import os
+import time
+import hashlib
+import itertools
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+# Uploads that are only analyzed, never kept; deleted once their job is done
+SCRATCH_DIR = os.path.join(UPLOAD_DIR, "scratch")
+# Multipart uploads being received; on the same filesystem as the stores
+# above, so a finished upload is renamed into place rather than copied
+INCOMING_DIR = os.path.join(UPLOAD_DIR, "incoming")
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 1024 * 1024
+# Uploads up to this size stay in memory while the request is parsed
+SPOOL_MEMORY_SIZE = 1024 * 1024
+# Allowance for boundaries, part headers and plain fields in a multipart body
+FORM_OVERHEAD = 64 * 1024
+
+@dataclass
+class StoredUpload:
+    path: str
+    sha256: str
+    size: int
+    deduplicated: bool = False
+
+def _write_chunk(buffer, hasher, chunk: bytes):
+    """Hash and write one chunk; runs in the threadpool (hashlib releases the GIL)"""
+    if hasher is not None:
+        hasher.update(chunk)
+    buffer.write(chunk)
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File exceeds the maximum upload size of {max_size} bytes"
+    )
+
+def _check_declared_size(file: UploadFile, max_size: int):
+    """Reject uploads whose declared size is already over the limit"""
+    if file.size is not None and file.size > max_size:
+        raise _too_large(max_size)
+
+# Receiving uploads
+#
+# Starlette's form parser spools every file part to an anonymous temporary
+# file, which then has to be copied into the stores. Endpoints marked with
+# accepts_uploads() parse their body with UploadSpool files instead: the
+# body is refused up front when its Content-Length is over the limit, each
+# part is hashed and size-checked as it arrives, and a part that outgrows
+# memory spills to a named file in INCOMING_DIR which is later renamed to
+# its final path. An upload therefore reaches the disk at most once.
+
+class UploadSpool:
+    """File object for one uploaded part: hashes and counts data as it is
+    written, keeping it in memory up to SPOOL_MEMORY_SIZE and in a file in
+    INCOMING_DIR beyond that"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.path: Optional[str] = None
+        self._hasher = hashlib.sha256()
+        self._file = io.BytesIO()
+        # Read by UploadFile: once on disk, its reads and writes go to the threadpool
+        self._rolled = False
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise _too_large(self.max_size)
+        self._hasher.update(data)
+        if not self._rolled and self.size > SPOOL_MEMORY_SIZE:
+            self._rollover()
+        return self._file.write(data)
+
+    def _rollover(self):
+        os.makedirs(INCOMING_DIR, exist_ok=True)
+        self.path = os.path.join(INCOMING_DIR, f".incoming-{uuid.uuid4().hex}")
+        spilled = open(self.path, "w+b")
+        spilled.write(self._file.getbuffer())
+        self._file = spilled
+        self._rolled = True
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def move_to(self, path: str):
+        """Rename the spilled file to path (only for spools that are on disk)"""
+        self._file.close()
+        os.replace(self.path, path)
+        self.path = None
+
+    def close(self):
+        self._file.close()
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+class _SpoolingParser(MultiPartParser):
+    """Starlette's multipart parser with UploadSpool in place of its temporary files"""
+
+    def __init__(self, *args, max_file_size: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_file_size = max_file_size
+
+    def on_headers_finished(self) -> None:
+        super().on_headers_finished()
+        upload = self._current_part.file
+        if upload is not None:
+            upload.file = self._files_to_close_on_error[-1] = UploadSpool(self.max_file_size)
+
+    async def parse(self):
+        try:
+            return await super().parse()
+        except BaseException:
+            # Starlette only cleans up after MultiPartException; a 413 or a
+            # dropped client must not leave spilled files behind either
+            for file in self._files_to_close_on_error:
+                file.close()
+            raise
+
+class UploadRequest(Request):
+    max_files = 1
+
+    async def _get_form(self, *, max_files=1000, max_fields=1000):
+        content_type = self.headers.get("content-type", "")
+        if self._form is None and content_type.startswith("multipart/form-data"):
+            limit = self.max_files * MAX_FILE_SIZE + FORM_OVERHEAD
+            declared = self.headers.get("content-length", "")
+            if declared.isdigit() and int(declared) > limit:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Upload exceeds the maximum of {self.max_files} file(s) of {MAX_FILE_SIZE} bytes"
+                )
+            parser = _SpoolingParser(
+                self.headers, self.stream(),
+                max_files=self.max_files, max_fields=max_fields, max_file_size=MAX_FILE_SIZE
+            )
+            try:
+                self._form = await parser.parse()
+            except MultiPartException as exc:
+                raise HTTPException(status_code=400, detail=exc.message)
+        return await super()._get_form(max_files=max_files, max_fields=max_fields)
+
+class UploadRoute(APIRoute):
+    """Route class of the app; endpoints marked with accepts_uploads() receive
+    their files as UploadSpools"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        max_files = getattr(self.endpoint, "max_upload_files", None)
+        if max_files is None:
+            return handler
+
+        async def upload_handler(request: Request):
+            request = UploadRequest(request.scope, request.receive)
+            request.max_files = max_files
+            return await handler(request)
+        return upload_handler
+
+def accepts_uploads(max_files: int = 1):
+    """Mark an endpoint that takes up to max_files uploads of MAX_FILE_SIZE each"""
+    def mark(endpoint):
+        endpoint.max_upload_files = max_files
+        return endpoint
+    return mark
+
+def _spool(file: UploadFile) -> Optional[UploadSpool]:
+    return file.file if isinstance(file.file, UploadSpool) else None
+
+async def _write_temp(file: UploadFile, directory: str, max_size: int, hash_chunks: bool = True):
+    """Stream an upload to a temporary file in directory, hashing it on the way.
+
+    Returns (temp_path, sha256, size), with sha256 None when hash_chunks is
+    off; the temporary file is removed if the upload fails or is too large.
+    """
+    _check_declared_size(file, max_size)
+    await run_in_threadpool(os.makedirs, directory, exist_ok=True)
+
+    temp_path = os.path.join(directory, f".incoming-{uuid.uuid4().hex}")
+    hasher = hashlib.sha256() if hash_chunks else None
+    size = 0
+    buffer = await run_in_threadpool(open, temp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise _too_large(max_size)
+            await run_in_threadpool(_write_chunk, buffer, hasher, chunk)
+        await run_in_threadpool(buffer.close)
+    except BaseException:
+        await run_in_threadpool(buffer.close)
+        if os.path.exists(temp_path):
+            await run_in_threadpool(os.remove, temp_path)
+        raise
+    return temp_path, hasher.hexdigest() if hasher is not None else None, size
+
+async def _place(file: UploadFile, path: str, max_size: int):
+    """Put an upload at path: a spilled spool is renamed there, anything else
+    goes through a temporary file next to it"""
+    directory = os.path.dirname(path) or "."
+    spool = _spool(file)
+    if spool is not None and spool.path is not None:
+        await run_in_threadpool(os.makedirs, directory, exist_ok=True)
+        await run_in_threadpool(spool.move_to, path)
+        return
+    temp_path, _, _ = await _write_temp(file, directory, max_size, hash_chunks=False)
+    try:
+        await run_in_threadpool(os.replace, temp_path, path)
+    except BaseException:
+        await remove_file(temp_path)
+        raise
+
+async def save_upload(file: UploadFile, file_path: str, max_size: int = MAX_FILE_SIZE) -> StoredUpload:
+    """Stream an upload to disk in fixed-size chunks, hashing it on the way.
+
+    Disk I/O happens in the threadpool so the event loop keeps serving other
+    requests. Data is written to a temporary file next to the destination and
+    only renamed into place once the whole upload has passed the size check.
+    A spooled upload was hashed and checked while it was received, so it is
+    just moved there.
+    """
+    if _spool(file) is None:
+        temp_path, digest, size = await _write_temp(file, os.path.dirname(file_path) or ".", max_size)
+        await run_in_threadpool(os.replace, temp_path, file_path)
+        return StoredUpload(path=file_path, sha256=digest, size=size)
+    digest, size = await _hash_upload(file, max_size)
+    await _place(file, file_path, max_size)
+    return StoredUpload(path=file_path, sha256=digest, size=size)
+
+async def remove_file(file_path: str):
+    """Delete a file without blocking the event loop"""
+    if os.path.exists(file_path):
+        await run_in_threadpool(os.remove, file_path)
+
+async def save_scratch(file: UploadFile, max_size: int = MAX_FILE_SIZE) -> StoredUpload:
+    """Store an upload that is only needed until it has been analyzed"""
+    extension = os.path.splitext(file.filename or "")[1]
+    return await save_upload(file, os.path.join(SCRATCH_DIR, f"{uuid.uuid4().hex}{extension}"), max_size)
+
+async def remove_scratch(file_path: str):
+    """Delete a scratch upload; paths outside the scratch area are left alone"""
+    if os.path.dirname(os.path.abspath(file_path)) == os.path.abspath(SCRATCH_DIR):
+        await remove_file(file_path)
+
+# Content-addressed blob store
+#
+# Blobs live at blobs/<aa>/<bb>/<sha256>, so identical uploads share one file
+# and no directory grows past 65536 entries. Blobs are shared by every
+# medical_images record carrying their content_hash, so deduplicated uploads
+# only cost a metadata insert. That count of records is a blob's reference
+# count: collect_garbage deletes blobs (and derivatives) nothing references
+# once they are older than a grace period, which covers uploads between
+# storing the blob and inserting their record.
+
+BLOB_GC_GRACE = int(os.getenv("BLOB_GC_GRACE", "3600"))
+
+def blob_path(digest: str) -> str:
+    """Location of a blob in the sharded store"""
+    return os.path.join(BLOB_DIR, digest[:2], digest[2:4], digest)
+
+async def _hash_upload(file: UploadFile, max_size: int):
+    """SHA-256 and size of an upload already spooled by Starlette; rewinds it afterwards.
+    An UploadSpool already knows both."""
+    _check_declared_size(file, max_size)
+    spool = _spool(file)
+    if spool is not None:
+        if spool.size > max_size:
+            raise _too_large(max_size)
+        return spool.sha256, spool.size
+    hasher = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise _too_large(max_size)
+        await run_in_threadpool(hasher.update, chunk)
+    await file.seek(0)
+    return hasher.hexdigest(), size
+
+async def store_blob(file: UploadFile, max_size: int = MAX_FILE_SIZE) -> StoredUpload:
+    """Add an upload to the blob store, writing it only if its content is new.
+
+    The spooled upload is hashed first; a known blob just has its mtime
+    refreshed (so garbage collection gives the new reference its grace
+    period), otherwise the upload is moved (or copied) to its blob path.
+    """
+    digest, size = await _hash_upload(file, max_size)
+    path = blob_path(digest)
+    try:
+        await run_in_threadpool(os.utime, path)
+        return StoredUpload(path=path, sha256=digest, size=size, deduplicated=True)
+    except FileNotFoundError:
+        pass
+    await _place(file, path, max_size)
+    return StoredUpload(path=path, sha256=digest, size=size)
+
+def _old_blobs(grace: float) -> List[Tuple[str, str]]:
+    """(digest, path) of blobs not written or reused within grace seconds;
+    abandoned temporary files past the grace period are removed on the way"""
+    cutoff = time.time() - grace
+    blobs = []
+    for directory, _, files in itertools.chain(os.walk(BLOB_DIR), os.walk(INCOMING_DIR)):
+        for name in files:
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                if name.startswith(".incoming-"):
+                    os.remove(path)
+                else:
+                    blobs.append((name, path))
+            except FileNotFoundError:
+                continue
+    return blobs
+
+def _remove_if_old(path: str, cutoff: float) -> bool:
+    """Delete a blob unless it was reused since it was listed"""
+    try:
+        if os.path.getmtime(path) >= cutoff:
+            return False
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+async def collect_garbage(
+    referenced: Callable[[List[str]], Awaitable[Set[str]]],
+    remove_derivatives: Callable[[str], Awaitable[None]],
+    grace: float = BLOB_GC_GRACE,
+    batch_size: int = 500,
+) -> Dict[str, int]:
+    """Delete blobs that no image record references, with their derivatives.
+
+    referenced(digests) returns the subset still in use (the reference
+    count is the number of records with that content_hash).
+    """
+    started = time.time()
+    candidates = await run_in_threadpool(_old_blobs, grace)
+    deleted = freed = 0
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        in_use = await referenced([digest for digest, _ in batch])
+        for digest, path in batch:
+            if digest in in_use:
+                continue
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            if await run_in_threadpool(_remove_if_old, path, started - grace):
+                await remove_derivatives(digest)
+                deleted += 1
+                freed += size
+    return {"scanned": len(candidates), "deleted": deleted, "bytes_freed": freed}
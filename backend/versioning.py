@@ -0,0 +1,164 @@
+import os
+import re
+from datetime import datetime
+from difflib import SequenceMatcher
+from typing import Dict, Any, List, Optional
+import database
+
+# Report version history
+#
+# Every update stores a word-level delta against the previous version; every
+# SNAPSHOT_INTERVAL versions (starting at version 1) stores the full field
+# values instead. Rebuilding any version therefore reads one snapshot and at
+# most SNAPSHOT_INTERVAL - 1 deltas.
+
+SNAPSHOT_INTERVAL = int(os.getenv("REPORT_SNAPSHOT_INTERVAL", "10"))
+TEXT_FIELDS = ("findings", "impression", "review_notes")
+VALUE_FIELDS = ("status", "reviewed_by", "study_type")
+VERSIONED_FIELDS = TEXT_FIELDS + VALUE_FIELDS
+UPDATE_ATTEMPTS = 5
+
+_TOKEN = re.compile(r"\s+|[^\s]+")
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into alternating word and whitespace tokens"""
+    return _TOKEN.findall(text or "")
+
+def text_delta(old: Optional[str], new: Optional[str]) -> List[list]:
+    """Ops turning old into new: ["=", n] keep, ["-", n] drop, ["+", text] insert"""
+    a, b = tokenize(old), tokenize(new)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append(["=", i2 - i1])
+            continue
+        if tag in ("delete", "replace"):
+            ops.append(["-", i2 - i1])
+        if tag in ("insert", "replace"):
+            ops.append(["+", "".join(b[j1:j2])])
+    return ops
+
+def apply_text_delta(old: Optional[str], ops: List[list]) -> str:
+    tokens = tokenize(old)
+    position = 0
+    parts = []
+    for op, value in ops:
+        if op == "=":
+            parts.extend(tokens[position:position + value])
+            position += value
+        elif op == "-":
+            position += value
+        else:
+            parts.append(value)
+    return "".join(parts)
+
+def snapshot_fields(report: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: report.get(field) for field in VERSIONED_FIELDS}
+
+def is_snapshot_version(version: int) -> bool:
+    return (version - 1) % SNAPSHOT_INTERVAL == 0
+
+def build_delta(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+    """Per-field changes between two sets of field values"""
+    delta = {}
+    for field in VERSIONED_FIELDS:
+        if before.get(field) == after.get(field):
+            continue
+        if field in TEXT_FIELDS and after.get(field) is not None:
+            delta[field] = {"ops": text_delta(before.get(field), after.get(field))}
+        else:
+            delta[field] = {"value": after.get(field)}
+    return delta
+
+def apply_delta(fields: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    fields = dict(fields)
+    for field, change in delta.items():
+        if "ops" in change:
+            fields[field] = apply_text_delta(fields.get(field), change["ops"])
+        else:
+            fields[field] = change["value"]
+    return fields
+
+def version_entry(report_id: str, version: int, before: Optional[Dict[str, Any]],
+                  after: Dict[str, Any], user_id: Optional[str]) -> Dict[str, Any]:
+    """History record for one version; a snapshot or a delta against before"""
+    entry = {
+        "report_id": report_id,
+        "version": version,
+        "created_by": user_id,
+        "created_at": after.get("updated_at") or after.get("created_at") or datetime.utcnow(),
+    }
+    if before is None or is_snapshot_version(version):
+        entry["snapshot"] = snapshot_fields(after)
+        entry["changed"] = [field for field in VERSIONED_FIELDS
+                            if before is None or before.get(field) != after.get(field)]
+    else:
+        entry["delta"] = build_delta(snapshot_fields(before), snapshot_fields(after))
+        entry["changed"] = list(entry["delta"])
+    return entry
+
+async def record_initial_version(report_id: str, report: Dict[str, Any], user_id: Optional[str]):
+    """Store version 1 of a new report"""
+    await database.save_report_version(version_entry(report_id, report.get("version", 1), None, report, user_id))
+
+async def store_pending_version(report: Dict[str, Any]):
+    """Move a report's pending history entry (left by an interrupted update) into report_versions"""
+    entry = report.get("pending_version")
+    if entry:
+        await database.save_report_version(entry)
+        await database.clear_pending_version(str(report["_id"]), entry["version"])
+
+async def update_report(report_id: str, update_data: Dict[str, Any], user_id: str,
+                        expected_version: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Apply an update, bump the version and append its history entry.
+
+    The entry is computed from the current report and written together with
+    the version bump, conditional on the version read; a concurrent update in
+    between makes it start over. Returns the new version entry, or None if
+    the report does not exist (or is no longer at expected_version).
+    """
+    for _ in range(UPDATE_ATTEMPTS):
+        before = await database.get_report_by_id(report_id)
+        if before is None:
+            return None
+        await store_pending_version(before)
+        previous = before.get("version", 1)
+        if expected_version is not None and previous != expected_version:
+            return None
+        if previous == 1:
+            # Reports created before history existed have no stored version 1
+            await database.save_report_version(version_entry(report_id, 1, None, before, before.get("created_by")))
+        after = {**before, **update_data}
+        entry = version_entry(report_id, previous + 1, before, after, user_id)
+        if await database.update_report_versioned(report_id, update_data, previous, entry):
+            await database.save_report_version(entry)
+            await database.clear_pending_version(report_id, entry["version"])
+            return entry
+    raise RuntimeError("Report is being updated concurrently, please retry")
+
+async def get_version(report_id: str, version: int) -> Optional[Dict[str, Any]]:
+    """Rebuild a version's fields from its nearest snapshot"""
+    base = version - (version - 1) % SNAPSHOT_INTERVAL
+    entries = await database.get_report_versions_between(report_id, base, version)
+    if len(entries) != version - base + 1:
+        report = await database.get_report_by_id(report_id)
+        if report and report.get("pending_version"):
+            await store_pending_version(report)
+            entries = await database.get_report_versions_between(report_id, base, version)
+    if len(entries) != version - base + 1 or "snapshot" not in entries[0]:
+        return None
+    fields = dict(entries[0]["snapshot"])
+    for entry in entries[1:]:
+        fields = entry["snapshot"] if "snapshot" in entry else apply_delta(fields, entry.get("delta", {}))
+    last = entries[-1]
+    return {
+        "report_id": report_id,
+        "version": version,
+        "created_by": last.get("created_by"),
+        "created_at": last.get("created_at"),
+        "fields": fields,
+    }
+
+def diff_versions(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Field-level diff between two rebuilt versions"""
+    return build_delta(old["fields"], new["fields"])
@@ -39,10 +39,13 @@ api.interceptors.response.use(
 export const authAPI = {
   register: (userData) => api.post('/auth/register', userData),
   login: (credentials) => api.post('/auth/login', credentials),
+  logout: () => api.post('/auth/logout'),
 };
 
 export const patientsAPI = {
-  getAll: (skip = 0, limit = 100) => api.get(`/patients/?skip=${skip}&limit=${limit}`),
+  getAll: (limit = 100, cursor = null) => api.get('/patients/', { params: { limit, cursor } }),
+  dashboard: (limit = 50, cursor = null) => api.get('/patients/dashboard', { params: { limit, cursor } }),
+  search: (search, mode = 'prefix', filters = {}) => api.get('/patients/search', { params: { search, mode, ...filters } }),
   create: (patientData) => api.post('/patients/', patientData),
 };
 
@@ -53,12 +56,50 @@ export const imagesAPI = {
     },
   }),
   getByPatient: (patientId) => api.get(`/images/patient/${patientId}`),
+  collectBlobs: () => api.post('/images/blobs/gc'),
 };
 
 export const reportsAPI = {
   create: (reportData) => api.post('/reports/', reportData),
+  query: (filters = {}, limit = 50, cursor = null) => api.get('/reports/', { params: { ...filters, limit, cursor } }),
   getByPatient: (patientId) => api.get(`/reports/patient/${patientId}`),
   update: (reportId, updateData) => api.put(`/reports/${reportId}`, updateData),
+  autosave: (reportId, baseVersion, deltas, editorId = null) => api.patch(`/reports/${reportId}`, { base_version: baseVersion, deltas, editor_id: editorId }),
+  getVersions: (reportId) => api.get(`/reports/${reportId}/versions`),
+  getVersion: (reportId, version) => api.get(`/reports/${reportId}/versions/${version}`),
+  diff: (reportId, fromVersion, toVersion = null) => api.get(`/reports/${reportId}/diff`, { params: { from_version: fromVersion, to_version: toVersion } }),
+  // Streams a drafted report; onToken gets each text chunk as it arrives.
+  // Aborting the signal closes the stream and stops generation server-side.
+  generateStream: async (imageId, onToken, signal) => {
+    const response = await fetch(`${API_BASE_URL}/reports/generate/${imageId}/stream`, {
+      method: 'POST',
+      headers: { Authorization: `Bearer ${localStorage.getItem('token')}` },
+      signal,
+    });
+    if (!response.ok) {
+      throw new Error(`Report generation failed (${response.status})`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) {
+        throw new Error('Report stream ended unexpectedly');
+      }
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const block = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const event = block.match(/^event: (.*)$/m)?.[1];
+        const data = JSON.parse(block.match(/^data: (.*)$/m)?.[1] || '{}');
+        if (event === 'token') onToken(data.text);
+        if (event === 'error') throw new Error(data.message);
+        if (event === 'done') return data;
+      }
+    }
+  },
 };
 
 export const analysisAPI = {
@@ -67,6 +108,7 @@ export const analysisAPI = {
       'Content-Type': 'multipart/form-data',
     },
   }),
+  getJob: (jobId) => api.get(`/analyze/jobs/${jobId}`),
 };
 
 export const healthAPI = {
@@ -42,7 +42,12 @@ function App() {
     }
   };
 
-  const handleLogout = () => {
+  const handleLogout = async () => {
+    try {
+      await authAPI.logout();
+    } catch (err) {
+      // The token is dropped locally either way
+    }
     localStorage.removeItem('token');
     localStorage.removeItem('user');
     setUser(null);
@@ -1,6 +1,9 @@
 import React, { useState } from 'react';
 import { analysisAPI } from '../Api.js';
 
+const ANALYSIS_POLL_INTERVAL_MS = 1000;
+const ANALYSIS_POLL_TIMEOUT_MS = 5 * 60 * 1000;
+
 const ImageAnalysis = ({ user }) => {
   const [selectedFile, setSelectedFile] = useState(null);
   const [preview, setPreview] = useState(null);
@@ -35,7 +38,21 @@ const ImageAnalysis = ({ user }) => {
       const response = await analysisAPI.analyze(formData);
       
       if (response.data.success) {
-        setAnalysisResult(response.data.data.analysis);
+        // Analysis runs as a background job; poll until it finishes or we give up
+        const jobId = response.data.data.job_id;
+        let job = response.data.data;
+        const deadline = Date.now() + ANALYSIS_POLL_TIMEOUT_MS;
+        while ((job.status === 'queued' || job.status === 'running') && Date.now() < deadline) {
+          await new Promise((resolve) => setTimeout(resolve, ANALYSIS_POLL_INTERVAL_MS));
+          job = (await analysisAPI.getJob(jobId)).data.data;
+        }
+        if (job.status === 'completed') {
+          setAnalysisResult(job.result);
+        } else if (job.status === 'failed') {
+          setAnalysisResult('Analysis failed. Please try again.');
+        } else {
+          setAnalysisResult('Analysis is taking longer than expected. Please try again later.');
+        }
       } else {
         setAnalysisResult('Analysis failed. Please try again.');
       }